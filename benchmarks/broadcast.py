@@ -0,0 +1,119 @@
+"""
+Microbenchmark of the CPU cost of broadcasting a message to N subscribers.
+
+Compares Tornado's own `write_message`, which encodes and frames a message
+once per subscriber, with writing the shared frame of a BroadcastMessage as
+the registries do, i.e. only if there are more than one subscriber.
+
+Run from the root of the repository with ``python -m benchmarks.broadcast``.
+
+"""
+
+import json
+import time
+import argparse
+from functools import partial
+
+from tornado.websocket import WebSocketProtocol13
+
+from tailsocket.application import TailWebSocketHandler
+from tailsocket.broadcast import BroadcastMessage
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--subscribers', type=int, nargs='+', default=[1, 10, 100, 500],
+    help='Subscriber counts to measure')
+parser.add_argument(
+    '--sizes', type=int, nargs='+', default=[100, 4096],
+    help='Message sizes in bytes to measure')
+parser.add_argument(
+    '--messages', type=int, default=200,
+    help='Messages to send for each measurement')
+parser.add_argument(
+    '--json', default=False, action='store_true',
+    help='Output the results as JSON')
+
+
+class NullStream():
+    """Stream counting and discarding everything written to it.
+
+    """
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+    def closed(self):
+        return False
+
+    def writing(self):
+        return False
+
+
+def make_handlers(count):
+    """Creates websocket handlers writing to null streams, bypassing the
+    HTTP handshake.
+
+    """
+    handlers = []
+    for _ in range(count):
+        handler = TailWebSocketHandler.__new__(TailWebSocketHandler)
+        handler.request = None
+        handler.stream = NullStream()
+        handler.ws_connection = WebSocketProtocol13(handler)
+        handler.send_queue = handler.create_send_queue()
+        handler.binary_protocol = False
+        handler.announced_files = set()
+        handlers.append(handler)
+    return handlers
+
+
+def measure(handlers, message_class, text, messages):
+    """Returns the CPU seconds spent per message sent to all the handlers.
+
+    """
+    start = time.process_time()
+    for _ in range(messages):
+        message = message_class(text)
+        for handler in handlers:
+            handler.write_message(message)
+    return (time.process_time() - start) / messages
+
+
+def run(subscribers, sizes, messages):
+    results = []
+    for size in sizes:
+        text = ('x' * 79 + '\n') * (size // 80) + 'x' * (size % 80)
+        for count in subscribers:
+            handlers = make_handlers(count)
+            per_subscriber = measure(handlers, str, text, messages)
+            shared = measure(
+                handlers, partial(BroadcastMessage, shared=count > 1), text,
+                messages)
+            results.append({
+                'size': size,
+                'subscribers': count,
+                'per_subscriber_us': per_subscriber * 1e6,
+                'shared_frame_us': shared * 1e6,
+            })
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    results = run(args.subscribers, args.sizes, args.messages)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:>8} {:>12} {:>22} {:>20}'.format(
+        'size', 'subscribers', 'per subscriber us/msg', 'shared frame us/msg'))
+    for result in results:
+        print('{size:>8} {subscribers:>12} {per_subscriber_us:>22.1f} '
+              '{shared_frame_us:>20.1f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
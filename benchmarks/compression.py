@@ -0,0 +1,133 @@
+"""
+Benchmark of the websocket compression modes when broadcasting log lines.
+
+Measures the bytes written to the wire and the CPU time per message sent to
+N subscribers without compression, compressing every message for every
+connection as Tornado does, and compressing broadcast messages once for all
+the connections.
+
+Run from the root of the repository with ``python -m benchmarks.compression``.
+
+"""
+
+import json
+import time
+import random
+import argparse
+
+from tornado import options, websocket
+
+from tailsocket import application
+from tailsocket.broadcast import BroadcastMessage
+from benchmarks.broadcast import make_handlers
+
+MODES = (
+    application.COMPRESSION_NONE,
+    application.COMPRESSION_PER_CONNECTION,
+    application.COMPRESSION_SHARED,
+)
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--subscribers', type=int, nargs='+', default=[1, 10, 100],
+    help='Subscriber counts to measure')
+parser.add_argument(
+    '--lines', type=int, nargs='+', default=[1, 20, 200],
+    help='Lines per message to measure')
+parser.add_argument(
+    '--messages', type=int, default=200,
+    help='Messages to send for each measurement')
+parser.add_argument(
+    '--json', default=False, action='store_true',
+    help='Output the results as JSON')
+
+
+def make_log_lines(count, seed=0):
+    """Returns access log like lines, random enough not to compress better
+    than real logs.
+
+    """
+    rng = random.Random(seed)
+    paths = ['/', '/api/users', '/api/orders', '/static/app.js', '/login']
+    return [
+        '10.0.{}.{} - - [17/Oct/2016:13:{:02d}:{:02d} +0000] "GET {}?id={} '
+        'HTTP/1.1" {} {} "-" "Mozilla/5.0"'.format(
+            rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 59),
+            rng.randint(0, 59), rng.choice(paths), rng.randint(0, 10 ** 6),
+            rng.choice([200, 200, 200, 304, 404, 500]),
+            rng.randint(100, 50000))
+        for _ in range(count)
+    ]
+
+
+def make_compressed_handlers(count, mode):
+    """Creates handlers as if permessage-deflate had been agreed with every
+    client.
+
+    """
+    options.options.compression = mode
+    handlers = make_handlers(count)
+    if mode != application.COMPRESSION_NONE:
+        for handler in handlers:
+            handler.ws_connection._compressor = (
+                websocket._PerMessageDeflateCompressor(
+                    persistent=True, max_wbits=None))
+            if handler.uses_shared_compression():
+                handler.disable_context_takeover()
+    return handlers
+
+
+def measure(handlers, texts):
+    """Returns the CPU seconds spent and bytes written per message sent to
+    all the handlers.
+
+    """
+    start = time.process_time()
+    for text in texts:
+        message = BroadcastMessage(text)
+        for handler in handlers:
+            handler.write_message(message)
+    elapsed = time.process_time() - start
+    written = sum(handler.stream.written for handler in handlers)
+    return elapsed / len(texts), written / len(texts)
+
+
+def run(subscribers, lines, messages):
+    results = []
+    for line_count in lines:
+        log_lines = make_log_lines(line_count * messages)
+        texts = [
+            '\n'.join(log_lines[i:i + line_count])
+            for i in range(0, len(log_lines), line_count)]
+        payload_bytes = sum(len(text.encode()) for text in texts) / messages
+        for count in subscribers:
+            for mode in MODES:
+                handlers = make_compressed_handlers(count, mode)
+                cpu, written = measure(handlers, texts)
+                results.append({
+                    'lines': line_count,
+                    'subscribers': count,
+                    'mode': mode,
+                    'cpu_us': cpu * 1e6,
+                    'wire_bytes': written,
+                    'ratio': payload_bytes * count / written,
+                })
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    results = run(args.subscribers, args.lines, args.messages)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:>6} {:>12} {:>15} {:>12} {:>14} {:>7}'.format(
+        'lines', 'subscribers', 'mode', 'us/msg', 'wire bytes/msg', 'ratio'))
+    for result in results:
+        print('{lines:>6} {subscribers:>12} {mode:>15} {cpu_us:>12.1f} '
+              '{wire_bytes:>14.0f} {ratio:>7.2f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
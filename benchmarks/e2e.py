@@ -0,0 +1,370 @@
+"""
+End to end benchmark of the throughput and latency of the server.
+
+Starts a tailsocket server in a subprocess for each registry, connects
+websocket clients to it and appends the lines of the load generator of
+`mock_log` to the files they tail at a fixed rate. Measures the lines
+received per second, the lines lost or duplicated, the latency from writing
+a line to a client receiving it and the CPU time and peak memory of the
+server.
+
+The loop registry runs with the select policy, the notify registry, only
+available on Linux, and the poll registry with the default one. Results may
+be saved with ``--output`` and compared with a previous run, e.g. of another
+commit, with ``--baseline``.
+
+Run from the root of the repository with ``python -m benchmarks.e2e``.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import platform
+import subprocess
+
+from tornado import gen, websocket
+from tornado.ioloop import IOLoop
+
+import mock_log
+from tailsocket.reader_registries import (
+    REGISTRY_LOOP, REGISTRY_NOTIFY, REGISTRY_POLL)
+
+POLICIES = {
+    REGISTRY_LOOP: 'select',
+    REGISTRY_NOTIFY: 'default',
+    REGISTRY_POLL: 'default',
+}
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--registries', nargs='+', choices=sorted(POLICIES),
+    default=sorted(POLICIES) if sys.platform == 'linux' else [
+        REGISTRY_LOOP, REGISTRY_POLL],
+    help='Registries to measure')
+parser.add_argument(
+    '--files', type=int, default=1,
+    help='Files to write to, clients are spread over them')
+parser.add_argument(
+    '--clients', type=int, default=10,
+    help='Websocket clients to connect')
+parser.add_argument(
+    '--rate', type=int, default=1000,
+    help='Lines per second written to each file')
+parser.add_argument(
+    '--line-size', type=int, default=120,
+    help='Bytes per line written')
+parser.add_argument(
+    '--duration', type=float, default=10,
+    help='Seconds to write lines for')
+parser.add_argument(
+    '--drain', type=float, default=1,
+    help='Seconds to wait for the last lines after writing')
+parser.add_argument(
+    '--json', default=False, action='store_true',
+    help='Output the results as JSON')
+parser.add_argument(
+    '--output',
+    help='Save the results as JSON to a file')
+parser.add_argument(
+    '--baseline',
+    help='Compare the results with the ones saved to a file')
+
+# Interval between writes, every write appends the lines due since the last
+WRITE_INTERVAL = 0.01
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def get_commit():
+    """Returns the commit of the working tree, if in a git repository.
+
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, fraction):
+    """Returns the value at a fraction of the sorted values.
+
+    """
+    if not values:
+        return None
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+class Server():
+    """A tailsocket server running in a subprocess.
+
+    Args:
+        registry (str): The registry type of the server.
+        directory (str): Directory of the log files of the server.
+
+    """
+
+    def __init__(self, registry, directory):
+        self.port = get_free_port()
+        self.started = time.time()
+        self.process = subprocess.Popen([
+            sys.executable, '-m', 'tailsocket.application',
+            '--ip=127.0.0.1',
+            '--port={}'.format(self.port),
+            '--registry={}'.format(registry),
+            '--policy={}'.format(POLICIES[registry]),
+            '--debug=False',
+            '--logging=warning',
+            '--access_log_file_path={}'.format(
+                os.path.join(directory, 'access.log')),
+            '--application_log_file_path={}'.format(
+                os.path.join(directory, 'application.log')),
+        ], stdout=subprocess.DEVNULL)
+
+    def wait_until_listening(self, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('The server exited with {}'.format(
+                    self.process.returncode))
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError('The server did not start listening')
+
+    def stop(self):
+        """Terminates the server.
+
+        Returns:
+            dict: The CPU seconds used by the server, as a percentage of its
+                lifetime too, and its peak memory in MB.
+
+        """
+        self.process.terminate()
+        _, _, usage = os.wait4(self.process.pid, 0)
+        self.process.returncode = 0
+        cpu_seconds = usage.ru_utime + usage.ru_stime
+        # Linux reports the maximum resident set size in KB, macOS in bytes
+        max_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return {
+            'cpu_seconds': cpu_seconds,
+            'cpu_percent': 100 * cpu_seconds / (time.time() - self.started),
+            'max_rss_mb': max_rss / 2 ** 20,
+        }
+
+
+class Client():
+    """Websocket client tailing a file, measuring the latency of the lines
+    written by `Writer` and counting the lines lost or duplicated.
+
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.latencies = []
+        self.sequences = mock_log.SequenceTracker()
+
+    @gen.coroutine
+    def connect(self, port, name, path):
+        self.connection = yield websocket.websocket_connect(
+            'ws://127.0.0.1:{}/websocket/{}'.format(port, name))
+        self.connection.write_message(path)
+        # The initial lines, or lack thereof, of the file
+        yield self.connection.read_message()
+
+    @gen.coroutine
+    def run(self):
+        while True:
+            message = yield self.connection.read_message()
+            if message is None:
+                return
+            received = time.time()
+            for line in message.split('\n'):
+                parsed = mock_log.parse_line(line)
+                if parsed is None:
+                    continue
+                written, sequence = parsed
+                self.latencies.append(received - written)
+                self.sequences.track(sequence)
+
+    def close(self):
+        self.connection.close()
+
+
+class Writer():
+    """Appends the lines of the load generator to a file at a fixed rate.
+
+    """
+
+    def __init__(self, path, rate, line_size):
+        self.rate = rate
+        self.log_file = mock_log.LogFile(path)
+        self.generator = mock_log.LineGenerator(line_size)
+
+    @property
+    def written(self):
+        return self.log_file.sequence
+
+    @gen.coroutine
+    def run(self, duration):
+        start = time.time()
+        try:
+            while True:
+                now = time.time()
+                if now - start >= duration:
+                    return
+                due = int(self.rate * (now - start)) - self.written
+                lines = []
+                for sequence in range(self.written, self.written + due):
+                    lines.append(self.generator.make_line(sequence, now))
+                self.log_file.sequence += due
+                self.log_file.write(lines)
+                yield gen.sleep(WRITE_INTERVAL)
+        finally:
+            self.log_file.close()
+
+
+@gen.coroutine
+def measure(port, paths, args):
+    """Connects the clients, writes the lines and returns the results of the
+    clients and writers.
+
+    """
+    clients = []
+    for i in range(args.clients):
+        client = Client()
+        yield client.connect(
+            port, 'bench-{}'.format(i), paths[i % len(paths)])
+        clients.append(client)
+
+    runs = [client.run() for client in clients]
+    writers = [Writer(path, args.rate, args.line_size) for path in paths]
+    yield [writer.run(args.duration) for writer in writers]
+    yield gen.sleep(args.drain)
+    for client in clients:
+        client.close()
+    yield runs
+
+    expected = 0
+    for i, client in enumerate(clients):
+        written = writers[i % len(paths)].written
+        client.sequences.finish(written)
+        expected += written
+    latencies = sorted(
+        latency for client in clients for latency in client.latencies)
+    return {
+        'lines_written': sum(writer.written for writer in writers),
+        'lines_received': len(latencies),
+        'delivery_ratio': len(latencies) / expected if expected else None,
+        'lines_lost': sum(client.sequences.lost for client in clients),
+        'lines_duplicated': sum(
+            client.sequences.duplicated for client in clients),
+        'lines_received_per_sec': len(latencies) / args.duration,
+        'latency_p50_ms': (percentile(latencies, 0.5) or 0) * 1000,
+        'latency_p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+        'latency_max_ms': (latencies[-1] if latencies else 0) * 1000,
+    }
+
+
+def run_registry(registry, args):
+    directory = tempfile.mkdtemp(prefix='tailsocket-bench-')
+    try:
+        paths = []
+        for i in range(args.files):
+            paths.append(os.path.join(directory, 'file-{}.log'.format(i)))
+            open(paths[-1], 'w').close()
+
+        server = Server(registry, directory)
+        try:
+            server.wait_until_listening()
+            result = IOLoop.current().run_sync(
+                lambda: measure(server.port, paths, args))
+        finally:
+            usage = server.stop()
+    finally:
+        shutil.rmtree(directory)
+
+    result.update(usage)
+    result['registry'] = registry
+    return result
+
+
+def run(args):
+    return {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': sys.platform,
+        'parameters': {
+            'files': args.files,
+            'clients': args.clients,
+            'rate': args.rate,
+            'line_size': args.line_size,
+            'duration': args.duration,
+        },
+        'results': [
+            run_registry(registry, args) for registry in args.registries],
+    }
+
+
+def compare(results, baseline):
+    """Prints the change of the main figures from a previous run.
+
+    """
+    previous = {
+        result['registry']: result for result in baseline['results']}
+    print('\nChange from {} ({})'.format(
+        baseline.get('commit'), baseline.get('parameters')))
+    for result in results['results']:
+        before = previous.get(result['registry'])
+        if before is None:
+            continue
+        changes = []
+        for key in ('lines_received_per_sec', 'latency_p50_ms',
+                    'latency_p99_ms', 'cpu_seconds', 'max_rss_mb'):
+            if before[key]:
+                changes.append('{} {:+.1f}%'.format(
+                    key, 100 * (result[key] - before[key]) / before[key]))
+        print('{:>8}: {}'.format(result['registry'], ', '.join(changes)))
+
+
+def main():
+    args = parser.parse_args()
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print('{:>8} {:>12} {:>10} {:>6} {:>6} {:>10} {:>10} {:>8} {:>8}'
+              .format('registry', 'lines/s', 'delivered', 'lost', 'dup',
+                      'p50 ms', 'p99 ms', 'cpu %', 'rss MB'))
+        for result in results['results']:
+            print('{registry:>8} {lines_received_per_sec:>12.0f} '
+                  '{delivery_ratio:>10.3f} {lines_lost:>6} '
+                  '{lines_duplicated:>6} {latency_p50_ms:>10.2f} '
+                  '{latency_p99_ms:>10.2f} {cpu_percent:>8.1f} '
+                  '{max_rss_mb:>8.1f}'.format(**result))
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            compare(results, json.load(fd))
+
+
+if __name__ == '__main__':
+    main()
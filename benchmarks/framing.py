@@ -0,0 +1,102 @@
+"""
+Benchmark of the cost and size of the message framings.
+
+Compares plain text frames, text frames carrying the same metadata as the
+binary protocol in a JSON object and binary protocol frames, encoding each
+batch of lines once as broadcast messages do.
+
+Run from the root of the repository with ``python -m benchmarks.framing``.
+
+"""
+
+import json
+import time
+import argparse
+
+from tornado.escape import json_encode
+
+from tailsocket.broadcast import BroadcastMessage
+from benchmarks.compression import make_log_lines
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--lines', type=int, nargs='+', default=[1, 20, 200],
+    help='Lines per message to measure')
+parser.add_argument(
+    '--messages', type=int, default=1000,
+    help='Messages to encode for each measurement')
+parser.add_argument(
+    '--json', default=False, action='store_true',
+    help='Output the results as JSON')
+
+
+def text_frame(text, file_id, offset):
+    return BroadcastMessage(text).frame
+
+
+def json_frame(text, file_id, offset):
+    return BroadcastMessage(json_encode({
+        'type': 'lines', 'file': file_id, 'offset': offset,
+        'lines': text.count('\n') + 1, 'data': text})).frame
+
+
+def binary_frame(text, file_id, offset):
+    return BroadcastMessage(
+        text, file_id=file_id, offset=offset).get_frame(binary=True)
+
+
+FRAMINGS = (
+    ('text', text_frame),
+    ('json', json_frame),
+    ('binary', binary_frame),
+)
+
+
+def measure(encode, texts):
+    """Returns the CPU seconds spent and bytes produced per message.
+
+    """
+    size = 0
+    offset = 0
+    start = time.process_time()
+    for text in texts:
+        offset += len(text) + 1
+        size += len(encode(text, 1, offset))
+    elapsed = time.process_time() - start
+    return elapsed / len(texts), size / len(texts)
+
+
+def run(lines, messages):
+    results = []
+    for line_count in lines:
+        log_lines = make_log_lines(line_count * messages)
+        texts = [
+            '\n'.join(log_lines[i:i + line_count])
+            for i in range(0, len(log_lines), line_count)]
+        for name, encode in FRAMINGS:
+            cpu, size = measure(encode, texts)
+            results.append({
+                'lines': line_count,
+                'framing': name,
+                'encode_us': cpu * 1e6,
+                'bytes': size,
+            })
+    return results
+
+
+def main():
+    args = parser.parse_args()
+    results = run(args.lines, args.messages)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:>6} {:>8} {:>10} {:>10}'.format(
+        'lines', 'framing', 'us/msg', 'bytes/msg'))
+    for result in results:
+        print('{lines:>6} {framing:>8} {encode_us:>10.2f} '
+              '{bytes:>10.0f}'.format(**result))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,342 @@
 """
-Utility to write a to a file periodically with options for rollover.
+Load generator writing log lines to files at a target rate, with options for
+bursts and rotation.
+
+Every line starts with the time it was written and its sequence number in
+the file, e.g. ``1476711000.123456 42 Lorem ipsum...``, so the receiving
+side can measure the latency and detect lost or duplicated lines, see
+`parse_line` and `SequenceTracker`. Sequence numbers carry on across
+rotations.
+
+Examples::
+
+    # One line per second, as a tail to watch
+    python mock_log.py test.log --clean
+
+    # 2 MB/s of variable size lines to 10 files, rotated every 100k lines
+    python mock_log.py /tmp/logs/{0..9}.log --mbps 2 \\
+        --distribution exponential --rollover 100000 --rollover-mode rename
 
 """
 import os
+import sys
 import time
+import random
+import shutil
 import argparse
-from datetime import datetime
 
-from loremipsum import generate_sentence
+ROTATION_TRUNCATE = 'truncate'
+ROTATION_RENAME = 'rename'
+ROTATION_COPYTRUNCATE = 'copytruncate'
+ROTATION_DELETE = 'delete'
+ROTATIONS = (
+    ROTATION_TRUNCATE, ROTATION_RENAME, ROTATION_COPYTRUNCATE,
+    ROTATION_DELETE)
 
-parser = argparse.ArgumentParser(description=__doc__)
-parser.add_argument('file_path', type=str, help='Path to file to write to')
+DISTRIBUTION_FIXED = 'fixed'
+DISTRIBUTION_UNIFORM = 'uniform'
+DISTRIBUTION_EXPONENTIAL = 'exponential'
+DISTRIBUTIONS = (
+    DISTRIBUTION_FIXED, DISTRIBUTION_UNIFORM, DISTRIBUTION_EXPONENTIAL)
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+    'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam '
+    'quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat').split()
+MULTIBYTE_WORDS = (
+    'ñandú', 'café', 'straße', 'żółw', 'δοκιμή', 'проверка', 'テスト',
+    '日志', '로그', '🙂', '🚀')
+
+# Seconds between writes, every write appends the lines due since the last
+WRITE_INTERVAL = 0.01
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument(
+    'file_paths', type=str, nargs='+', help='Paths to files to write to')
 parser.add_argument(
     '--clean', help='Remove contents first', default=False,
     action="store_true")
 parser.add_argument(
-    '--rollover', type=int, help='Reset the file after N lines', default=0)
-args = parser.parse_args()
+    '--rate', type=float, default=1,
+    help='Lines per second written to each file')
+parser.add_argument(
+    '--mbps', type=float, default=None,
+    help='MB per second written to each file, instead of --rate')
+parser.add_argument(
+    '--line-size', type=int, default=80,
+    help='Mean size of the lines in bytes')
+parser.add_argument(
+    '--max-line-size', type=int, default=64 * 1024,
+    help='Maximum size of the lines in bytes')
+parser.add_argument(
+    '--distribution', choices=DISTRIBUTIONS, default=DISTRIBUTION_FIXED,
+    help='Distribution of the line sizes around the mean, uniform sizes '
+    'range from half to one and a half times the mean')
+parser.add_argument(
+    '--multibyte', type=float, default=0,
+    help='Fraction of the words with multi-byte UTF-8 characters')
+parser.add_argument(
+    '--burst-factor', type=float, default=1,
+    help='Multiplier of the rate during bursts')
+parser.add_argument(
+    '--burst-every', type=float, default=0,
+    help='Seconds between the start of bursts, 0 disables them')
+parser.add_argument(
+    '--burst-for', type=float, default=1,
+    help='Seconds each burst lasts')
+parser.add_argument(
+    '--rollover', type=int, default=0,
+    help='Rotate the files after N lines')
+parser.add_argument(
+    '--rollover-mode', choices=ROTATIONS, default=ROTATION_TRUNCATE,
+    help='How files are rotated: truncating them, renaming them to '
+    '<path>.1 and creating them again, copying them to <path>.1 and '
+    'truncating them, or deleting them and creating them again')
+parser.add_argument(
+    '--duration', type=float, default=0,
+    help='Seconds to write for, by default until interrupted')
+parser.add_argument(
+    '--seed', type=int, default=None,
+    help='Seed of the random line sizes and contents')
+
+
+def format_line(timestamp, sequence, text):
+    return '{:.6f} {} {}\n'.format(timestamp, sequence, text)
+
+
+def parse_line(line):
+    """Returns the time a line was written and its sequence number.
+
+    Returns:
+        tuple: The timestamp and sequence number, or None if the line was
+            not written by the load generator.
+
+    """
+    parts = line.split(' ', 2)
+    if len(parts) < 2:
+        return None
+    try:
+        return float(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+
+class SequenceTracker():
+    """Counts the lines lost or duplicated by the receiving side of a file
+    from their sequence numbers.
+
+    """
+
+    def __init__(self):
+        self.last = -1
+        self.received = 0
+        self.lost = 0
+        self.duplicated = 0
+
+    def track(self, sequence):
+        self.received += 1
+        if sequence <= self.last:
+            self.duplicated += 1
+            return
+        self.lost += sequence - self.last - 1
+        self.last = sequence
+
+    def finish(self, written):
+        """Counts the lines written after the last one received as lost.
+
+        Args:
+            written (int): Number of lines written to the file.
+
+        """
+        self.lost += max(0, written - 1 - self.last)
+        self.last = max(self.last, written - 1)
+
+
+class LineGenerator():
+    """Generates the text of the lines, of sizes following a distribution.
+
+    Args:
+        size (int): Mean size of the lines in bytes, including the timestamp,
+            sequence number and newline.
+        distribution (Optional[str]): Distribution of the line sizes.
+        multibyte (Optional[float]): Fraction of multi-byte words.
+        max_size (Optional[int]): Maximum size of the lines in bytes.
+        rng (Optional[random.Random]): Source of randomness.
+
+    """
+
+    def __init__(
+            self, size, distribution=DISTRIBUTION_FIXED, multibyte=0,
+            max_size=64 * 1024, rng=None):
+        self.size = size
+        self.distribution = distribution
+        self.multibyte = multibyte
+        self.max_size = max_size
+        self.rng = rng or random.Random()
+
+    def get_size(self):
+        if self.distribution == DISTRIBUTION_UNIFORM:
+            size = self.rng.uniform(self.size / 2, self.size * 1.5)
+        elif self.distribution == DISTRIBUTION_EXPONENTIAL:
+            size = self.rng.expovariate(1 / self.size)
+        else:
+            size = self.size
+        return max(1, min(int(size), self.max_size))
+
+    def get_text(self, size):
+        """Returns words adding up to at most `size` bytes of UTF-8.
+
+        """
+        words = []
+        length = -1
+        while length < size:
+            if self.multibyte and self.rng.random() < self.multibyte:
+                word = self.rng.choice(MULTIBYTE_WORDS)
+            else:
+                word = self.rng.choice(WORDS)
+            words.append(word)
+            length += len(word.encode('utf-8')) + 1
+        text = ' '.join(words).encode('utf-8')[:size]
+        # Don't split a multi-byte character
+        return text.decode('utf-8', 'ignore')
+
+    def make_line(self, sequence, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        prefix = format_line(timestamp, sequence, '')
+        return prefix[:-1] + self.get_text(
+            self.get_size() - len(prefix)) + '\n'
+
+
+class LogFile():
+    """A file written to by the load generator, rotated every `rollover`
+    lines.
+
+    Args:
+        path (str): Path of the file.
+        rollover (Optional[int]): Lines after which the file is rotated, 0
+            never rotates it.
+        rollover_mode (Optional[str]): How the file is rotated.
+
+    """
+
+    def __init__(self, path, rollover=0, rollover_mode=ROTATION_TRUNCATE):
+        self.path = path
+        self.rollover = rollover
+        self.rollover_mode = rollover_mode
+        self.sequence = 0
+        self.bytes_written = 0
+        self.lines_since_rotation = 0
+        self.fd = open(path, 'a', encoding='utf-8')
+
+    def write(self, lines):
+        """Writes lines made by a line generator, rotating the file when due.
+
+        Args:
+            lines (list): The lines.
+
+        """
+        for line in lines:
+            if self.rollover and self.lines_since_rotation >= self.rollover:
+                self.rotate()
+            self.fd.write(line)
+            self.bytes_written += len(line.encode('utf-8'))
+            self.lines_since_rotation += 1
+        self.fd.flush()
+
+    def rotate(self):
+        self.fd.flush()
+        if self.rollover_mode == ROTATION_RENAME:
+            self.fd.close()
+            os.replace(self.path, self.path + '.1')
+            self.fd = open(self.path, 'a', encoding='utf-8')
+        elif self.rollover_mode == ROTATION_COPYTRUNCATE:
+            shutil.copyfile(self.path, self.path + '.1')
+            self.fd.truncate(0)
+        elif self.rollover_mode == ROTATION_DELETE:
+            self.fd.close()
+            os.remove(self.path)
+            self.fd = open(self.path, 'a', encoding='utf-8')
+        else:
+            self.fd.truncate(0)
+        self.lines_since_rotation = 0
+
+    def close(self):
+        self.fd.close()
+
+
+def get_burst_factor(elapsed, every, duration, factor):
+    """Returns the multiplier of the rate at some point of the run.
+
+    """
+    if every and elapsed % every < duration:
+        return factor
+    return 1
+
 
+def run(args):
+    rng = random.Random(args.seed)
+    generator = LineGenerator(
+        args.line_size, distribution=args.distribution,
+        multibyte=args.multibyte, max_size=args.max_line_size, rng=rng)
+    files = [
+        LogFile(path, args.rollover, args.rollover_mode)
+        for path in args.file_paths]
 
-def reset_log():
-    fd = open(args.file_path, 'w')
-    fd.close()
+    # Lines or bytes due to each file, accumulated tick by tick
+    due = 0
+    start = last = time.time()
+    try:
+        while not args.duration or last - start < args.duration:
+            time.sleep(WRITE_INTERVAL)
+            now = time.time()
+            factor = get_burst_factor(
+                now - start, args.burst_every, args.burst_for,
+                args.burst_factor)
+            if args.mbps:
+                due += args.mbps * 2 ** 20 * factor * (now - last)
+            else:
+                due += args.rate * factor * (now - last)
+            last = now
 
+            # Whole lines are written, the rest of the bytes or lines due
+            # carry over to the next write
+            written = 0
+            for log_file in files:
+                lines = []
+                size = 0
+                while (size < due) if args.mbps else (len(lines) < int(due)):
+                    lines.append(generator.make_line(
+                        log_file.sequence, timestamp=now))
+                    log_file.sequence += 1
+                    size += len(lines[-1].encode('utf-8'))
+                log_file.write(lines)
+                written = size if args.mbps else len(lines)
+            due -= written
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for log_file in files:
+            log_file.close()
 
-def log():
-    fd = open(args.file_path, 'a')
-    print("{}: {}".format(
-        datetime.now(), generate_sentence()[2]), file=fd)
-    fd.close()
-    time.sleep(1)
+    elapsed = time.time() - start
+    for log_file in files:
+        print('{}: {} lines, {:.1f} MB in {:.1f}s'.format(
+            log_file.path, log_file.sequence,
+            log_file.bytes_written / 2 ** 20, elapsed), file=sys.stderr)
 
 
-if args.clean:
-    reset_log()
-else:
-    if not os.path.exists(args.file_path):
-        print("File does not exists, alternatively use --clean to create it.")
+def main():
+    args = parser.parse_args()
+    for path in args.file_paths:
+        if args.clean:
+            open(path, 'w').close()
+        elif not os.path.exists(path):
+            print("File {} does not exist, it will be created, "
+                  "alternatively use --clean.".format(path))
+    run(args)
 
-count = 1
-while True:
-    if args.rollover and count > args.rollover:
-        print("Rolling over after {} lines".format(args.rollover))
-        reset_log()
-        count = 1
 
-    log()
-    count += 1
+if __name__ == '__main__':
+    main()
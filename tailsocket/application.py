@@ -5,19 +5,61 @@ Starts up the Tornado application, defines logging, routing and handlers.
 
 """
 import os
+import signal
 import asyncio
 import logging
+import tempfile
 import selectors
+from functools import partial
 
-from tornado import options, websocket
+from tornado import escape, gen, netutil, options, websocket
+from tornado.concurrent import is_future
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 from tornado.platform.asyncio import AsyncIOMainLoop
-from tornado.web import RequestHandler, Application, url
-
-from tailsocket.reader_registries import get_registry
+from tornado.web import HTTPError, RequestHandler, Application, url
+
+from tailsocket import binary_protocol, metrics, profiling
+from tailsocket.archives import normalize_cursor
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.channels import (
+    Channel, ChannelGroup, ChannelMessage, format_channel_message)
+from tailsocket.filters import LineFilter
+from tailsocket.glob_reader import is_glob
+from tailsocket.reader_registries import REGISTRY_AUTO, get_registry
+from tailsocket.reader_registries.remote_reader_registry import (
+    RemoteReaderRegistry)
+from tailsocket.reader_registries.upstream_reader_registry import (
+    UpstreamReaderRegistry)
+from tailsocket.send_queue import (
+    SendQueue, POLICIES, SKIP_MARKER, SKIPPED_LINES_MARKER, count_lines,
+    get_message_size)
+from tailsocket.tailer import TailerServer
 from tailsocket.log import setup_logging
 
 logger = logging.getLogger('tornado.application')
 
+COMPRESSION_NONE = 'none'
+COMPRESSION_PER_CONNECTION = 'per_connection'
+COMPRESSION_SHARED = 'shared'
+COMPRESSIONS = (
+    COMPRESSION_NONE, COMPRESSION_PER_CONNECTION, COMPRESSION_SHARED)
+
+
+def check_compression(compression):
+    """Rejects unknown values of the `compression` option when parsed.
+
+    Raises:
+        tornado.options.Error: If the compression is not one of
+            `COMPRESSIONS`.
+
+    """
+    if compression not in COMPRESSIONS:
+        raise options.Error('Unknown compression {!r}, choices are {}'.format(
+            compression, ', '.join("'{}'".format(c) for c in COMPRESSIONS)))
+
+
 options.define(
     "ip", default='0.0.0.0',
     help="IP address to attach the server to", type=str)
@@ -27,6 +69,11 @@ options.define(
 options.define(
     "policy", default='default',
     help="IOLoop policy to use, choices are 'default' or 'select'.",)
+options.define(
+    "registry", default=REGISTRY_AUTO,
+    help="Registry reading the files, choices are 'auto' for the "
+    "platform's default, 'loop', 'notify' (Linux only) or 'poll' for "
+    "filesystems where the others don't work.",)
 options.define(
     "ws_host_port", default=os.environ.get('WS_HOST_PORT', None),
     help="Port number to run the server on", type=str)
@@ -36,6 +83,67 @@ options.define(
 options.define(
     "webpackdevserver", default=None,
     help="Optional route to the Webpack dev server assets", type=str)
+options.define(
+    "coalesce_window_ms", default=0,
+    help="Milliseconds to collect new content of busy files into a single "
+    "message, 0 sends every read as it happens", type=int)
+options.define(
+    "scrollback_lines", default=1000,
+    help="Number of recent lines of each file kept in memory to serve new "
+    "connections", type=int)
+options.define(
+    "scrollback_bytes", default=1024 * 1024,
+    help="Maximum size of the recent lines kept in memory for each file",
+    type=int)
+options.define(
+    "send_queue_max_bytes", default=1024 * 1024,
+    help="Maximum size of the messages queued for a slow connection",
+    type=int)
+options.define(
+    "tailer_max_pending_bytes", default=16 * 1024 * 1024,
+    help="Bytes waiting to be written from the tailer to a worker beyond "
+    "which new lines are dropped", type=int)
+options.define(
+    "slow_consumer_policy", default=SKIP_MARKER,
+    help="What to do when the send queue of a connection overflows, choices "
+    "are {}".format(", ".join("'{}'".format(p) for p in POLICIES)),
+    type=str)
+options.define(
+    "compression", default=COMPRESSION_SHARED,
+    help="Websocket compression, choices are 'none', 'per_connection' to "
+    "compress every message for every connection or 'shared' to compress "
+    "messages sent to many connections once", type=str,
+    callback=check_compression)
+options.define(
+    "coalesce_max_bytes", default=64 * 1024,
+    help="Size of collected content to be sent regardless of the "
+    "coalescing window", type=int)
+options.define(
+    "workers", default=0,
+    help="Number of worker processes accepting websocket connections on the "
+    "same port, fed by a single process tailing the files, 0 serves "
+    "everything from a single process", type=int)
+options.define(
+    "loop_lag_interval", default=0.5,
+    help="Seconds between samples of the event loop lag, 0 disables the "
+    "monitor", type=float)
+options.define(
+    "slow_callback_ms", default=100,
+    help="Milliseconds a file read or broadcast may take before it is "
+    "reported as slow, also the loop lag reported as a warning", type=int)
+options.define(
+    "admin", default=False,
+    help="Enable the /admin/profile endpoint capturing CPU or memory "
+    "profiles of the running server", type=bool)
+options.define(
+    "upstream", default=None,
+    help="Websocket URL of a tailsocket instance to relay, e.g. "
+    "ws://origin:8888, files are tailed through it instead of read locally",
+    type=str)
+options.define(
+    "tailer_socket", default=None,
+    help="Path of the Unix socket the tailer process serves the workers on, "
+    "defaults to a temporary path", type=str)
 
 
 class HomePageHandler(RequestHandler):
@@ -53,49 +161,593 @@ class HomePageHandler(RequestHandler):
         )
 
 
+class MetricsHandler(RequestHandler):
+    """Exposes the metrics of the application in the Prometheus text format.
+
+    """
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.render(self.application))
+
+
+class ProfileHandler(RequestHandler):
+    """Captures a CPU or memory profile of the running server for a number
+    of seconds and returns the report, e.g.::
+
+        GET /admin/profile?mode=cpu&seconds=10&limit=30
+
+    `mode` is `cpu` for a cProfile capture or `memory` for a tracemalloc
+    capture of the allocations made meanwhile. One capture runs at a time,
+    for at most `max_seconds`.
+
+    """
+
+    max_seconds = 60
+    capturing = False
+
+    @gen.coroutine
+    def get(self):
+        mode = self.get_argument('mode', 'cpu')
+        if mode not in profiling.PROFILES:
+            raise HTTPError(400, reason='Unknown profile mode')
+        if ProfileHandler.capturing:
+            raise HTTPError(409, reason='A capture is already running')
+
+        try:
+            seconds = float(self.get_argument('seconds', 10))
+            limit = int(self.get_argument('limit', 30))
+        except ValueError:
+            raise HTTPError(400, reason='Invalid seconds or limit')
+        # Also rejects NaN
+        if not seconds >= 0 or limit <= 0:
+            raise HTTPError(400, reason='Invalid seconds or limit')
+
+        seconds = min(seconds, self.max_seconds)
+        profile = profiling.PROFILES[mode](limit)
+        logger.info('Capturing %s profile for %ss', mode, seconds)
+        ProfileHandler.capturing = True
+        profile.start()
+        try:
+            yield gen.sleep(seconds)
+        finally:
+            report = profile.stop()
+            ProfileHandler.capturing = False
+
+        self.set_header('Content-Type', 'text/plain')
+        self.write(report)
+
+
 class TailWebSocketHandler(websocket.WebSocketHandler):
     """Websocket connection handler.
 
+    Messages are written through a bounded send queue so slow connections
+    do not buffer an unlimited amount of data.
+
+    A connection either tails a single file or multiplexes any number of
+    subscriptions as channels, sharing its send queue between them.
+
+    Clients requesting the binary subprotocol are sent messages framed as
+    described in `tailsocket.binary_protocol`, the rest plain text messages.
+
     """
 
     def __init__(self, *args, **kwargs):
-        logger.debug('Init {} websocket'.format(self.__class__.__name__))
+        logger.debug('Init %s websocket', self.__class__.__name__)
         self.app = kwargs.pop('app')
         self.filename = None
+        self.channels = {}
+        self.channel_groups = {}
+        self.binary_protocol = False
+        self.announced_files = set()
+        self.name = None
+        self.send_queue = self.create_send_queue()
         super().__init__(*args, **kwargs)
 
+    def create_send_queue(self):
+        """Creates the send queue of the connection based on the options.
+
+        """
+        return SendQueue(
+            self.write_message_to_connection,
+            self.connection_is_writing,
+            partial(self.close, 1008, 'Send queue overflow'),
+            max_bytes=options.options.send_queue_max_bytes,
+            policy=options.options.slow_consumer_policy,
+            format_marker=self.format_skipped_lines_marker)
+
+    def format_skipped_lines_marker(self, channel_id, lines):
+        """Returns the marker of the lines skipped by the send queue, tagged
+        with the id of their channel on multiplexed connections.
+
+        """
+        marker = SKIPPED_LINES_MARKER.format(lines)
+        if channel_id is None:
+            return marker
+        if self.binary_protocol:
+            return ChannelMessage(channel_id, marker)
+        return format_channel_message(channel_id, marker)
+
+    def get_queue_stats(self):
+        """Returns the depth of the send queue of the connection.
+
+        """
+        return self.send_queue.get_stats()
+
     def check_origin(self, origin):
         """Security measure from Tornado to avoid cross domain referencing.
 
         """
         return True
 
+    def select_subprotocol(self, subprotocols):
+        """Selects the binary protocol if the client requests it.
+
+        """
+        if binary_protocol.SUBPROTOCOL in subprotocols:
+            self.binary_protocol = True
+            return binary_protocol.SUBPROTOCOL
+        return None
+
+    def get_compression_options(self):
+        """Enables permessage-deflate for clients offering it unless
+        compression is disabled.
+
+        """
+        if options.options.compression == COMPRESSION_NONE:
+            return None
+        return {}
+
     def open(self, name, *args, **kwargs):
-        logger.info('Open websocket with: {}'.format(name))
+        logger.info('Open websocket with: %s', name)
         self.name = name
+        self.app.connections.add(self)
+        if self.uses_shared_compression():
+            self.disable_context_takeover()
 
     def on_close(self):
-        logger.info("Closed {} websocket".format(self.__class__.__name__))
-        if self.filename is not None:
-            self.app.registry.remove_handler_from_filename(self, self.filename)
+        logger.info("Closed %s websocket", self.__class__.__name__)
+        self.app.connections.discard(self)
+        self.send_queue.clear()
+        self.unsubscribe()
+        for channel_id in list(self.channels):
+            self.unsubscribe_channel(channel_id)
+
+    def write_message(self, message, binary=False, lines=None, channel=None):
+        """Queues a message to be written to the websocket.
+
+        Args:
+            message (str or dict): The message.
+            binary (Optional[bool]): Whether to send the message as binary.
+            lines (Optional[int]): Number of lines of the message, counted
+                from the message if not given, see `SendQueue.put`.
+            channel (Optional[str or int]): Id of the channel the message
+                belongs to, if any.
+
+        """
+        if self.ws_connection is None:
+            raise websocket.WebSocketClosedError()
+        if lines is None:
+            lines = count_lines(message)
+        if isinstance(message, dict):
+            message = escape.json_encode(message)
+            if self.binary_protocol:
+                message = BroadcastMessage(
+                    message, message_type=binary_protocol.MESSAGE_JSON)
+        self.send_queue.put(message, binary, lines=lines, channel=channel)
+
+    def write_message_to_connection(self, message, binary=False):
+        """Writes a message to the websocket connection.
+
+        Writes the prebuilt frame of broadcast messages directly to the stream
+        when the connection uses plain unmasked frames, or their shared
+        compressed frame when using shared compression.
+
+        Returns:
+            Future: Resolved when the data is flushed to the connection.
+
+        """
+        metrics.MESSAGES_SENT.inc()
+        metrics.BYTES_SENT.inc(amount=get_message_size(message))
+        if self.binary_protocol:
+            return self.write_binary_message(message)
+
+        if isinstance(message, BroadcastMessage):
+            frame = self.get_prebuilt_frame(message)
+            if frame is not None:
+                return self.write_prebuilt_frame(frame, message.payload)
+            # Encoded already when measured by the send queue
+            message = message.payload
+
+        return super().write_message(message, binary=binary)
+
+    def write_binary_message(self, message):
+        """Writes a message to the websocket connection using the binary
+        protocol.
+
+        Text messages are sent as status messages and dicts as JSON messages,
+        the path of a file is announced before its first lines.
+
+        Returns:
+            Future: Resolved when the data is flushed to the connection.
+
+        """
+        if isinstance(message, dict):
+            message = BroadcastMessage(
+                escape.json_encode(message),
+                message_type=binary_protocol.MESSAGE_JSON)
+        elif not isinstance(message, BroadcastMessage):
+            message = BroadcastMessage(
+                message, message_type=binary_protocol.MESSAGE_STATUS)
+
+        if (message.message_type == binary_protocol.MESSAGE_LINES and
+                message.file_id and
+                message.file_id not in self.announced_files):
+            self.announced_files.add(message.file_id)
+            self.write_binary_message(BroadcastMessage(
+                self.app.registry.file_paths.get(message.file_id, ''),
+                message_type=binary_protocol.MESSAGE_FILE,
+                file_id=message.file_id))
+
+        frame = self.get_prebuilt_frame(message, binary=True)
+        if frame is not None:
+            return self.write_prebuilt_frame(frame, message.binary_payload)
+
+        return super().write_message(message.binary_payload, binary=True)
+
+    def get_prebuilt_frame(self, message, binary=False):
+        """Returns the frame of a broadcast message shared with other
+        connections, if the connection can write shared frames.
+
+        Args:
+            message (BroadcastMessage): The message.
+            binary (Optional[bool]): Whether to use the binary protocol.
+
+        """
+        if not message.shared:
+            return None
+        if self.can_write_prebuilt_frames():
+            return message.get_frame(binary)
+        if self.uses_shared_compression():
+            return message.get_frame(
+                binary, self.ws_connection._compressor._max_wbits)
+        return None
+
+    def connection_is_writing(self):
+        """Returns True if the connection has data waiting to be flushed.
+
+        """
+        return (
+            self.ws_connection is not None and
+            self.ws_connection.stream.writing()
+        )
+
+    def can_write_prebuilt_frames(self):
+        """Returns True if frames shared with other connections can be written
+        as is, i.e. the connection neither compresses nor masks its frames.
+
+        """
+        connection = self.ws_connection
+        return (
+            isinstance(connection, websocket.WebSocketProtocol13) and
+            not connection.mask_outgoing and
+            connection._compressor is None
+        )
+
+    def uses_shared_compression(self):
+        """Returns True if the connection agreed permessage-deflate and
+        compressed frames are shared with other connections.
+
+        """
+        connection = self.ws_connection
+        return (
+            options.options.compression == COMPRESSION_SHARED and
+            isinstance(connection, websocket.WebSocketProtocol13) and
+            not connection.mask_outgoing and
+            connection._compressor is not None
+        )
+
+    def disable_context_takeover(self):
+        """Makes the connection compress every message on its own.
+
+        Frames compressed once for many connections can't refer to previous
+        messages of any of them, and messages compressed by the connection
+        itself must not refer to the data of the shared frames it didn't
+        compress, so no message may use the context of previous ones.
+
+        """
+        connection = self.ws_connection
+        connection._compressor = websocket._PerMessageDeflateCompressor(
+            persistent=False, max_wbits=connection._compressor._max_wbits)
+
+    def write_prebuilt_frame(self, frame, payload):
+        """Writes an already built frame to the stream of the connection,
+        mimicking the accounting done by Tornado's own `_write_frame`.
+
+        Args:
+            frame (bytes): The complete websocket frame.
+            payload (bytes): The payload carried in the frame.
+
+        """
+        connection = self.ws_connection
+        if connection is None:
+            raise websocket.WebSocketClosedError()
+
+        connection._message_bytes_out += len(payload)
+        connection._wire_bytes_out += len(frame)
+        try:
+            return connection.stream.write(frame)
+        except StreamClosedError:
+            connection._abort()
 
     def on_message(self, message):
         """Handles messages from the websocket. The application expects full
         paths to be sent and will attempt to create readers for these files.
 
+        Messages holding a JSON object are requests on the file being tailed,
+        see `on_request`.
+
         Args:
             message (str): Message sent from the client.
         """
-        logger.info('[{}]: Recieved message from websocket: {}'.format(
-            self.name, message))
+        logger.info(
+            '[%s]: Recieved message from websocket: %s', self.name, message)
+        request = None
         try:
-            self.app.registry.add_handler_to_filename(self, message)
-            self.filename = message
+            if message.startswith('{'):
+                request = escape.json_decode(message)
+                self.on_request(request)
+            else:
+                self.subscribe(message)
         except Exception as e:
-            # TODO: write an object with a message type for the frontend
-            # to display in different ways?
-            self.write_message("An error occurred: {}".format(e))
-            logger.exception(e)
+            handler = self
+            if isinstance(request, dict) and 'channel' in request:
+                handler = Channel(
+                    self, request['channel'], request.get('filename'))
+            self.write_error_message(handler, e)
+
+    def write_error_message(self, handler, error):
+        """Writes an error to the connection, or to the channel of the request
+        that failed.
+
+        Args:
+            handler (TailWebSocketHandler or Channel): The requester.
+            error (Exception): The error.
+
+        """
+        # TODO: write an object with a message type for the frontend
+        # to display in different ways?
+        handler.write_message(BroadcastMessage(
+            "An error occurred: {}".format(error),
+            message_type=binary_protocol.MESSAGE_ERROR))
+        logger.exception(error)
+
+    def on_request(self, request):
+        """Handles a request from the websocket, the type of the request is
+        given by its `type` key.
+
+        Args:
+            request (dict): The decoded request.
+
+        Raises:
+            ValueError: If the request is not supported.
+
+        """
+        if request.get('type') == 'subscribe' and 'channel' in request:
+            self.subscribe_channel(
+                request['channel'], request['filename'],
+                LineFilter.from_request(request), request.get('resume_from'))
+        elif request.get('type') == 'subscribe':
+            self.subscribe(
+                request['filename'], LineFilter.from_request(request),
+                request.get('resume_from'))
+        elif request.get('type') == 'unsubscribe':
+            self.unsubscribe_channel(request['channel'])
+        elif request.get('type') == 'history':
+            self.on_history_request(request)
+        else:
+            raise ValueError('Unknown request {}'.format(request.get('type')))
+
+    def subscribe(self, filename, line_filter=None, resume_from=None):
+        """Starts tailing a file, replacing the file tailed so far if any.
+
+        Paths with wildcards tail all the matching files, including the ones
+        created later, the lines of each file being preceded by a
+        ``==> path <==`` header.
+
+        Subscriptions with filters are requested with::
+
+            {"type": "subscribe", "filename": "/var/log/syslog",
+             "include": ["sshd", {"regex": "port \\d+"}],
+             "exclude": [{"substring": "debug1"}], "level": "warning"}
+
+        Only the lines matching any of the `include` patterns, none of the
+        `exclude` patterns and containing a log level name at or above
+        `level` are sent. Plain strings are substrings to look for.
+
+        Clients reconnecting after losing their connection may add the
+        `resume_from` key with the offset of the last lines they received,
+        as given by the binary protocol, to be sent the lines following them
+        instead of the last lines of the file.
+
+        Args:
+            filename (str): Path to the file.
+            line_filter (Optional[LineFilter]): Filter of the lines to send.
+            resume_from (Optional[int]): Offset to resume the tail from.
+
+        """
+        self.unsubscribe()
+        self.add_to_registry(self, filename, line_filter, resume_from)
+        self.filename = filename
+
+    def unsubscribe(self):
+        """Stops tailing the file or files tailed so far, if any.
+
+        """
+        if self.filename is None:
+            return
+
+        self.remove_from_registry(self, self.filename)
+        self.filename = None
+
+    def subscribe_channel(
+            self, channel_id, filename, line_filter=None, resume_from=None):
+        """Starts tailing a file in a channel of the connection, replacing the
+        subscription of the channel if any.
+
+        Channels are requested with::
+
+            {"type": "subscribe", "channel": "syslog",
+             "filename": "/var/log/syslog"}
+
+        taking the same filters as `subscribe`, and closed with::
+
+            {"type": "unsubscribe", "channel": "syslog"}
+
+        The messages of a channel are sent as JSON objects with its id::
+
+            {"channel": "syslog", "data": "New lines"}
+
+        The channels on the same file or pattern share a registration in the
+        registry, see `ChannelGroup`.
+
+        Args:
+            channel_id (str or int): The id of the channel.
+            filename (str): Path to the file or glob pattern.
+            line_filter (Optional[LineFilter]): Filter of the lines to send.
+            resume_from (Optional[int]): Offset to resume the tail from.
+
+        """
+        self.unsubscribe_channel(channel_id)
+        group = self.channel_groups.get(filename)
+        if group is None:
+            group = ChannelGroup(self, filename)
+            self.add_to_registry(group, filename)
+            self.channel_groups[filename] = group
+
+        channel = Channel(self, channel_id, filename)
+        try:
+            group.add(channel, line_filter, resume_from)
+        finally:
+            if not group:
+                self.remove_channel_group(group)
+        self.channels[channel_id] = channel
+
+    def unsubscribe_channel(self, channel_id):
+        """Stops tailing the file of a channel, if open.
+
+        Args:
+            channel_id (str or int): The id of the channel.
+
+        """
+        channel = self.channels.pop(channel_id, None)
+        if channel is None:
+            return
+
+        group = self.channel_groups[channel.filename]
+        group.remove(channel)
+        if not group:
+            self.remove_channel_group(group)
+
+    def remove_channel_group(self, group):
+        """Removes the registration of a group of channels left empty.
+
+        """
+        del self.channel_groups[group.filename]
+        self.remove_from_registry(group, group.filename)
+
+    def add_to_registry(
+            self, handler, filename, line_filter=None, resume_from=None):
+        """Registers the connection, or a group of its channels, to receive the
+        lines of a file or the files matching a glob pattern.
+
+        Glob subscriptions can't be resumed, they always start from the end
+        of the files.
+
+        """
+        if is_glob(filename):
+            self.app.registry.add_handler_to_glob(
+                handler, filename, line_filter)
+        else:
+            self.app.registry.add_handler_to_filename(
+                handler, filename, line_filter,
+                None if resume_from is None else int(resume_from))
+
+    def remove_from_registry(self, handler, filename):
+        """Removes the registration of the connection or a group of its
+        channels.
+
+        """
+        if is_glob(filename):
+            self.app.registry.remove_handler_from_glob(handler, filename)
+        else:
+            self.app.registry.remove_handler_from_filename(handler, filename)
+
+    def on_history_request(self, request):
+        """Sends a page of the lines of the file being tailed preceding a
+        cursor, the reply includes the cursor to request the next page with.
+
+        Request::
+
+            {"type": "history", "lines": 100, "before": 1024, "skip": 0}
+
+        Reply::
+
+            {"type": "history", "lines": [...], "cursor": 512,
+             "has_more": true, "line": 2048}
+
+        `before` defaults to the content sent so far and `skip` to 0, `line`
+        is the number of the first line of the page, if known. Pages past
+        the start of the file come from its rotated archives, their cursors
+        being strings like ``"1234.1700000000000000000:512"``. Requests with
+        a `channel` key read the file of the channel and are replied to on
+        the channel.
+
+        Args:
+            request (dict): The decoded request.
+
+        """
+        handler, filename = self, self.filename
+        if 'channel' in request:
+            handler = self.channels[request['channel']]
+            filename = handler.filename
+
+        if filename is None or is_glob(filename):
+            raise ValueError('History requires tailing a single file')
+
+        before = request.get('before')
+        page = self.app.registry.read_history(
+            filename, int(request.get('lines', 100)),
+            before=None if before is None else normalize_cursor(before),
+            skip=int(request.get('skip', 0)))
+        if is_future(page):
+            IOLoop.current().add_future(
+                page, partial(self.write_history_page, handler))
+        else:
+            self.write_history_page(handler, page)
+
+    def write_history_page(self, handler, page):
+        """Writes a page of history to the connection or channel that
+        requested it.
+
+        Args:
+            handler (TailWebSocketHandler or Channel): The requester.
+            page (dict or Future): The page, or a future resolving to it for
+                registries reading the history in another process.
+
+        """
+        if self.ws_connection is None:
+            return
+
+        if is_future(page):
+            try:
+                page = page.result()
+            except Exception as e:
+                self.write_error_message(handler, e)
+                return
+
+        page['type'] = 'history'
+        handler.write_message(page)
 
 
 class TailSocketApplication(Application):
@@ -103,15 +755,20 @@ class TailSocketApplication(Application):
 
     """
 
-    def __init__(self):
-        self.registry = get_registry()
+    def __init__(self, registry=None):
+        self.connections = set()
+        self.registry = registry or create_registry()
 
         handlers = [
             url(r"/", HomePageHandler, {}, 'home'),
+            url(r"/metrics", MetricsHandler, {}, 'metrics'),
             url(
                 r"/websocket/([\w-]+)",
                 TailWebSocketHandler, {"app": self}, 'websocket'),
         ]
+        if options.options.admin:
+            handlers.append(
+                url(r"/admin/profile", ProfileHandler, {}, 'profile'))
 
         settings = {
             'debug': options.options.debug,
@@ -121,9 +778,35 @@ class TailSocketApplication(Application):
         super(TailSocketApplication, self).__init__(handlers, **settings)
 
 
-def main():
-    options.parse_command_line()
+def get_registry_options():
+    """Returns the arguments of the registry based on the options.
+
+    """
+    return {
+        'coalesce_window_ms': options.options.coalesce_window_ms,
+        'coalesce_max_bytes': options.options.coalesce_max_bytes,
+        'scrollback_lines': options.options.scrollback_lines,
+        'scrollback_bytes': options.options.scrollback_bytes,
+    }
+
+
+def create_registry():
+    """Returns the registry reading the files, or relaying them from the
+    upstream instance if one is given.
+
+    """
+    if options.options.upstream:
+        return UpstreamReaderRegistry(
+            options.options.upstream, **get_registry_options())
+    return get_registry(
+        registry_type=options.options.registry, **get_registry_options())
+
+
+def install_event_loop():
+    """Sets up the asyncio event loop based on the options and makes Tornado
+    use it, starting the monitor of its lag if enabled.
 
+    """
     if options.options.policy == 'select':
         selector = selectors.SelectSelector()
         loop = asyncio.SelectorEventLoop(selector)
@@ -131,6 +814,123 @@ def main():
 
     AsyncIOMainLoop().install()
 
+    profiling.slow_callback_threshold = options.options.slow_callback_ms / 1000
+    if options.options.loop_lag_interval:
+        profiling.LoopLagMonitor(
+            options.options.loop_lag_interval,
+            profiling.slow_callback_threshold).start()
+
+
+def stop_on_signals():
+    """Stops the event loop on SIGTERM and SIGINT, so the code following
+    `run_forever` cleans up before the process exits.
+
+    """
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, loop.stop)
+
+
+def run_workers():
+    """Forks the worker processes accepting the websocket connections and
+    runs the tailer process serving them the lines of the files.
+
+    Workers listen on the same port using SO_REUSEPORT so the kernel
+    balances the connections between them, and subscribe to the files on
+    the tailer through its Unix socket, see `tailsocket.tailer`. The socket
+    is bound before forking so workers can connect right away.
+
+    Stopping the tailer, e.g. with SIGTERM, terminates the workers and
+    removes the socket, and workers exit when their connection to the
+    tailer closes.
+
+    """
+    socket_path = options.options.tailer_socket or os.path.join(
+        tempfile.gettempdir(), 'tailsocket-{}.sock'.format(os.getpid()))
+    unix_socket = netutil.bind_unix_socket(socket_path)
+
+    pids = []
+    for worker_id in range(options.options.workers):
+        pid = os.fork()
+        if pid == 0:
+            unix_socket.close()
+            run_worker(worker_id, socket_path)
+            os._exit(0)
+        pids.append(pid)
+
+    try:
+        run_tailer(unix_socket)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        os.remove(socket_path)
+
+
+def run_tailer(unix_socket):
+    """Runs the tailer process, reading the files for the workers.
+
+    Args:
+        unix_socket (socket.socket): The bound socket to serve workers on.
+
+    """
+    install_event_loop()
+    setup_logging()
+
+    server = TailerServer(
+        create_registry(),
+        max_pending_bytes=options.options.tailer_max_pending_bytes)
+    server.add_socket(unix_socket)
+    print("Starting tailer for {} workers on {}".format(
+        options.options.workers, unix_socket.getsockname()))
+
+    stop_on_signals()
+    asyncio.get_event_loop().run_forever()
+
+
+def run_worker(worker_id, socket_path):
+    """Runs a worker process, accepting websocket connections and
+    subscribing to the files they tail on the tailer.
+
+    Args:
+        worker_id (int): Number of the worker.
+        socket_path (str): Path of the Unix socket of the tailer.
+
+    """
+    install_event_loop()
+    setup_logging()
+
+    registry = RemoteReaderRegistry(socket_path, **get_registry_options())
+    loop = asyncio.get_event_loop()
+    # Without the tailer the worker has nothing to serve
+    IOLoop.current().add_future(
+        registry.connect(), lambda future: loop.stop())
+    app = TailSocketApplication(registry=registry)
+    server = HTTPServer(app)
+    server.add_sockets(netutil.bind_sockets(
+        options.options.port, address=options.options.ip, reuse_port=True))
+    print("Starting worker {} on http://{}:{}".format(
+        worker_id, options.options.ip, options.options.port))
+
+    stop_on_signals()
+    loop.run_forever()
+
+
+def main():
+    options.parse_command_line()
+
+    if options.options.workers:
+        run_workers()
+        return None
+
+    install_event_loop()
     setup_logging()
 
     app = TailSocketApplication()
@@ -0,0 +1,491 @@
+"""
+Reading the history of a file from its rotated siblings, e.g. ``app.log.1``
+and ``app.log.2.gz``, including gzip archives through an index of seek
+points.
+
+"""
+
+import os
+import re
+import zlib
+import bisect
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from tailsocket.backward_reader import (
+    BLOCK_SIZE, get_size, read_at, read_lines_before)
+
+# Window bits of zlib accepting a gzip header and trailer
+GZIP_WBITS = zlib.MAX_WBITS | 16
+
+# Compressed bytes decompressed at a time
+READ_SIZE = 64 * 1024
+
+CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+
+ARCHIVE_SUFFIX = re.compile(r'(\d+)(\.gz)?$')
+
+ARCHIVE_ID = re.compile(r'\d+\.\d+$')
+
+
+def parse_cursor(cursor):
+    """Returns the archive and position of a history cursor.
+
+    Cursors of the current file are positions in it, cursors of its
+    archives are strings of the id of the archive, see `get_archive_id`, and
+    the position in its uncompressed content, e.g.
+    ``1234.1700000000000000000:512``.
+
+    Args:
+        cursor (int or str): The cursor, None for the end of the current
+            file.
+
+    Returns:
+        tuple: The id of the archive, None for the current file, and the
+            position, or None for the end.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+
+    """
+    if cursor is None:
+        return None, None
+
+    archive, position = None, cursor
+    if isinstance(cursor, str) and ':' in cursor:
+        archive, position = cursor.split(':', 1)
+        if not ARCHIVE_ID.match(archive):
+            raise ValueError('Invalid cursor {!r}'.format(cursor))
+    return archive, max(0, int(position))
+
+
+def format_cursor(archive, position):
+    """Returns the cursor of a position of the current file or of one of its
+    archives, see `parse_cursor`.
+
+    """
+    if archive is None:
+        return position
+    return '{}:{}'.format(archive, position)
+
+
+def normalize_cursor(cursor):
+    """Validates a cursor received from a client, e.g. as a string.
+
+    """
+    return format_cursor(*parse_cursor(cursor))
+
+
+def get_archive_id(stat):
+    """Returns the id of an archive used in its cursors, made of its inode
+    and modification time.
+
+    Unlike their names, which shift by one generation on every rotation,
+    archives keep their inode when renamed, and their modification time
+    when compressed, see `find_generation`.
+
+    Args:
+        stat (os.stat_result): The stat of the archive.
+
+    """
+    return '{}.{}'.format(stat.st_ino, stat.st_mtime_ns)
+
+
+def find_generation(archives, archive):
+    """Returns the generation of an archive given its id.
+
+    Archives are matched by inode and modification time, an archive
+    compressed since by its modification time alone. Inodes alone aren't
+    enough, as new files may reuse the inode of a deleted archive.
+
+    Args:
+        archives (list): The paths of the archives, see `find_archives`.
+        archive (str): The id of the archive.
+
+    Returns:
+        int: The generation of the archive, 1 for the most recent one.
+
+    Raises:
+        ValueError: If the archive no longer exists, or was written to since.
+
+    """
+    inode, mtime = (int(part) for part in archive.split('.'))
+    compressed = []
+    for generation, path in enumerate(archives, 1):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if (stat.st_ino, stat.st_mtime_ns) == (inode, mtime):
+            return generation
+        if path.endswith('.gz') and stat.st_mtime_ns == mtime:
+            compressed.append(generation)
+
+    if compressed:
+        return compressed[0]
+    raise ValueError('Archive {} no longer exists'.format(archive))
+
+
+def find_archives(filename):
+    """Returns the rotated siblings of a file, from the most recent to the
+    oldest.
+
+    Siblings are named after the file with a numeric suffix, optionally
+    compressed with gzip, e.g. ``app.log.1`` and ``app.log.2.gz``.
+
+    Args:
+        filename (str): Absolute path of the file.
+
+    Returns:
+        list: The paths of the archives, the generation of each one being
+            its position in the list plus one.
+
+    """
+    directory, name = os.path.split(filename)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    archives = []
+    for other in names:
+        if not other.startswith(name + '.'):
+            continue
+        match = ARCHIVE_SUFFIX.match(other[len(name) + 1:])
+        if match:
+            archives.append((int(match.group(1)), other))
+    return [os.path.join(directory, other) for _, other in sorted(archives)]
+
+
+def count_lines(fd, end, block_size=BLOCK_SIZE):
+    """Returns the number of lines before a position of a file, counting a
+    last line without a newline.
+
+    """
+    count = 0
+    position = 0
+    while position < end:
+        block = read_at(fd, min(block_size, end - position), position)
+        if not block:
+            break
+        count += block.count(b'\n')
+        position += len(block)
+    if end and read_at(fd, 1, end - 1) != b'\n':
+        count += 1
+    return count
+
+
+def inflate(decompressor, data, max_length=0):
+    """Decompresses the next chunk of a gzip file, which may span several
+    members.
+
+    Args:
+        decompressor (zlib.Decompress): The decompressor of the current
+            member, None between members.
+        data (bytes): The next compressed chunk.
+        max_length (Optional[int]): Maximum size of the decompressed data,
+            0 for no limit.
+
+    Returns:
+        tuple: The decompressed data, the decompressor to continue with and
+            the compressed data left once `max_length` was reached.
+
+    """
+    output = []
+    length = 0
+    while not max_length or length < max_length:
+        if decompressor is None:
+            # Members may be padded with zeros
+            data = data.lstrip(b'\x00')
+            if not data:
+                break
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+        limit = max_length and max_length - length
+        output.append(decompressor.decompress(data, limit))
+        length += len(output[-1])
+        if decompressor.eof:
+            data = decompressor.unused_data
+            decompressor = None
+            continue
+        data = decompressor.unconsumed_tail
+        # Reaching the limit may leave output pending without input left
+        if not data and (not limit or len(output[-1]) < limit):
+            break
+    return b''.join(output), decompressor, data
+
+
+class GzipIndex():
+    """Seek points of a gzip file, to read parts of its content without
+    decompressing it from the start.
+
+    Every `interval` bytes of content a copy of the state of the
+    decompressor is kept along with the positions in the content and in the
+    compressed file, so reading any part of it costs decompressing at most
+    the span between two checkpoints. The last span read is kept, as history
+    pages are read backwards a block at a time.
+
+    Args:
+        interval (Optional[int]): Bytes of content between checkpoints.
+
+    """
+
+    def __init__(self, interval=CHECKPOINT_INTERVAL):
+        self.interval = interval
+        self.checkpoints = []
+        self.positions = []
+        self.size = None
+        self._span = None
+
+    def build(self, fd):
+        """Decompresses the whole file once, saving the checkpoints.
+
+        Args:
+            fd (file-like): The compressed file.
+
+        """
+        fd.seek(0)
+        decompressor = None
+        checkpoints = [(0, 0, None)]
+        position = compressed = 0
+        while True:
+            data = fd.read(READ_SIZE)
+            if not data:
+                break
+            compressed += len(data)
+            while True:
+                next_checkpoint = checkpoints[-1][0] + self.interval
+                output, decompressor, data = inflate(
+                    decompressor, data, max_length=next_checkpoint - position)
+                position += len(output)
+                if position < next_checkpoint:
+                    break
+                checkpoints.append((
+                    position, compressed - len(data),
+                    decompressor and decompressor.copy()))
+
+        self.checkpoints = checkpoints
+        self.positions = [checkpoint[0] for checkpoint in checkpoints]
+        self.size = position
+        self._span = None
+
+    def read_span(self, fd, number):
+        """Returns the content between a checkpoint and the next one.
+
+        Args:
+            fd (file-like): The compressed file.
+            number (int): The index of the checkpoint.
+
+        Returns:
+            tuple: The position of the span and its content.
+
+        """
+        if self._span is not None and self._span[0] == number:
+            return self._span[1:]
+
+        start, compressed, decompressor = self.checkpoints[number]
+        end = (
+            self.positions[number + 1] if number + 1 < len(self.positions)
+            else self.size)
+        # The saved state is copied so the checkpoint can be used again
+        decompressor = decompressor and decompressor.copy()
+        fd.seek(compressed)
+        output = []
+        position = start
+        while position < end:
+            data = fd.read(READ_SIZE)
+            if not data:
+                break
+            content, decompressor, _ = inflate(
+                decompressor, data, max_length=end - position)
+            output.append(content)
+            position += len(content)
+
+        content = b''.join(output)
+        self._span = (number, start, content)
+        return start, content
+
+    def read(self, fd, size, position):
+        """Reads up to size bytes of the content from a position.
+
+        """
+        end = min(position + size, self.size)
+        parts = []
+        while position < end:
+            number = bisect.bisect_right(self.positions, position) - 1
+            start, content = self.read_span(fd, number)
+            part = content[position - start:end - start]
+            if not part:
+                break
+            parts.append(part)
+            position += len(part)
+        return b''.join(parts)
+
+
+class GzipArchive():
+    """Read only file-like view of the content of an indexed gzip file.
+
+    Args:
+        fd (file-like): The compressed file.
+        index (GzipIndex): The index of the file.
+
+    """
+
+    def __init__(self, fd, index):
+        self.fd = fd
+        self.index = index
+        self.position = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_END:
+            offset += self.index.size
+        elif whence == os.SEEK_CUR:
+            offset += self.position
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.index.size
+        data = self.index.read(self.fd, size, self.position)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveReader():
+    """Reads pages of history from the archives of files.
+
+    Archives are read in a single background thread, which also keeps the
+    indexes of the gzip archives from being built twice at once. Indexes
+    are built the first time an archive is read and cached until it
+    changes, the least recently used ones being discarded beyond
+    `max_indexes`.
+
+    Args:
+        checkpoint_interval (Optional[int]): Bytes of content between the
+            checkpoints of the gzip indexes.
+        block_size (Optional[int]): Size of the blocks read from archives.
+        max_indexes (Optional[int]): Number of gzip indexes kept.
+
+    """
+
+    def __init__(self, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 block_size=BLOCK_SIZE, max_indexes=8):
+        self.checkpoint_interval = checkpoint_interval
+        self.block_size = block_size
+        self.max_indexes = max_indexes
+        self.indexes = collections.OrderedDict()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def get_index(self, path, fd):
+        """Returns the index of a gzip archive, building it if the archive
+        was not indexed yet or changed since.
+
+        """
+        stat = os.fstat(fd.fileno())
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+        cached = self.indexes.pop(path, None)
+        if cached is not None and cached[0] == key:
+            index = cached[1]
+        else:
+            index = GzipIndex(self.checkpoint_interval)
+            index.build(fd)
+
+        self.indexes[path] = (key, index)
+        while len(self.indexes) > self.max_indexes:
+            self.indexes.popitem(last=False)
+        return index
+
+    def open(self, path):
+        """Opens an archive, returning a file-like object of its content.
+
+        """
+        fd = open(path, 'rb')
+        if not path.endswith('.gz'):
+            return fd
+        try:
+            return GzipArchive(fd, self.get_index(path, fd))
+        except Exception:
+            fd.close()
+            raise
+
+    def read_page(self, filename, n, archive=None, before=None, skip=0,
+                  newer_lines=()):
+        """Reads a page of n lines from the archives of a file, ending `skip`
+        lines before a position of one of them and continuing into older
+        archives as they run out.
+
+        Args:
+            filename (str): Absolute path of the current file.
+            n (int): Number of lines to read.
+            archive (Optional[str]): Id of the archive to start from, see
+                `get_archive_id`, defaults to the most recent one.
+            before (Optional[int]): Position in the archive to read lines
+                before, defaults to its end.
+            skip (Optional[int]): Number of lines before it to skip.
+            newer_lines (Optional[list]): Lines of newer content preceding
+                the page, e.g. the start of the current file.
+
+        Returns:
+            dict: The page, see `ReaderRegistry.read_history`.
+
+        Raises:
+            ValueError: If the archive no longer exists.
+
+        """
+        archives = find_archives(filename)
+        generation = 1
+        if archive is not None:
+            generation = find_generation(archives, archive)
+        lines = list(newer_lines)
+        cursor = format_cursor(archive, 0)
+        start = 0
+        while generation <= len(archives) and len(lines) < n:
+            path = archives[generation - 1]
+            with self.open(path) as fd:
+                archive = get_archive_id(os.stat(path))
+                end = get_size(fd)
+                if before is not None:
+                    end = min(before, end)
+                page, start = read_lines_before(
+                    fd, n - len(lines), end=end, offset=skip,
+                    block_size=self.block_size)
+                if skip and not page:
+                    skip = max(0, skip - count_lines(
+                        fd, end, block_size=self.block_size))
+                else:
+                    skip = 0
+
+            lines[:0] = [line.decode('utf-8', 'replace') for line in page]
+            cursor = format_cursor(archive, start)
+            if start > 0:
+                break
+            generation += 1
+            before = None
+
+        return {
+            'lines': lines,
+            'cursor': cursor,
+            'has_more': start > 0 or generation <= len(archives),
+            'line': None,
+        }
+
+    def read_history(self, *args, **kwargs):
+        """Reads a page in the background, see `read_page`.
+
+        Returns:
+            concurrent.futures.Future: Resolved with the page.
+
+        """
+        return self.executor.submit(self.read_page, *args, **kwargs)
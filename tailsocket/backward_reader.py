@@ -0,0 +1,150 @@
+"""
+Block-wise backward reading of the last lines of a file.
+
+"""
+
+import os
+import mmap
+
+BLOCK_SIZE = 8 * 1024
+
+
+def read_at(fd, size, position):
+    """Reads up to size bytes of a file from a position.
+
+    Uses positional reads for files with a descriptor, falling back to
+    seeking for other file-like objects.
+
+    """
+    try:
+        fileno = fd.fileno()
+    except (AttributeError, OSError):
+        fd.seek(position)
+        return fd.read(size)
+
+    return os.pread(fileno, size, position)
+
+
+def get_size(fd):
+    """Returns the current size of a file.
+
+    """
+    try:
+        return os.fstat(fd.fileno()).st_size
+    except (AttributeError, OSError):
+        return fd.seek(0, os.SEEK_END)
+
+
+class BackwardLineScanner():
+    """Finds line boundaries in a file scanning backwards from a position,
+    reading fixed size blocks or searching a memory map of the file.
+
+    Args:
+        fd (file-like): The file to scan.
+        block_size (Optional[int]): Size of the blocks read from the file.
+        use_mmap (Optional[bool]): Search a memory map of the file instead of
+            reading blocks, if the file can be mapped.
+
+    """
+
+    def __init__(self, fd, block_size=BLOCK_SIZE, use_mmap=False):
+        self.fd = fd
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+
+    def find_line_start(self, end, count):
+        """Returns the position of the start of the count-th line before end.
+
+        `end` is expected to be at a line boundary, i.e. the end of the file
+        or the start of a line, a newline right before it is considered the
+        terminator of the last line rather than the start of an empty one.
+
+        Args:
+            end (int): The position to scan backwards from.
+            count (int): Number of lines to step back.
+
+        Returns:
+            int: The position of the start of the line, 0 if there are fewer
+                than count lines before end.
+
+        """
+        if count <= 0 or end <= 0:
+            return end
+
+        search_end = end
+        if read_at(self.fd, 1, end - 1) == b'\n':
+            search_end -= 1
+
+        if self.use_mmap:
+            try:
+                return self._find_line_start_in_map(search_end, count)
+            except (ValueError, OSError, AttributeError):
+                # Empty or non regular files can't be mapped
+                pass
+
+        return self._find_line_start_in_blocks(search_end, count)
+
+    def _find_line_start_in_blocks(self, search_end, count):
+        found = 0
+        position = search_end
+        while position > 0:
+            block_start = max(0, position - self.block_size)
+            block = read_at(self.fd, position - block_start, block_start)
+            index = len(block)
+            while True:
+                index = block.rfind(b'\n', 0, index)
+                if index == -1:
+                    break
+                found += 1
+                if found == count:
+                    return block_start + index + 1
+
+            position = block_start
+
+        return 0
+
+    def _find_line_start_in_map(self, search_end, count):
+        with mmap.mmap(
+                self.fd.fileno(), 0, access=mmap.ACCESS_READ) as file_map:
+            index = search_end
+            for _ in range(count):
+                index = file_map.rfind(b'\n', 0, index)
+                if index == -1:
+                    return 0
+            return index + 1
+
+
+def read_lines_before(
+        fd, n, end=None, offset=None, block_size=BLOCK_SIZE, use_mmap=False):
+    """Reads n lines of a file ending `offset` lines before `end`.
+
+    Only the blocks containing the requested lines and the skipped ones are
+    scanned, and only the requested lines are read into memory.
+
+    Args:
+        fd (file-like): The file to read from.
+        n (int): Number of lines to read.
+        end (Optional[int]): Position at a line boundary to read lines
+            before, defaults to the end of the file.
+        offset (Optional[int]): Number of lines before end to skip.
+        block_size (Optional[int]): Size of the blocks read from the file.
+        use_mmap (Optional[bool]): Search a memory map of the file instead of
+            reading blocks.
+
+    Returns:
+        tuple: The list of lines as bytes and the position of the start of
+            the first one, which is greater than zero if there are more lines
+            before them.
+
+    """
+    if end is None:
+        end = get_size(fd)
+
+    scanner = BackwardLineScanner(fd, block_size=block_size, use_mmap=use_mmap)
+    lines_end = scanner.find_line_start(end, offset or 0)
+    start = scanner.find_line_start(lines_end, n)
+    if start == lines_end:
+        return [], start
+
+    lines = read_at(fd, lines_end - start, start).splitlines()
+    return lines[-n:], start
@@ -0,0 +1,91 @@
+"""
+Binary framing of the messages sent to clients negotiating it.
+
+Clients request the binary protocol with the ``tailsocket.binary.v1``
+websocket subprotocol, the rest are sent plain text messages.
+
+Every binary websocket message holds one or more messages, each made of a
+fixed size header followed by its payload::
+
+    type        uint8   one of the MESSAGE_* constants
+    flags       uint8   reserved, always 0
+    file id     uint32  id of the file, as announced by a MESSAGE_FILE
+    offset      uint64  position in the file of the end of the lines
+    line count  uint32  number of lines in the payload
+    length      uint32  length of the payload in bytes
+
+All integers are big endian, payloads are UTF-8 text, lines being separated
+by newlines.
+
+The messages of multiplexed channels are each preceded, in the same
+websocket message, by a MESSAGE_CHANNEL message whose payload is the JSON
+encoded id of their channel.
+
+"""
+
+import struct
+import collections
+
+SUBPROTOCOL = 'tailsocket.binary.v1'
+
+HEADER = struct.Struct('!BBIQII')
+
+MESSAGE_LINES = 1
+MESSAGE_STATUS = 2
+MESSAGE_ERROR = 3
+MESSAGE_FILE = 4
+MESSAGE_JSON = 5
+MESSAGE_CHANNEL = 6
+
+Message = collections.namedtuple(
+    'Message', 'type flags file_id offset line_count payload')
+
+
+def encode_message(
+        message_type, payload, file_id=0, offset=0, line_count=0, flags=0):
+    """Encodes a message with its header.
+
+    Args:
+        message_type (int): One of the MESSAGE_* constants.
+        payload (bytes): The payload.
+        file_id (Optional[int]): Id of the file the message belongs to.
+        offset (Optional[int]): Position in the file of the end of the lines.
+        line_count (Optional[int]): Number of lines in the payload.
+        flags (Optional[int]): Reserved flags.
+
+    Returns:
+        bytes: The encoded message.
+
+    """
+    return HEADER.pack(
+        message_type, flags, file_id, offset, line_count,
+        len(payload)) + payload
+
+
+def decode_messages(data):
+    """Decodes the messages of a binary websocket message.
+
+    Args:
+        data (bytes): The binary websocket message.
+
+    Returns:
+        list: The decoded `Message` tuples.
+
+    Raises:
+        ValueError: If the data is truncated.
+
+    """
+    messages = []
+    position = 0
+    while position < len(data):
+        if len(data) - position < HEADER.size:
+            raise ValueError('Truncated message header')
+
+        fields = HEADER.unpack_from(data, position)
+        start = position + HEADER.size
+        position = start + fields[-1]
+        if position > len(data):
+            raise ValueError('Truncated message payload')
+
+        messages.append(Message(*fields[:-1], payload=data[start:position]))
+    return messages
@@ -0,0 +1,186 @@
+"""
+Helpers to broadcast the same message to many websocket connections.
+
+"""
+
+import zlib
+import struct
+
+from tornado.escape import json_encode
+
+from tailsocket.binary_protocol import MESSAGE_LINES, encode_message
+
+FIN = 0x80
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+RSV1 = 0x40
+COMPRESSION_LEVEL = 6
+
+
+def build_frame(payload, opcode=OPCODE_TEXT, flags=0):
+    """Builds a single unmasked websocket frame, as sent by servers.
+
+    Args:
+        payload (bytes): The payload of the frame.
+        opcode (Optional[int]): The frame's opcode, defaults to text.
+        flags (Optional[int]): Extra bits for the first byte, e.g. RSV1.
+
+    Returns:
+        bytes: The header and the payload of the frame.
+
+    """
+    first_byte = FIN | opcode | flags
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', first_byte, length)
+    elif length <= 0xFFFF:
+        header = struct.pack('!BBH', first_byte, 126, length)
+    else:
+        header = struct.pack('!BBQ', first_byte, 127, length)
+    return header + payload
+
+
+def compress_payload(
+        payload, max_wbits=zlib.MAX_WBITS, level=COMPRESSION_LEVEL):
+    """Compresses a payload as a permessage-deflate message on its own, i.e.
+    without context takeover.
+
+    Args:
+        payload (bytes): The payload to compress.
+        max_wbits (Optional[int]): Size of the window agreed with the client.
+        level (Optional[int]): Compression level.
+
+    Returns:
+        bytes: The compressed payload.
+
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -max_wbits)
+    data = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-4]  # strip the empty block ending the sync flush
+
+
+class BroadcastMessage(str):
+    """A message to be sent to many websocket connections.
+
+    Being a `str` it can be written by any handler, but it also caches its
+    encoded payload and websocket frame so handlers able to write raw frames
+    share them instead of encoding and framing the message once each. The
+    message encoded as a JSON string is cached too, to be embedded in the
+    messages of multiplexed channels, as well as its compressed frames for
+    connections using permessage-deflate and its binary frame for
+    connections using the binary protocol.
+
+    Args:
+        text (str): The text of the message.
+        message_type (Optional[int]): Type of the message in the binary
+            protocol, defaults to lines.
+        file_id (Optional[int]): Id of the file the message belongs to.
+        offset (Optional[int]): Position in the file of the end of the lines.
+        body (Optional[str]): Text of the message in the binary protocol if
+            different, e.g. without the header line of glob batches.
+        shared (Optional[bool]): Whether the message is sent to many
+            connections. Frames of messages sent to a single one are left to
+            Tornado, building and caching them would cost more.
+
+    """
+
+    _payload = None
+    _frame = None
+    _json = None
+    _body_payload = None
+    _binary_payload = None
+    _compressed_frames = None
+
+    def __new__(
+            cls, text, message_type=MESSAGE_LINES, file_id=0, offset=0,
+            body=None, shared=True):
+        message = super().__new__(cls, text)
+        message.message_type = message_type
+        message.file_id = file_id
+        message.offset = offset
+        message.body = text if body is None else body
+        message.shared = shared
+        return message
+
+    @property
+    def payload(self):
+        """The UTF-8 encoded message.
+
+        """
+        if self._payload is None:
+            self._payload = self.encode()
+        return self._payload
+
+    @property
+    def frame(self):
+        """The text websocket frame carrying the message.
+
+        """
+        if self._frame is None:
+            self._frame = build_frame(self.payload)
+        return self._frame
+
+    @property
+    def json(self):
+        """The message encoded as a JSON string.
+
+        """
+        if self._json is None:
+            self._json = json_encode(str(self))
+        return self._json
+
+    @property
+    def body_payload(self):
+        """The UTF-8 encoded body of the message.
+
+        """
+        if self._body_payload is None:
+            self._body_payload = (
+                self.payload if self.body == self else self.body.encode())
+        return self._body_payload
+
+    @property
+    def binary_payload(self):
+        """The message encoded in the binary protocol.
+
+        """
+        if self._binary_payload is None:
+            line_count = 0
+            if self.message_type == MESSAGE_LINES and self.body:
+                line_count = self.body.count('\n') + 1
+            self._binary_payload = encode_message(
+                self.message_type, self.body_payload, file_id=self.file_id,
+                offset=self.offset, line_count=line_count)
+        return self._binary_payload
+
+    def get_frame(self, binary=False, max_wbits=None):
+        """Returns the websocket frame carrying the message, built once for
+        all the connections using the same protocol and compression.
+
+        Compressed payloads that don't shrink are sent in a plain frame,
+        which is allowed for any message of a compressed connection.
+
+        Args:
+            binary (Optional[bool]): Whether to use the binary protocol.
+            max_wbits (Optional[int]): Size of the compression window agreed
+                with the client, None for uncompressed frames.
+
+        """
+        if not binary and max_wbits is None:
+            return self.frame
+
+        if self._compressed_frames is None:
+            self._compressed_frames = {}
+
+        key = (binary, max_wbits)
+        frame = self._compressed_frames.get(key)
+        if frame is None:
+            payload = self.binary_payload if binary else self.payload
+            opcode = OPCODE_BINARY if binary else OPCODE_TEXT
+            frame = build_frame(payload, opcode=opcode)
+            if max_wbits is not None:
+                compressed = compress_payload(payload, max_wbits)
+                if len(compressed) < len(payload):
+                    frame = build_frame(compressed, opcode=opcode, flags=RSV1)
+            self._compressed_frames[key] = frame
+        return frame
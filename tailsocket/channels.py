@@ -0,0 +1,266 @@
+"""
+Multiplexing of many subscriptions over a single websocket connection.
+
+"""
+
+from tornado.escape import json_encode
+from tornado.ioloop import IOLoop
+
+from tailsocket.binary_protocol import (
+    MESSAGE_CHANNEL, MESSAGE_JSON, MESSAGE_LINES, MESSAGE_STATUS,
+    encode_message)
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.filters import FilterGroups
+from tailsocket.send_queue import count_lines
+
+
+def format_channel_message(channel_id, message):
+    """Tags a message with the id of the channel it belongs to.
+
+    Text messages are wrapped in a JSON object with the text as `data`, the
+    text of broadcast messages is JSON encoded once for all the channels
+    they are sent to. Dict messages get a `channel` key.
+
+    Args:
+        channel_id (str or int): The id of the channel.
+        message (str or dict): The message.
+
+    Returns:
+        str or dict: The tagged message.
+
+    """
+    if isinstance(message, dict):
+        return dict(message, channel=channel_id)
+
+    if isinstance(message, BroadcastMessage):
+        data = message.json
+    else:
+        data = json_encode(message)
+    return '{{"channel": {}, "data": {}}}'.format(
+        json_encode(channel_id), data)
+
+
+class ChannelMessage(BroadcastMessage):
+    """A message of a channel sent with the binary protocol, preceded by a
+    MESSAGE_CHANNEL message with the id of the channel.
+
+    The binary payload of the message is shared with the other channels it
+    is sent to, only the channel message is encoded for each of them.
+
+    Args:
+        channel_id (str or int): The id of the channel.
+        message (str or dict): The message, text messages being sent as
+            status messages and dicts as JSON messages.
+
+    """
+
+    def __new__(cls, channel_id, message):
+        if isinstance(message, dict):
+            message = BroadcastMessage(
+                json_encode(message), message_type=MESSAGE_JSON)
+        elif not isinstance(message, BroadcastMessage):
+            message = BroadcastMessage(message, message_type=MESSAGE_STATUS)
+
+        tagged = super().__new__(
+            cls, message, message_type=message.message_type,
+            file_id=message.file_id, offset=message.offset,
+            body=message.body, shared=False)
+        tagged.channel_id = channel_id
+        tagged.message = message
+        return tagged
+
+    @property
+    def binary_payload(self):
+        """The channel message followed by the message, encoded in the
+        binary protocol.
+
+        """
+        if self._binary_payload is None:
+            channel = encode_message(
+                MESSAGE_CHANNEL, json_encode(self.channel_id).encode())
+            self._binary_payload = channel + self.message.binary_payload
+        return self._binary_payload
+
+
+class Channel():
+    """A subscription to a file, or files matching a glob pattern, sharing a
+    websocket connection with others.
+
+    Channels tag the messages they receive from their `ChannelGroup` with
+    their id before queueing them on the connection, as JSON objects or, on
+    connections using the binary protocol, as `ChannelMessage`.
+
+    Args:
+        connection (TailWebSocketHandler): The connection of the channel.
+        channel_id (str or int): The id of the channel, chosen by the client.
+        filename (str): Path or glob pattern of the subscription.
+
+    """
+
+    def __init__(self, connection, channel_id, filename):
+        self.connection = connection
+        self.channel_id = channel_id
+        self.filename = filename
+
+    def __repr__(self):
+        return '<Channel {} {}>'.format(self.channel_id, self.filename)
+
+    def write_message(self, message, binary=False):
+        """Queues a message tagged with the id of the channel on the
+        connection.
+
+        The lines of the message are counted before tagging it, as newlines
+        are escaped in its JSON.
+
+        """
+        if self.connection.binary_protocol:
+            tagged = ChannelMessage(self.channel_id, message)
+        else:
+            tagged = format_channel_message(self.channel_id, message)
+        self.connection.write_message(
+            tagged, binary, lines=count_lines(message),
+            channel=self.channel_id)
+
+
+class ChannelGroup():
+    """The channels of a connection subscribed to the same file or glob
+    pattern.
+
+    The group is registered in the registry once for all of them, with no
+    filter, and gives each channel the lines passing its filter, so the
+    bookkeeping of the registry doesn't grow with the number of channels.
+
+    Each channel is sent its own initial lines by a `PendingChannel`
+    registered until it receives them, the initial lines of the group
+    itself are dropped.
+
+    Args:
+        connection (TailWebSocketHandler): The connection of the channels.
+        filename (str): Path or glob pattern of the subscriptions.
+
+    """
+
+    def __init__(self, connection, filename):
+        self.connection = connection
+        self.filename = filename
+        self.filter_groups = FilterGroups()
+        self.pending = {}
+        self.started = False
+
+    def __len__(self):
+        return sum(
+            len(channels) for channels in self.filter_groups.groups.values()
+        ) + len(self.pending)
+
+    def __repr__(self):
+        return '<ChannelGroup {}>'.format(self.filename)
+
+    def add(self, channel, line_filter=None, resume_from=None):
+        """Adds a channel, which receives the lines of the group once sent
+        its initial lines.
+
+        Args:
+            channel (Channel): The channel.
+            line_filter (Optional[LineFilter]): Filter of the lines to send.
+            resume_from (Optional[int]): Offset to resume the tail from.
+
+        """
+        pending = PendingChannel(self, channel, line_filter)
+        self.pending[channel] = pending
+        try:
+            self.connection.add_to_registry(
+                pending, self.filename, line_filter, resume_from)
+        except Exception:
+            del self.pending[channel]
+            raise
+
+    def start(self, pending):
+        """Starts sending the lines of the group to a channel sent its
+        initial lines, removing its `PendingChannel` from the registry.
+
+        The removal is deferred as the registry may be sending to it.
+
+        """
+        if self.pending.get(pending.channel) is not pending:
+            return
+
+        del self.pending[pending.channel]
+        self.filter_groups.add(pending.channel, pending.line_filter)
+        IOLoop.current().add_callback(
+            self.connection.remove_from_registry, pending, self.filename)
+
+    def remove(self, channel):
+        """Removes a channel.
+
+        """
+        pending = self.pending.pop(channel, None)
+        if pending is not None:
+            self.connection.remove_from_registry(pending, self.filename)
+        else:
+            self.filter_groups.remove(channel)
+
+    def write_message(self, message, binary=False):
+        """Writes a message of the registry to the channels, lines messages
+        being filtered for each of them.
+
+        """
+        if not self.started:
+            self.started = True
+            return
+
+        groups = self.filter_groups.groups
+        if not (self.filter_groups.filtered and
+                isinstance(message, BroadcastMessage) and
+                message.message_type == MESSAGE_LINES):
+            for channels in list(groups.values()):
+                for channel in channels:
+                    channel.write_message(message, binary)
+            return
+
+        # Header of glob batches, empty for the lines of a single file
+        header = message[:len(message) - len(message.body)]
+        selected = self.filter_groups.select(message.body.split('\n'))
+        for line_filter, channels in list(groups.items()):
+            group_message = message
+            if line_filter is not None:
+                if not selected[line_filter]:
+                    continue
+                body = '\n'.join(selected[line_filter])
+                group_message = BroadcastMessage(
+                    header + body, file_id=message.file_id,
+                    offset=message.offset, body=body)
+            for channel in channels:
+                channel.write_message(group_message, binary)
+
+
+class PendingChannel():
+    """Registered in the registry for a channel joining a `ChannelGroup`
+    until the channel is sent its initial lines.
+
+    Args:
+        group (ChannelGroup): The group.
+        channel (Channel): The channel.
+        line_filter (Optional[LineFilter]): Filter of the channel.
+
+    """
+
+    def __init__(self, group, channel, line_filter=None):
+        self.group = group
+        self.channel = channel
+        self.line_filter = line_filter
+        self.done = False
+
+    def __repr__(self):
+        return '<PendingChannel {}>'.format(self.channel.channel_id)
+
+    def write_message(self, message, binary=False):
+        """Writes the initial lines to the channel, later messages are sent
+        to it by the group.
+
+        """
+        if self.done:
+            return
+
+        self.done = True
+        self.channel.write_message(message, binary)
+        self.group.start(self)
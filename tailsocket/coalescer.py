@@ -0,0 +1,101 @@
+"""
+Coalescing of bursts of new content into batched messages.
+
+"""
+
+import asyncio
+
+
+class Coalescer():
+    """Collects the chunks of new content read from a file and flushes them
+    as a single batch.
+
+    The first chunk after a quiet period is flushed right away, chunks
+    arriving less than `window` seconds after the last flush are held back
+    until the window elapses, bounding the latency of any chunk to the length
+    of the window. Pending content reaching `max_bytes` is flushed right away.
+
+    Also keeps count of the chunks received and batches flushed to measure
+    how much merging happened.
+
+    Args:
+        callback (callable): Called with the batched message on every flush.
+        window (Optional[float]): Coalescing window in seconds, the default
+            of 0 disables coalescing.
+        max_bytes (Optional[int]): Size of the pending content that forces a
+            flush regardless of the window, measured on the decoded text.
+
+    """
+
+    def __init__(self, callback, window=0, max_bytes=64 * 1024):
+        self.callback = callback
+        self.window = window
+        self.max_bytes = max_bytes
+        self.chunks_received = 0
+        self.batches_flushed = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush = None
+        self._timer = None
+
+    @property
+    def merged(self):
+        """Number of chunks that did not need a message of their own.
+
+        """
+        return self.chunks_received - self.batches_flushed
+
+    def add(self, chunk):
+        """Adds a chunk of content, flushing immediately if the file was quiet
+        or scheduling a flush at the end of the coalescing window otherwise.
+
+        Args:
+            chunk (str): The new content.
+
+        """
+        self.chunks_received += 1
+        self._pending.append(chunk)
+        self._pending_bytes += len(chunk)
+
+        if self._pending_bytes >= self.max_bytes:
+            self.flush()
+            return
+
+        if self._timer is not None:
+            return
+
+        loop = asyncio.get_event_loop()
+        if (not self.window or self._last_flush is None or
+                loop.time() - self._last_flush >= self.window):
+            self.flush()
+        else:
+            self._timer = loop.call_at(
+                self._last_flush + self.window, self.flush)
+
+    def flush(self):
+        """Sends any pending content as a single message.
+
+        """
+        self._cancel_timer()
+        if not self._pending:
+            return
+
+        message = '\n'.join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self._last_flush = asyncio.get_event_loop().time()
+        self.batches_flushed += 1
+        self.callback(message)
+
+    def cancel(self):
+        """Discards any pending content and scheduled flush.
+
+        """
+        self._cancel_timer()
+        self._pending = []
+        self._pending_bytes = 0
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,261 @@
+"""
+Server-side filtering of the lines sent to each subscriber of a file.
+
+"""
+
+import re
+
+LEVELS = (
+    ('TRACE',),
+    ('DEBUG',),
+    ('INFO',),
+    ('WARNING', 'WARN'),
+    ('ERROR',),
+    ('CRITICAL', 'FATAL'),
+)
+
+
+def get_pattern(spec):
+    """Returns the regular expression matching a pattern specification.
+
+    Args:
+        spec (str or dict): A substring, or a dict with either a `substring`
+            or a `regex` key.
+
+    Raises:
+        ValueError: If the specification or the regular expression is not
+            valid.
+
+    """
+    if isinstance(spec, str):
+        return re.escape(spec)
+
+    if isinstance(spec, dict) and 'substring' in spec:
+        return re.escape(spec['substring'])
+
+    if isinstance(spec, dict) and 'regex' in spec:
+        try:
+            re.compile(spec['regex'])
+        except re.error as e:
+            raise ValueError('Invalid regex {}: {}'.format(spec['regex'], e))
+        return spec['regex']
+
+    raise ValueError('Invalid filter pattern {}'.format(spec))
+
+
+def get_level_pattern(level):
+    """Returns the regular expression matching the names of a log level and
+    the ones above it.
+
+    Args:
+        level (str): The minimum log level, e.g. `WARNING`.
+
+    Raises:
+        ValueError: If the level is not known.
+
+    """
+    level = level.upper()
+    for i, names in enumerate(LEVELS):
+        if level in names:
+            return r'\b(?:{})\b'.format('|'.join(
+                name for names in LEVELS[i:] for name in names))
+
+    raise ValueError('Unknown log level {}'.format(level))
+
+
+class LineFilter():
+    """Include and exclude patterns chosen by a subscriber.
+
+    A line passes the filter if it matches any of the include patterns, if
+    there are any, none of the exclude patterns and the log level pattern
+    if a level was given. Filters with the same patterns are equal so
+    subscribers using them can be grouped.
+
+    Args:
+        include (Optional[iterable]): Pattern specifications of the lines to
+            send, see `get_pattern`.
+        exclude (Optional[iterable]): Pattern specifications of the lines not
+            to send.
+        level (Optional[str]): Minimum log level of the lines to send.
+
+    """
+
+    def __init__(self, include=(), exclude=(), level=None):
+        self.include = tuple(sorted(set(get_pattern(p) for p in include)))
+        self.exclude = tuple(sorted(set(get_pattern(p) for p in exclude)))
+        self.level = get_level_pattern(level) if level else None
+        self.key = (self.include, self.exclude, self.level)
+
+    @classmethod
+    def from_request(cls, request):
+        """Creates a filter from the `include`, `exclude` and `level` keys of a
+        request, returning None if there are no filters in it.
+
+        """
+        if not any(request.get(k) for k in ('include', 'exclude', 'level')):
+            return None
+
+        return cls(
+            include=request.get('include') or (),
+            exclude=request.get('exclude') or (),
+            level=request.get('level'))
+
+    def __eq__(self, other):
+        return isinstance(other, LineFilter) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    @property
+    def patterns(self):
+        """All the patterns used by the filter.
+
+        """
+        patterns = self.include + self.exclude
+        if self.level is not None:
+            patterns += (self.level,)
+        return patterns
+
+    @property
+    def accepts_unmatched(self):
+        """True if lines matching none of the patterns pass the filter.
+
+        """
+        return not self.include and self.level is None
+
+    def accepts(self, matched):
+        """Returns True if a line passes the filter.
+
+        Args:
+            matched (callable): Returns True if the line matches a pattern.
+
+        """
+        if self.level is not None and not matched(self.level):
+            return False
+        if self.include and not any(matched(p) for p in self.include):
+            return False
+        return not any(matched(p) for p in self.exclude)
+
+    def filter_lines(self, lines):
+        """Returns the lines passing the filter.
+
+        """
+        groups = FilterGroups()
+        groups.add(None, self)
+        return groups.select(lines)[self]
+
+
+class FilterGroups():
+    """Subscribers of a file grouped by their filters.
+
+    All the lines of a message are matched against the distinct patterns of
+    all the filters at once: a single regular expression combining them is
+    searched first, lines matching none of the patterns are only given to
+    the filters accepting them, and only for the remaining lines each
+    distinct pattern is searched, at most once per line regardless of how
+    many filters use it.
+
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self._compiled = {}
+        self._combined = None
+
+    def __len__(self):
+        return len(self.groups)
+
+    @property
+    def filtered(self):
+        """True if any of the subscribers uses a filter.
+
+        """
+        return any(line_filter is not None for line_filter in self.groups)
+
+    def add(self, handler, line_filter=None):
+        """Adds a subscriber with an optional filter.
+
+        """
+        self.groups.setdefault(line_filter, []).append(handler)
+        self._compile()
+
+    def remove(self, handler):
+        """Removes a subscriber.
+
+        """
+        for line_filter, handlers in list(self.groups.items()):
+            if handler in handlers:
+                handlers.remove(handler)
+                if not handlers:
+                    del self.groups[line_filter]
+                    self._compile()
+                return
+
+    def split(self, message):
+        """Splits a message into the messages for each group of subscribers.
+
+        Args:
+            message (str): Lines of a file separated by newlines.
+
+        Returns:
+            list: Tuples of the message and list of handlers of each group,
+                groups with no lines passing their filter are left out.
+
+        """
+        if not self.filtered:
+            return list((message, h) for h in self.groups.values())
+
+        selected = self.select(message.split('\n'))
+        messages = []
+        for line_filter, handlers in self.groups.items():
+            if line_filter is None:
+                messages.append((message, handlers))
+            elif selected[line_filter]:
+                messages.append(('\n'.join(selected[line_filter]), handlers))
+        return messages
+
+    def select(self, lines):
+        """Returns the lines passing each of the filters.
+
+        Args:
+            lines (list): The lines to filter.
+
+        Returns:
+            dict: The filters as keys and lists of lines as values.
+
+        """
+        filters = [f for f in self.groups if f is not None]
+        selected = {f: [] for f in filters}
+        accepting_unmatched = [f for f in filters if f.accepts_unmatched]
+        for line in lines:
+            if self._combined is not None and not self._combined.search(line):
+                for line_filter in accepting_unmatched:
+                    selected[line_filter].append(line)
+                continue
+
+            results = {}
+
+            def matched(pattern):
+                if pattern not in results:
+                    results[pattern] = bool(
+                        self._compiled[pattern].search(line))
+                return results[pattern]
+
+            for line_filter in filters:
+                if line_filter.accepts(matched):
+                    selected[line_filter].append(line)
+
+        return selected
+
+    def _compile(self):
+        patterns = sorted(set(
+            pattern for line_filter in self.groups if line_filter is not None
+            for pattern in line_filter.patterns))
+        self._compiled = {pattern: re.compile(pattern) for pattern in patterns}
+        try:
+            self._combined = re.compile('|'.join(
+                '(?:{})'.format(pattern) for pattern in patterns)) if (
+                    patterns) else None
+        except re.error:
+            # Patterns with backreferences or named groups can't be combined
+            self._combined = None
@@ -0,0 +1,290 @@
+"""
+Tailing of all the files matching a glob pattern as a single stream.
+
+"""
+
+import os
+import glob
+import asyncio
+import fnmatch
+import logging
+import collections
+
+from tailsocket.line_assembler import LineAssembler
+
+logger = logging.getLogger('tornado.application')
+
+HEADER = '==> {} <=='
+
+
+def is_glob(path):
+    """Returns True if a path contains glob wildcards.
+
+    """
+    return any(c in path for c in '*?[')
+
+
+def split_path(path):
+    """Returns the segments of an absolute path.
+
+    """
+    return [segment for segment in path.split(os.sep) if segment]
+
+
+def match_segments(segments, patterns):
+    """Returns True if each path segment matches the glob pattern in the same
+    position, so wildcards never match across directories.
+
+    """
+    return len(segments) == len(patterns) and all(
+        fnmatch.fnmatchcase(segment, pattern)
+        for segment, pattern in zip(segments, patterns))
+
+
+class GlobReader():
+    """Tails the files matching a glob pattern.
+
+    Matching files are tracked by their offset and identity only, they are
+    opened when they have new content to be read and kept open in a cache of
+    at most `max_open_files` descriptors, so idle files cost no descriptor.
+
+    Only the directories that may contain matches need to be watched, new
+    matching files and directories are added as they are created without
+    expanding the whole pattern again.
+
+    Args:
+        pattern (str): Absolute glob pattern, wildcards may be used in any
+            segment of the path.
+        callback (callable): Called with the path of a file and the list of
+            new complete lines read from it.
+        max_open_files (Optional[int]): Maximum number of files kept open.
+
+    """
+
+    read_chunk_size = 64 * 1024
+    read_budget_bytes = 256 * 1024
+
+    def __init__(self, pattern, callback, max_open_files=128):
+        self.pattern = pattern
+        self.callback = callback
+        self.max_open_files = max_open_files
+        self.files = {}
+        self.segments = split_path(pattern)
+        root = []
+        for segment in self.segments[:-1]:
+            if is_glob(segment):
+                break
+            root.append(segment)
+        self.root = os.sep + os.path.join(*root) if root else os.sep
+        self._open_files = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.files)
+
+    def matches(self, path):
+        """Returns True if a path matches the pattern.
+
+        """
+        return match_segments(split_path(path), self.segments)
+
+    def matches_directory(self, path):
+        """Returns True if a directory may contain matching files, i.e. it is
+        the deepest directory without wildcards of the pattern or matches
+        the pattern of a directory below it.
+
+        """
+        segments = split_path(path)
+        if len(segments) < len(split_path(self.root)):
+            return False
+        return match_segments(segments, self.segments[:len(segments)]) and (
+            len(segments) < len(self.segments))
+
+    def get_directories(self, directory=None):
+        """Returns the existing directories that may contain matching files
+        or directories.
+
+        Args:
+            directory (Optional[str]): Only look for directories in a
+                directory, e.g. one just created, and include it.
+
+        """
+        base = directory or self.root
+        directories = [base] if os.path.isdir(base) else []
+        depth = len(split_path(base))
+        for end in range(depth + 1, len(self.segments)):
+            directories.extend(
+                path for path in glob.glob(
+                    os.path.join(base, *self.segments[depth:end]))
+                if os.path.isdir(path))
+        return directories
+
+    def scan(self, directory=None, from_start=False):
+        """Tracks the files matching the pattern, reading them from their end
+        or their start if `from_start`.
+
+        Args:
+            directory (Optional[str]): Only look for matches in a directory,
+                e.g. one just created.
+            from_start (Optional[bool]): Read the files from their start.
+
+        Returns:
+            list: The paths of the files tracked.
+
+        """
+        pattern = self.pattern
+        if directory is not None:
+            depth = len(split_path(directory))
+            pattern = os.path.join(directory, *self.segments[depth:])
+
+        tracked = []
+        for path in glob.glob(pattern):
+            if path not in self.files and os.path.isfile(path):
+                self.track(path, from_start=from_start)
+                tracked.append(path)
+        return tracked
+
+    def track(self, path, from_start=False):
+        """Starts tracking a file, reading it from its end or its start.
+
+        If the file was tracked already it is assumed to be replaced by a
+        new file, the old one is read to its end before switching.
+
+        Args:
+            path (str): Path of the file.
+            from_start (Optional[bool]): Read the file from its start.
+
+        """
+        if path in self.files:
+            if path in self._open_files:
+                # Drain the replaced file, still open
+                self.read(path)
+            lines = self.files[path]['assembler'].flush()
+            if lines:
+                self.callback(path, lines)
+            self.close_file(path)
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+
+        self.files[path] = {
+            'offset': 0 if from_start else stat.st_size,
+            'identity': (stat.st_dev, stat.st_ino),
+            'assembler': LineAssembler(),
+        }
+
+    def untrack(self, path):
+        """Stops tracking a file.
+
+        """
+        self.close_file(path)
+        self.files.pop(path, None)
+
+    def open_file(self, path):
+        """Returns the open file of a tracked path, opening it if needed and
+        closing the least recently used file if too many are open.
+
+        A file opened again having a different identity than when tracked
+        has been replaced and is read from its start.
+
+        """
+        if path in self._open_files:
+            self._open_files.move_to_end(path)
+            return self._open_files[path]
+
+        record = self.files[path]
+        fd = open(path, 'rb', buffering=0)
+        stat = os.fstat(fd.fileno())
+        if (stat.st_dev, stat.st_ino) != record['identity']:
+            record['identity'] = (stat.st_dev, stat.st_ino)
+            record['offset'] = 0
+            record['assembler'].reset()
+
+        self._open_files[path] = fd
+        while len(self._open_files) > self.max_open_files:
+            _, old_fd = self._open_files.popitem(last=False)
+            old_fd.close()
+        return fd
+
+    def close_file(self, path):
+        """Closes the file of a tracked path if open.
+
+        """
+        fd = self._open_files.pop(path, None)
+        if fd is not None:
+            fd.close()
+
+    def read(self, path):
+        """Reads the new content of a tracked file passing the lines it
+        completes to the callback.
+
+        At most `read_budget_bytes` are read at once, the rest of the
+        content is read in later iterations of the event loop.
+
+        Args:
+            path (str): Path of the file.
+
+        """
+        record = self.files.get(path)
+        if record is None:
+            return
+
+        try:
+            fd = self.open_file(path)
+        except FileNotFoundError:
+            self.untrack(path)
+            return
+
+        fileno = fd.fileno()
+        chunks = []
+        remaining = self.read_budget_bytes
+        while remaining > 0:
+            size = min(self.read_chunk_size, remaining)
+            remaining -= size
+            chunk = os.pread(fileno, size, record['offset'])
+            record['offset'] += len(chunk)
+            chunks.append(chunk)
+            if len(chunk) < size:
+                break
+        else:
+            asyncio.get_event_loop().call_soon(self.read, path)
+
+        content = b''.join(chunks)
+        if not content and os.fstat(fileno).st_size < record['offset']:
+            logger.info('Detected truncation of %s', path)
+            record['offset'] = 0
+            record['assembler'].reset()
+            return self.read(path)
+
+        lines = record['assembler'].feed(content)
+        if lines:
+            self.callback(path, lines)
+
+    def poll(self):
+        """Tracks new matching files and reads the files that changed, for
+        platforms where directories can't be watched.
+
+        """
+        self.scan(from_start=True)
+        for path, record in list(self.files.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.untrack(path)
+                continue
+
+            if (stat.st_dev, stat.st_ino) != record['identity']:
+                self.track(path, from_start=True)
+                self.read(path)
+            elif stat.st_size != record['offset']:
+                self.read(path)
+
+    def close(self):
+        """Closes all the open files and stops tracking them.
+
+        """
+        for fd in self._open_files.values():
+            fd.close()
+        self._open_files.clear()
+        self.files.clear()
@@ -0,0 +1,99 @@
+"""
+Assembly of complete lines from the chunks of bytes read from a file.
+
+"""
+
+import codecs
+
+
+class LineAssembler():
+    """Splits chunks of bytes into complete lines, carrying an incomplete
+    trailing line over to the next chunk.
+
+    Only complete lines are decoded, so multi-byte characters split across
+    reads never reach the decoder half way. Chunks are decoded straight from
+    a memory view and only an incomplete trailing line is copied to be kept.
+
+    A line growing beyond `max_line_length` bytes is emitted in pieces to
+    bound the memory kept for files that never write a newline, the decoder
+    is incremental so those pieces are split at character boundaries.
+
+    Args:
+        encoding (Optional[str]): Encoding of the file, defaults to UTF-8.
+        errors (Optional[str]): Error handler for undecodable bytes, defaults
+            to replacing them.
+        max_line_length (Optional[int]): Size of an incomplete line that is
+            emitted regardless.
+
+    """
+
+    def __init__(
+            self, encoding='utf-8', errors='replace',
+            max_line_length=1024 * 1024):
+        self.max_line_length = max_line_length
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors)
+        self._partial = bytearray()
+
+    @property
+    def pending(self):
+        """Number of bytes of the incomplete line carried over.
+
+        """
+        return len(self._partial)
+
+    def feed(self, data):
+        """Adds a chunk of bytes returning the lines it completes.
+
+        Args:
+            data (bytes): The chunk read from the file.
+
+        Returns:
+            list: The complete lines as strings without line terminators.
+
+        """
+        view = memoryview(data)
+        end = data.rfind(b'\n') + 1
+        if not end:
+            self._partial.extend(view)
+            if len(self._partial) < self.max_line_length:
+                return []
+
+            text = self._decoder.decode(self._partial)
+            del self._partial[:]
+            return [text]
+
+        if self._partial:
+            self._partial.extend(view[:end])
+            text = self._decoder.decode(self._partial)
+            del self._partial[:]
+        else:
+            text = self._decoder.decode(view[:end])
+
+        self._partial.extend(view[end:])
+        lines = text.split('\n')
+        lines.pop()  # the text ends with a newline
+        if '\r' in text:
+            lines = [line.rstrip('\r') for line in lines]
+        return lines
+
+    def flush(self):
+        """Returns the incomplete line carried over as a final line, e.g. once
+        a rotated file has been read to its end.
+
+        Returns:
+            list: The incomplete line if there was one.
+
+        """
+        if not self._partial:
+            return []
+
+        text = self._decoder.decode(self._partial, True)
+        del self._partial[:]
+        return [text]
+
+    def reset(self):
+        """Discards any incomplete line, e.g. after the file is truncated.
+
+        """
+        del self._partial[:]
+        self._decoder.reset()
@@ -0,0 +1,135 @@
+"""
+Sparse index of line positions to page through large files.
+
+"""
+
+import asyncio
+import bisect
+
+from tailsocket.backward_reader import read_at
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class SparseLineIndex():
+    """Keeps the position of the start of every `interval`-th line of a file.
+
+    The index is built by feeding it the contents of the file in order, so
+    it can be built in the background and extended with the new content as
+    the file grows. Finding the position of a line or the line at a position
+    costs a seek to the closest checkpoint and a scan of at most `interval`
+    lines instead of a scan from the start or the end of the file.
+
+    Args:
+        interval (Optional[int]): Number of lines between checkpoints.
+
+    """
+
+    def __init__(self, interval=1000):
+        self.interval = interval
+        self.checkpoints = [0]
+        self.indexed_bytes = 0
+        self.lines = 0
+
+    def feed(self, data):
+        """Indexes the next chunk of the file.
+
+        Args:
+            data (bytes): The content of the file following the indexed part.
+
+        """
+        newlines = data.count(b'\n')
+        until_checkpoint = self.interval - self.lines % self.interval
+        index = -1
+        count = 0
+        while until_checkpoint <= newlines:
+            while count < until_checkpoint:
+                index = data.find(b'\n', index + 1)
+                count += 1
+            self.checkpoints.append(self.indexed_bytes + index + 1)
+            until_checkpoint += self.interval
+
+        self.lines += newlines
+        self.indexed_bytes += len(data)
+
+    def reset(self):
+        """Discards the index, e.g. after the file is truncated.
+
+        """
+        self.checkpoints = [0]
+        self.indexed_bytes = 0
+        self.lines = 0
+
+    def covers(self, position):
+        """Returns True if the index can be used to locate position.
+
+        """
+        return position <= self.indexed_bytes
+
+    def get_line_number(self, fd, position):
+        """Returns the number of complete lines before a position.
+
+        Args:
+            fd (file-like): The indexed file.
+            position (int): A position in the indexed part of the file.
+
+        """
+        checkpoint = bisect.bisect_right(self.checkpoints, position) - 1
+        start = self.checkpoints[checkpoint]
+        count = read_at(fd, position - start, start).count(b'\n')
+        return checkpoint * self.interval + count
+
+    def get_position(self, fd, line_number):
+        """Returns the position of the start of a line.
+
+        Args:
+            fd (file-like): The indexed file.
+            line_number (int): The zero-based number of the line.
+
+        Returns:
+            int: The position, or None if the line is not indexed.
+
+        """
+        if line_number < 0 or line_number > self.lines:
+            return None
+
+        checkpoint, remaining = divmod(line_number, self.interval)
+        position = self.checkpoints[checkpoint]
+        while remaining:
+            block = read_at(fd, CHUNK_SIZE, position)
+            if not block:
+                return None
+
+            index = -1
+            while remaining:
+                index = block.find(b'\n', index + 1)
+                if index == -1:
+                    break
+                remaining -= 1
+
+            position += len(block) if index == -1 else index + 1
+
+        return position
+
+    @asyncio.coroutine
+    def build(self, fd, get_end, chunk_size=CHUNK_SIZE):
+        """Indexes the file up to its end in chunks, read in an executor so
+        indexing a large file doesn't block the event loop.
+
+        Args:
+            fd (file-like): The file to index, with a descriptor so it can be
+                read with positional reads from another thread.
+            get_end (callable): Returns the position up to which the file
+                should be indexed, checked after every chunk as it may grow.
+            chunk_size (Optional[int]): Size of the chunks read.
+
+        """
+        loop = asyncio.get_event_loop()
+        while self.indexed_bytes < get_end():
+            size = min(chunk_size, get_end() - self.indexed_bytes)
+            data = yield from loop.run_in_executor(
+                None, read_at, fd, size, self.indexed_bytes)
+            if not data:
+                # The file was truncated below the end meanwhile
+                return
+            self.feed(data)
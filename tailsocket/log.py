@@ -1,4 +1,8 @@
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 
 from tornado.options import define, options
 
@@ -26,17 +30,99 @@ LOGGING_MAPPING = {
     'none': logging.NOTSET,
 }
 
+# The listener writing the records to the files and the handlers queueing
+# them, set up by `setup_logging`
+listener = None
+queue_handlers = {}
+
 
 def setup_logging():
     """Setup logging for the application based on the Tornado options.
 
+    The loggers put their records in a queue and a background thread writes
+    them to the files, so logging never blocks the event loop on the disk.
+    Calling it again replaces the previous setup.
+
     """
+    global listener
+    stop_logging()
+
+    records = queue.Queue()
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handlers = []
     for name, logger in loggers.items():
         logger.setLevel(LOGGING_MAPPING.get(options.logging, logging.DEBUG))
         handler = logging.FileHandler(
             getattr(options, '{}_log_file_path'.format(name))
         )
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        # All the records go through the same queue
+        handler.addFilter(logging.Filter(logger.name))
+        file_handlers.append(handler)
+
+        queue_handlers[name] = logging.handlers.QueueHandler(records)
+        logger.addHandler(queue_handlers[name])
+
+    listener = logging.handlers.QueueListener(records, *file_handlers)
+    listener.start()
+
+
+def stop_logging():
+    """Writes the records left in the queue and closes the log files.
+
+    """
+    global listener
+    for name, handler in list(queue_handlers.items()):
+        loggers[name].removeHandler(handler)
+        del queue_handlers[name]
+
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+
+
+atexit.register(stop_logging)
+
+
+class RateLimitedLog():
+    """Logs a message at most once per interval, along with the number of
+    times it was logged, for events too frequent to log every time.
+
+    Args:
+        logger (logging.Logger): The logger.
+        level (int): The level of the message.
+        interval (Optional[float]): Minimum seconds between messages.
+
+    """
+
+    def __init__(self, logger, level, interval=1):
+        self.logger = logger
+        self.level = level
+        self.interval = interval
+        self.count = 0
+        self.last_time = None
+
+    def log(self, message, *args):
+        """Counts the message, logging it if the interval has passed.
+
+        Args:
+            message (str): The message, formatted with `args` only if logged.
+            *args: The arguments of the message.
+
+        """
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        self.count += 1
+        now = time.monotonic()
+        if self.last_time is not None and now - self.last_time < self.interval:
+            return
+
+        self.logger.log(
+            self.level, message + ' (%d times in the last %.1fs)',
+            *(args + (self.count, now - (self.last_time or now))))
+        self.count = 0
+        self.last_time = now
@@ -0,0 +1,281 @@
+"""
+Metrics of the tailing and broadcast pipeline in the Prometheus text format.
+
+Counters and histograms updated as lines are read and sent are module level
+instances, the state of the registry and the connections is collected when
+the metrics are requested.
+
+"""
+
+import bisect
+import collections
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUEUE_BYTES_BUCKETS = (
+    0, 1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024)
+
+
+def format_labels(names, values, extra=()):
+    """Returns the label set of a sample, e.g. ``{file="/var/log/syslog"}``.
+
+    """
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs))
+
+
+def format_value(value):
+    """Returns a sample value as formatted by Prometheus.
+
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    """Base of the metrics, a family of samples identified by their labels.
+
+    Args:
+        name (str): Name of the metric.
+        documentation (str): Help text of the metric.
+        labels (Optional[tuple]): Names of the labels of the samples.
+
+    """
+
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def get_samples(self):
+        """Returns the samples of the metric as (suffix, labels, extra labels,
+        value) tuples.
+
+        """
+        raise NotImplementedError()
+
+    def render(self):
+        """Returns the metric in the Prometheus text format.
+
+        """
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.metric_type),
+        ]
+        for suffix, labels, extra, value in self.get_samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix,
+                format_labels(self.label_names, labels, extra),
+                format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A value that only increases.
+
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = collections.defaultdict(int)
+
+    def inc(self, *labels, amount=1):
+        """Increases the sample of the given label values.
+
+        """
+        self.values[labels] += amount
+
+    def remove(self, *labels):
+        """Removes the sample of the given label values, e.g. of a file no
+        longer read.
+
+        """
+        self.values.pop(labels, None)
+
+    def get_samples(self):
+        return [('', labels, (), value)
+                for labels, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    """A value that may go up and down, usually set when collecting.
+
+    """
+
+    metric_type = 'gauge'
+
+    def set(self, *labels, value):
+        """Sets the sample of the given label values.
+
+        """
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative buckets.
+
+    Args:
+        buckets (tuple): Upper bounds of the buckets, sorted.
+
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = collections.defaultdict(float)
+
+    def observe(self, value, *labels):
+        """Counts an observation in the buckets of the given label values.
+
+        """
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def get_samples(self):
+        samples = []
+        for labels, counts in sorted(self.counts.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                samples.append(
+                    ('_bucket', labels, (('le', format_value(bound)),),
+                     total))
+            samples.append(('_sum', labels, (), self.sums[labels]))
+            samples.append(('_count', labels, (), total))
+        return samples
+
+
+FILE_EVENTS = Counter(
+    'tailsocket_file_events_total',
+    'Reads of a file returning new content', ('file',))
+FILE_EVENTS_RECEIVED = Counter(
+    'tailsocket_file_events_received_total',
+    'Change events received for a file, including the ones handled by a '
+    'single read', ('file',))
+FILE_BATCHES = Counter(
+    'tailsocket_file_batches_total',
+    'Batches of lines of a file sent to its subscribers', ('file',))
+READ_BYTES = Counter(
+    'tailsocket_read_bytes_total', 'Bytes read from a file', ('file',))
+READ_LINES = Counter(
+    'tailsocket_read_lines_total', 'Complete lines read from a file',
+    ('file',))
+MESSAGES_SENT = Counter(
+    'tailsocket_messages_sent_total',
+    'Messages written to websocket connections')
+BYTES_SENT = Counter(
+    'tailsocket_bytes_sent_total',
+    'Payload bytes written to websocket connections')
+TAILER_SKIPPED_LINES = Counter(
+    'tailsocket_tailer_skipped_lines_total',
+    'Lines the tailer dropped while the worker fell behind')
+READ_TO_SEND_SECONDS = Histogram(
+    'tailsocket_read_to_send_seconds',
+    'Time from reading new content of a file to handing its lines to the '
+    'subscribers', buckets=LATENCY_BUCKETS)
+LOOP_LAG_SECONDS = Histogram(
+    'tailsocket_loop_lag_seconds',
+    'Delay of the event loop running a callback scheduled at regular '
+    'intervals', buckets=LAG_BUCKETS)
+SLOW_CALLBACKS = Counter(
+    'tailsocket_slow_callbacks_total',
+    'Calls of a callback taking longer than the slow callback threshold',
+    ('callback',))
+
+# Metrics labelled by file, whose samples are removed with the readers
+FILE_METRICS = (FILE_EVENTS_RECEIVED, FILE_EVENTS, FILE_BATCHES, READ_BYTES,
+                READ_LINES)
+
+
+def remove_file(path):
+    """Removes the samples of a file from the metrics labelled by file.
+
+    """
+    for metric in FILE_METRICS:
+        metric.remove(path)
+
+
+def collect(app):
+    """Returns the metrics describing the current state of an application.
+
+    Args:
+        app (TailSocketApplication): The application.
+
+    Returns:
+        list: The metrics.
+
+    """
+    registry = app.registry
+
+    files_watched = Gauge(
+        'tailsocket_files_watched',
+        'Files being tailed, including the files matching glob patterns')
+    files_watched.set(value=len(registry.readers) + sum(
+        len(subscription['glob_reader'])
+        for subscription in registry.globs.values()
+        if 'glob_reader' in subscription))
+
+    subscribers = Gauge(
+        'tailsocket_file_subscribers',
+        'Subscribers of a file or glob pattern', ('file',))
+    for key, subscription in list(registry.readers.items()) + list(
+            registry.globs.items()):
+        subscribers.set(key, value=len(subscription['handlers']))
+
+    coalesced = Counter(
+        'tailsocket_file_events_coalesced_total',
+        'Reads of a file returning new content sent along with the content '
+        'of other reads', ('file',))
+    for labels, events in FILE_EVENTS.values.items():
+        coalesced.inc(
+            *labels, amount=events - FILE_BATCHES.values.get(labels, 0))
+
+    rotations = Counter(
+        'tailsocket_rotations_detected_total',
+        'Rotations and truncations of files detected')
+    rotations.inc(amount=registry.rotations_detected)
+
+    connections = Gauge(
+        'tailsocket_connections', 'Open websocket connections')
+    connections.set(value=len(app.connections))
+
+    queue_bytes = Histogram(
+        'tailsocket_send_queue_bytes',
+        'Bytes queued on each websocket connection when collected',
+        buckets=QUEUE_BYTES_BUCKETS)
+    for connection in app.connections:
+        queue_bytes.observe(connection.get_queue_stats()['queued_bytes'])
+
+    return [
+        files_watched, subscribers, FILE_EVENTS_RECEIVED, FILE_EVENTS,
+        coalesced, FILE_BATCHES,
+        READ_BYTES, READ_LINES, rotations, connections, MESSAGES_SENT,
+        BYTES_SENT, queue_bytes, TAILER_SKIPPED_LINES, READ_TO_SEND_SECONDS,
+        LOOP_LAG_SECONDS, SLOW_CALLBACKS,
+    ]
+
+
+def render(app):
+    """Returns the metrics of an application in the Prometheus text format.
+
+    """
+    return '\n'.join(metric.render() for metric in collect(app)) + '\n'
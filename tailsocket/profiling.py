@@ -0,0 +1,161 @@
+"""
+Event loop lag monitoring, slow callback reporting and on-demand profiling
+of the running server.
+
+"""
+
+import io
+import time
+import pstats
+import asyncio
+import cProfile
+import logging
+import functools
+import tracemalloc
+
+from tailsocket import metrics
+
+logger = logging.getLogger('tornado.application')
+
+# Seconds a wrapped callback may take before being reported
+slow_callback_threshold = 0.1
+
+
+def report_slow_calls(name):
+    """Decorator logging and counting the calls of a function taking longer
+    than `slow_callback_threshold`, to tell which callbacks stall the loop.
+
+    Args:
+        name (str): Name of the callback in the logs and metrics.
+
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if elapsed > slow_callback_threshold:
+                    metrics.SLOW_CALLBACKS.inc(name)
+                    logger.warning(
+                        'Slow callback %s took %.3fs, arguments: %.200r',
+                        name, elapsed, args[1:])
+        return wrapper
+    return decorator
+
+
+class LoopLagMonitor():
+    """Measures how late the event loop runs a callback scheduled at a
+    regular interval, which is how long any other callback may have been
+    waiting for the loop.
+
+    Args:
+        interval (Optional[float]): Seconds between samples.
+        threshold (Optional[float]): Lag in seconds logged as a warning.
+
+    """
+
+    def __init__(self, interval=0.5, threshold=0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0
+        self._handle = None
+        self._expected = None
+
+    def start(self):
+        """Starts sampling the lag of the current event loop.
+
+        """
+        self._schedule()
+
+    def stop(self):
+        """Stops sampling.
+
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self):
+        loop = asyncio.get_event_loop()
+        self._expected = loop.time() + self.interval
+        self._handle = loop.call_at(self._expected, self._sample)
+
+    def _sample(self):
+        lag = max(0, asyncio.get_event_loop().time() - self._expected)
+        self.max_lag = max(self.max_lag, lag)
+        metrics.LOOP_LAG_SECONDS.observe(lag)
+        if lag > self.threshold:
+            logger.warning('Event loop lagged %.3fs', lag)
+        self._schedule()
+
+
+class CpuProfile():
+    """Profiles the calls made by the event loop while enabled.
+
+    Args:
+        limit (Optional[int]): Number of functions reported.
+
+    """
+
+    def __init__(self, limit=30):
+        self.limit = limit
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        self.profiler.enable()
+
+    def stop(self):
+        """Stops profiling.
+
+        Returns:
+            str: The functions taking the most cumulative time.
+
+        """
+        self.profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(self.limit)
+        return output.getvalue()
+
+
+class MemoryProfile():
+    """Traces the memory allocated while enabled.
+
+    Args:
+        limit (Optional[int]): Number of source lines reported.
+
+    """
+
+    def __init__(self, limit=30):
+        self.limit = limit
+        self.was_tracing = tracemalloc.is_tracing()
+        self.snapshot = None
+
+    def start(self):
+        if not self.was_tracing:
+            tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def stop(self):
+        """Stops tracing, unless it was enabled by someone else.
+
+        Returns:
+            str: The source lines whose allocations grew the most.
+
+        """
+        snapshot = tracemalloc.take_snapshot()
+        if not self.was_tracing:
+            tracemalloc.stop()
+
+        differences = snapshot.compare_to(self.snapshot, 'lineno')
+        return '\n'.join(
+            str(difference) for difference in differences[:self.limit])
+
+
+PROFILES = {
+    'cpu': CpuProfile,
+    'memory': MemoryProfile,
+}
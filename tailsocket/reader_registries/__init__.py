@@ -7,13 +7,37 @@ Contains factory function and ReaderRegistry and NotifyReaderRegistry classes.
 
 import sys
 
+REGISTRY_AUTO = 'auto'
+REGISTRY_LOOP = 'loop'
+REGISTRY_NOTIFY = 'notify'
+REGISTRY_POLL = 'poll'
+REGISTRY_TYPES = (
+    REGISTRY_AUTO, REGISTRY_LOOP, REGISTRY_NOTIFY, REGISTRY_POLL)
 
-def get_registry(*args, **kwargs):
+
+def get_registry(*args, registry_type=REGISTRY_AUTO, **kwargs):
     """ReaderRegistry factory, returns an instance of the appropriate
-    ReaderRegistry class depending on the system platform.
+    ReaderRegistry class depending on the system platform, unless a type is
+    requested.
+
+    On Linux the default registry polls the files in network filesystems,
+    which inotify doesn't see changes of.
+
+    Args:
+        registry_type (Optional[str]): 'auto' for the platform's default,
+            'loop' for ReaderRegistry, 'notify' for NotifyReaderRegistry,
+            only available on Linux, or 'poll' for PollReaderRegistry.
 
     """
-    if sys.platform == 'linux':
+    if registry_type not in REGISTRY_TYPES:
+        raise ValueError('Unknown registry type {}'.format(registry_type))
+
+    if registry_type == REGISTRY_POLL:
+        import tailsocket.reader_registries.poll_reader_registry as prr
+        return prr.PollReaderRegistry(*args, **kwargs)
+
+    if registry_type == REGISTRY_NOTIFY or (
+            registry_type == REGISTRY_AUTO and sys.platform == 'linux'):
         import tailsocket.reader_registries.notify_reader_registry as nrr
         return nrr.NotifyReaderRegistry(*args, **kwargs)
 
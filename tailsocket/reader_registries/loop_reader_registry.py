@@ -8,9 +8,33 @@ import asyncio
 import logging
 from functools import partial
 
+from tailsocket import metrics
+from tailsocket.archives import (
+    ArchiveReader, CHECKPOINT_INTERVAL, count_lines, find_archives,
+    parse_cursor)
+from tailsocket.backward_reader import read_at, read_lines_before
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.coalescer import Coalescer
 from tailsocket.errors import ExcessiveEmptyMessagesError
+from tailsocket.filters import FilterGroups
+from tailsocket.glob_reader import GlobReader, HEADER
+from tailsocket.line_assembler import LineAssembler
+from tailsocket.line_index import SparseLineIndex
+from tailsocket.log import RateLimitedLog
+from tailsocket.profiling import report_slow_calls
+from tailsocket.scrollback import ScrollbackBuffer
 
 logger = logging.getLogger('tornado.application')
+# Logs the sending of lines once a second, logging every batch would write
+# as much to the log as is read from the files
+sending_log = RateLimitedLog(logger, logging.INFO)
+
+
+def is_same_file(stat, other_stat):
+    """Returns True if two stat results belong to the same file.
+
+    """
+    return (stat.st_dev, stat.st_ino) == (other_stat.st_dev, other_stat.st_ino)
 
 
 class ReaderRegistry():
@@ -18,52 +42,114 @@ class ReaderRegistry():
     by WebSocketHandler instances.
 
     Saves a dict with file names as keys and another dict as values storing
-    the file descriptor being watched for read events, the latest stat
-    info of the file and an array of the handlers to be notified.
+    the open file, the offset up to which it has been read, the descriptor
+    being watched for read events, the stat info of the file when opened, the
+    assembler of its lines, the coalescer batching its new content, the
+    scrollback of its recent lines, the sparse index of its lines used for
+    history requests, the task catching up with content too large to read at
+    once, an array of the handlers to be notified and the same handlers
+    grouped by the filters they use.
+
+    Glob subscriptions are kept in a similar dict with the patterns as keys.
 
     Args:
         initial_lines_from_file (Optional[int]): Lines to read from file on
             creation of a reader, defaults to 10.
+        coalesce_window_ms (Optional[int]): Milliseconds during which new
+            content of a busy file is collected into a single message,
+            defaults to 0 which sends every read as it happens.
+        coalesce_max_bytes (Optional[int]): Size of collected content that
+            is sent right away regardless of the window.
+        scrollback_lines (Optional[int]): Number of recent lines of each file
+            kept in memory to serve new handlers, defaults to 1000.
+        scrollback_bytes (Optional[int]): Maximum size of the recent lines
+            kept in memory for each file.
 
     """
 
-    def __init__(self, initial_lines_from_file=10):
+    read_chunk_size = 64 * 1024
+    read_budget_bytes = 256 * 1024
+    rotation_check_interval = 1
+    tail_block_size = 8 * 1024
+    tail_use_mmap = False
+    history_index_interval = 1000
+    history_max_lines = 1000
+    archive_checkpoint_interval = CHECKPOINT_INTERVAL
+    glob_poll_interval = 1
+    glob_max_open_files = 128
+
+    def __init__(
+            self, initial_lines_from_file=10, coalesce_window_ms=0,
+            coalesce_max_bytes=64 * 1024, scrollback_lines=1000,
+            scrollback_bytes=1024 * 1024):
         self.readers = {}
+        self.globs = {}
+        self.file_ids = {}
+        self.file_paths = {}
         self.initial_lines_from_file = initial_lines_from_file
+        self.coalesce_window_ms = coalesce_window_ms
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.scrollback_lines = scrollback_lines
+        self.scrollback_bytes = scrollback_bytes
+        self.coalescing_overrides = {}
         self.empty_msg_count = 0
+        self.rotations_detected = 0
+        self.archives = ArchiveReader(
+            checkpoint_interval=self.archive_checkpoint_interval,
+            block_size=self.tail_block_size)
 
-    def read_last_lines_from_file(self, n, fd, offset=None):
+    def read_last_lines_from_file(self, n, fd, offset=None, end=None):
         """Reads n lines from f with an offset of offset lines.  The return
         value is a tuple in the form ``(lines, has_more)`` where `has_more` is
         an indicator that is `True` if there are more lines in the file.
 
-        Taken from http://stackoverflow.com/a/692616/3020799
+        The file is scanned backwards in blocks so only the requested and
+        skipped lines are read.
+
+        Args:
+            n (int): Number of lines to read.
+            fd (file-like): The file to read from.
+            offset (Optional[int]): Number of lines to skip from the end.
+            end (Optional[int]): Position to consider the end of the file,
+                defaults to its current size.
 
         """
-        avg_line_length = 74
-        to_read = n + (offset or 0)
+        lines, start = read_lines_before(
+            fd, n, end=end, offset=offset, block_size=self.tail_block_size,
+            use_mmap=self.tail_use_mmap)
+        return [line.decode('utf-8', 'replace') for line in lines], start > 0
 
-        while True:
-            try:
-                fd.seek(-(int(avg_line_length) * to_read), 2)
-            except IOError:
-                # woops.  apparently file is smaller than what we want
-                # to step back, go to the beginning instead
-                fd.seek(0)
+    def find_last_line_end(self, fd, size, max_line_length):
+        """Returns the position following the last newline of a file, where
+        an incomplete last line starts.
 
-            pos = fd.tell()
-            lines = fd.read().splitlines()
-            if len(lines) >= to_read or pos == 0:
-                return (
-                    [line.decode() for line in
-                        lines[-to_read:offset and -offset or None]],
-                    len(lines) > to_read or pos > 0
-                )
-            avg_line_length *= 1.3
+        Args:
+            fd (file-like): The file.
+            size (int): The size of the file.
+            max_line_length (int): Size of an incomplete line considered
+                complete regardless, as the assembler emits it anyway.
+
+        """
+        if not size or read_at(fd, 1, size - 1) == b'\n':
+            return size
+
+        lowest = max(0, size - max_line_length)
+        position = size
+        while position > lowest:
+            block_start = max(lowest, position - self.tail_block_size)
+            block = read_at(fd, position - block_start, block_start)
+            index = block.rfind(b'\n')
+            if index != -1:
+                return block_start + index + 1
+            position = block_start
+        return 0 if not lowest else size
 
     def create_reader(self, filename, read_last_n_lines=10):
         """Opens the specified file and creates the reader callback.
 
+        The file is kept open for the lifetime of the reader and new content
+        is read from it using positional reads from the tracked offset.
+
         Optionally returns the last few lines of content.
 
         Args:
@@ -72,55 +158,178 @@ class ReaderRegistry():
                 content to be returned
 
         Returns:
-            tuple: A file descriptor and possibly empty string of content
+            tuple: A reader dict and possibly empty string of content
 
         """
-        logger.debug('Creating reader for {}'.format(filename))
-        fd = open(filename, 'rb')
+        logger.debug('Creating reader for %s', filename)
+        fd = open(filename, 'rb', buffering=0)
+        stat = os.fstat(fd.fileno())
+        assembler = LineAssembler()
+        # A line still being written is left to the assembler, to be sent
+        # whole once complete
+        lines_end = self.find_last_line_end(
+            fd, stat.st_size, assembler.max_line_length)
+        assembler.feed(read_at(fd, stat.st_size - lines_end, lines_end))
         if read_last_n_lines:
-            logger.debug('Reading last {} lines'.format(read_last_n_lines))
+            logger.debug('Reading last %d lines', read_last_n_lines)
             content, _ = self.read_last_lines_from_file(
-                read_last_n_lines, fd)
+                read_last_n_lines, fd, end=lines_end)
             content = '\n'.join(content)
         else:
-            fd.seek(0, os.SEEK_END)
             content = ''
 
+        window_ms, max_bytes = self.coalescing_overrides.get(
+            filename, (self.coalesce_window_ms, self.coalesce_max_bytes))
+        reader = {
+            'file': fd,
+            'offset': stat.st_size,
+            'previous_stat': stat,
+            'assembler': assembler,
+            'coalescer': Coalescer(
+                partial(self.send_message_to_reader_handlers, filename),
+                window=window_ms / 1000, max_bytes=max_bytes),
+            'scrollback': ScrollbackBuffer(
+                self.scrollback_lines, self.scrollback_bytes),
+            'line_index': SparseLineIndex(self.history_index_interval),
+            'line_index_task': None,
+            'catch_up_task': None,
+            'next_file': None,
+            'filter_groups': FilterGroups(),
+        }
+        if content:
+            reader['scrollback'].append(content, lines_end)
+        reader['descriptor'] = self.watch_file(filename, fd)
+        return reader, content
+
+    def watch_file(self, filename, fd):
+        """Registers the reader callback to be called when the file changes.
+
+        Args:
+            filename (str): Path of the file to watch.
+            fd (file-like): The open file to watch.
+
+        Returns:
+            The descriptor identifying the registration.
+
+        """
         loop = asyncio.get_event_loop()
         # TODO: fileno() is required for epoll or uvloop policies
-        loop.add_reader(fd, partial(self.reader, fd))
-        return fd, content
+        loop.add_reader(fd, partial(self.reader, filename))
+        return fd
+
+    def unwatch_file(self, filename, descriptor):
+        """Removes the reader callback registration of a file.
+
+        Args:
+            filename (str): Path of the watched file.
+            descriptor: The descriptor returned by `watch_file`.
+
+        """
+        loop = asyncio.get_event_loop()
+        loop.remove_reader(descriptor)
 
-    def add_handler_to_filename(self, ws_handler, filename):
+    def add_handler_to_filename(
+            self, ws_handler, filename, line_filter=None, resume_from=None):
         """Adds a WebSocketHandler instance to a filename path, creating a
         reader if necessary.
 
+        The first handler of a file receives its last lines read from disk,
+        later ones receive them from the scrollback of the reader. Handlers
+        resuming a tail receive the lines following the position they give
+        instead, unless the file is now shorter than it.
+
         Args:
             ws_handler (WebSocketHandler): WebSocketHandler to attach a file
                 reader to.
             filename (str): Path to file to create the reader for.
+            line_filter (Optional[LineFilter]): Filter of the lines to send
+                to the handler, by default all lines are sent.
+            resume_from (Optional[int]): Offset of the last lines received by
+                the handler in a previous subscription.
 
         """
-        logger.debug('Adding handler for {}'.format(filename))
+        logger.debug('Adding handler for %s', filename)
         filename = os.path.abspath(filename)
         if filename not in self.readers:
-            logger.debug(
-                '{} not in readers, adding descriptor'.format(filename))
-            fd, content = self.create_reader(
+            logger.debug('%s not in readers, adding descriptor', filename)
+            reader, content = self.create_reader(
                 filename, self.initial_lines_from_file)
-            self.readers[filename] = {
-                'descriptor': fd,
-                'previous_stat': os.stat(filename),
-                'handlers': [ws_handler]
-            }
-            if content:
-                ws_handler.write_message(content)
-            else:
-                ws_handler.write_message('<< File is empty, tail started >>')
+            reader['handlers'] = [ws_handler]
+            self.readers[filename] = reader
+            lines = content.split('\n') if content else []
         else:
-            logger.debug('{} already in readers, adding handler'.format(
-                filename))
-            self.readers[filename]['handlers'].append(ws_handler)
+            logger.debug('%s already in readers, adding handler', filename)
+            reader = self.readers[filename]
+            reader['handlers'].append(ws_handler)
+            lines = reader['scrollback'].get_last_lines(
+                self.initial_lines_from_file)
+
+        if resume_from is not None:
+            # Lines waiting to be coalesced are sent to the other handlers
+            # first, as they are included in the lines read for this one
+            reader['coalescer'].flush()
+
+        end = reader['offset'] - reader['assembler'].pending
+        resumed = resume_from is not None and resume_from <= end
+        if resumed:
+            lines = self.read_lines_after(reader, resume_from)
+
+        reader['filter_groups'].add(ws_handler, line_filter)
+        self.send_initial_lines(
+            ws_handler, lines, line_filter, file_id=self.get_file_id(filename),
+            offset=end, resumed=resumed)
+
+    def read_lines_after(self, reader, position):
+        """Reads the complete lines of a file following a position, at most
+        `scrollback_bytes` of them.
+
+        Args:
+            reader (dict): The reader of the file.
+            position (int): The position, at the start of a line.
+
+        Returns:
+            list: The lines.
+
+        """
+        end = reader['offset'] - reader['assembler'].pending
+        start = max(position, end - self.scrollback_bytes)
+        content = read_at(reader['file'], end - start, start)
+        if start > position:
+            # Skip the line cut by the size limit
+            content = content[content.find(b'\n') + 1:]
+        if not content:
+            return []
+        return content.decode('utf-8', 'replace').rstrip('\n').split('\n')
+
+    def send_initial_lines(
+            self, ws_handler, lines, line_filter=None, file_id=0, offset=0,
+            resumed=False):
+        """Sends the last lines of a file to a new handler.
+
+        Args:
+            ws_handler (WebSocketHandler): The new handler.
+            lines (list): The last lines of the file.
+            line_filter (Optional[LineFilter]): Filter of the handler.
+            file_id (Optional[int]): Id of the file.
+            offset (Optional[int]): Position of the end of the lines.
+            resumed (Optional[bool]): Whether the lines are the ones following
+                the position given by a handler resuming a tail.
+
+        """
+        if line_filter is not None:
+            lines = line_filter.filter_lines(lines)
+            if not lines:
+                ws_handler.write_message(
+                    '<< No recent lines match the filters, tail started >>')
+                return
+
+        if lines:
+            ws_handler.write_message(BroadcastMessage(
+                '\n'.join(lines), file_id=file_id, offset=offset))
+        elif resumed:
+            ws_handler.write_message('<< No new lines, tail resumed >>')
+        else:
+            ws_handler.write_message('<< File is empty, tail started >>')
 
     def remove_handler_from_filename(self, ws_handler, filename):
         """Removes a WebSocketHandler instance from a filename path entry.
@@ -136,20 +345,21 @@ class ReaderRegistry():
 
         """
         filename = os.path.abspath(filename)
-        logger.debug('Removing handler for {}'.format(filename))
+        logger.debug('Removing handler for %s', filename)
         try:
             if ws_handler not in self.readers[filename]['handlers']:
                 logger.warning(
                     'Attempted to remove a handler not present in the registry'
-                    ' for filename {}'.format(filename))
+                    ' for filename %s', filename)
                 return False
         except KeyError:
             logger.warning(
-                'Attempted to remove a handler from a filename {} not present'
-                ' in the registry'.format(filename))
+                'Attempted to remove a handler from a filename %s not present'
+                ' in the registry', filename)
             return False
 
         self.readers[filename]['handlers'].remove(ws_handler)
+        self.readers[filename]['filter_groups'].remove(ws_handler)
         if not self.readers[filename]['handlers']:
             self.remove_reader_for_filename(filename)
 
@@ -162,64 +372,682 @@ class ReaderRegistry():
             filename (str): Path to file which should exist in the registry.
 
         """
-        logger.debug('No handlers left for {}, removing'.format(filename))
+        logger.debug('No handlers left for %s, removing', filename)
+        reader = self.readers.pop(filename)
+        self.unwatch_file(filename, reader['descriptor'])
+        reader['coalescer'].cancel()
+        if reader['catch_up_task'] is not None:
+            reader['catch_up_task'].cancel()
+        if reader['next_file'] is not None:
+            reader['next_file'].close()
+        self.reset_line_index(reader)
+        reader['file'].close()
+        self.remove_file_metrics(filename)
+
+    def add_handler_to_glob(self, ws_handler, pattern, line_filter=None):
+        """Adds a WebSocketHandler instance to the files matching a glob
+        pattern, sending their new lines as a single stream in which the
+        lines of each file are preceded by a header with its path.
+
+        Args:
+            ws_handler (WebSocketHandler): WebSocketHandler to attach.
+            pattern (str): The glob pattern.
+            line_filter (Optional[LineFilter]): Filter of the lines to send
+                to the handler, by default all lines are sent.
+
+        """
+        logger.debug('Adding handler for %s', pattern)
+        pattern = os.path.abspath(pattern)
+        if pattern not in self.globs:
+            glob_reader = GlobReader(
+                pattern, partial(self.send_glob_lines, pattern),
+                max_open_files=self.glob_max_open_files)
+            glob_reader.scan()
+            self.globs[pattern] = {
+                'glob_reader': glob_reader,
+                'handlers': [],
+                'filter_groups': FilterGroups(),
+            }
+            self.globs[pattern]['descriptor'] = self.watch_glob(
+                pattern, glob_reader)
+
+        subscription = self.globs[pattern]
+        subscription['handlers'].append(ws_handler)
+        subscription['filter_groups'].add(ws_handler, line_filter)
+        ws_handler.write_message(self.get_glob_status(pattern))
+
+    def get_glob_status(self, pattern):
+        """Returns the message telling new handlers of a glob pattern how
+        many files match it.
+
+        Args:
+            pattern (str): The glob pattern, which should exist in the
+                registry.
+
+        """
+        return '<< Tailing {} files matching {} >>'.format(
+            len(self.globs[pattern]['glob_reader']), pattern)
+
+    def remove_handler_from_glob(self, ws_handler, pattern):
+        """Removes a WebSocketHandler instance from a glob subscription,
+        removing the subscription if it has no handlers left.
+
+        Args:
+            ws_handler (WebSocketHandler): WebSocketHandler to remove.
+            pattern (str): The glob pattern.
+
+        Returns:
+            bool: True if handler was removed correctly.
+
+        """
+        pattern = os.path.abspath(pattern)
+        subscription = self.globs.get(pattern)
+        if subscription is None or ws_handler not in subscription['handlers']:
+            logger.warning(
+                'Attempted to remove a handler not present in the registry'
+                ' for pattern %s', pattern)
+            return False
+
+        subscription['handlers'].remove(ws_handler)
+        subscription['filter_groups'].remove(ws_handler)
+        if not subscription['handlers']:
+            logger.debug('No handlers left for %s, removing', pattern)
+            del self.globs[pattern]
+            self.unwatch_glob(pattern, subscription['descriptor'])
+            paths = list(subscription['glob_reader'].files)
+            subscription['glob_reader'].close()
+            for path in paths:
+                self.remove_file_metrics(path)
+
+        return True
+
+    def remove_file_metrics(self, path):
+        """Removes the samples of a file from the metrics once it is no
+        longer read, by its own reader nor as part of a glob subscription,
+        so the series of files tailed once don't accumulate.
+
+        Args:
+            path (str): Absolute path of the file.
+
+        """
+        if path in self.readers or any(
+                path in subscription['glob_reader'].files
+                for subscription in self.globs.values()
+                if 'glob_reader' in subscription):
+            return
+        metrics.remove_file(path)
+
+    def watch_glob(self, pattern, glob_reader):
+        """Starts polling the files matching a glob pattern for changes.
+
+        Args:
+            pattern (str): The glob pattern.
+            glob_reader (GlobReader): The reader of the matching files.
+
+        Returns:
+            The descriptor identifying the registration.
+
+        """
         loop = asyncio.get_event_loop()
-        loop.remove_reader(self.readers[filename]['descriptor'])
-        self.readers[filename]['descriptor'].close()
-        del self.readers[filename]
+        return loop.call_later(
+            self.glob_poll_interval, self.poll_glob, pattern)
+
+    def unwatch_glob(self, pattern, descriptor):
+        """Stops watching the files matching a glob pattern.
+
+        Args:
+            pattern (str): The glob pattern.
+            descriptor: The descriptor returned by `watch_glob`.
+
+        """
+        descriptor.cancel()
+
+    def poll_glob(self, pattern):
+        """Reads the files matching a glob pattern that changed since the
+        last poll and schedules the next one.
+
+        Args:
+            pattern (str): The glob pattern.
 
-    def reader(self, descriptor):
-        """Reader callback for a file descriptor. Handles reading the last line
-        of text and sending it to all registered handlers.
+        """
+        subscription = self.globs.get(pattern)
+        if subscription is None:
+            return
+
+        subscription['glob_reader'].poll()
+        subscription['descriptor'] = self.watch_glob(
+            pattern, subscription['glob_reader'])
+
+    def send_glob_lines(self, pattern, path, lines):
+        """Sends the new lines of a file matching a glob pattern to the
+        handlers of the pattern preceded by a header with its path.
+
+        Args:
+            pattern (str): The glob pattern.
+            path (str): Path of the file.
+            lines (list): The new lines of the file.
+
+        """
+        metrics.FILE_EVENTS.inc(path)
+        metrics.READ_LINES.inc(path, amount=len(lines))
+        metrics.FILE_BATCHES.inc(path)
+        record = self.globs[pattern]['glob_reader'].files[path]
+        self.send_glob_batch(
+            pattern, path, lines, file_id=self.get_file_id(path),
+            offset=record['offset'] - record['assembler'].pending)
 
-        Also detects rotation of a the file based on the stat info.
+    def send_glob_batch(self, pattern, path, lines, file_id=0, offset=0):
+        """Sends a batch of lines of a file matching a glob pattern to each
+        group of handlers of the pattern, filtered and preceded by a header
+        with its path.
 
         Args:
-            descriptor (file-like): The descriptor attached to the callback.
+            pattern (str): The glob pattern.
+            path (str): Path of the file.
+            lines (list): The new lines of the file.
+            file_id (Optional[int]): Id of the file.
+            offset (Optional[int]): Position of the end of the lines.
 
         """
-        filename = descriptor.name
-        logger.debug('Reader for {}'.format(filename))
+        groups = self.globs[pattern]['filter_groups']
+        if groups.filtered:
+            selected = groups.select(lines)
+        header = HEADER.format(path)
+        for line_filter, handlers in groups.groups.items():
+            group_lines = lines if line_filter is None else selected[
+                line_filter]
+            if group_lines:
+                body = '\n'.join(group_lines)
+                self.send_message_to_handlers(
+                    '\n'.join((header, body)), handlers, file_id=file_id,
+                    offset=offset, body=body)
+
+    @report_slow_calls('reader')
+    def reader(self, filename):
+        """Reader callback for a file. Handles reading the content appended
+        since the last call and sending the lines it completes to all
+        registered handlers.
+
+        At most `read_budget_bytes` are read in a call so a file written to
+        faster than it is read doesn't starve the others, the rest of the
+        content is read in the background, see `catch_up`.
+
+        Also detects rotation of the file when there is no new content.
+
+        Args:
+            filename (str): The path of the file attached to the callback.
+
+        """
+        logger.debug('Reader for %s', filename)
 
-        stat = os.stat(filename)
         reader = self.readers[filename]
-        if stat.st_size == reader['previous_stat'].st_size:
-            # Ignore calls if the size is the same
-            # Should only happen when using the `select` event loop
+        if reader['catch_up_task'] is not None:
             return
-        elif stat.st_size < reader['previous_stat'].st_size:
-            logger.info('Detected rotation on file {} - Sizes {} < {}'.format(
-                filename, stat.st_size, reader['previous_stat'].st_size))
 
-            self.remove_reader_callback_for_descriptor(descriptor)
-            reader['descriptor'], msg = self.create_reader(filename, 1)
-        else:
-            msg = descriptor.read().decode()
+        content = self.read_new_content(reader, self.read_budget_bytes)
+        if not content:
+            # Nothing new to read, with the `select` event loop this happens
+            # on every loop iteration, otherwise the file might be truncated
+            if self.detect_truncation(filename, reader):
+                content = self.read_new_content(
+                    reader, self.read_budget_bytes)
+            elif self.replacement_check_is_due(reader):
+                self.check_replacement(filename)
+                return
+            else:
+                return
 
-        msg = msg.strip()
-        self.send_message_to_handlers(msg, reader['handlers'])
-        reader['previous_stat'] = stat
+        self.process_new_content(filename, reader, content)
+        if len(content) >= self.read_budget_bytes:
+            reader['catch_up_task'] = asyncio.ensure_future(
+                self.catch_up(filename, reader))
 
-    def remove_reader_callback_for_descriptor(self, descriptor):
-        """Removes the reader callback for a particular descriptor.
+    @asyncio.coroutine
+    def catch_up(self, filename, reader):
+        """Reads the content of a file left unread by the reader callback,
+        a chunk of `read_budget_bytes` at a time in an executor, processing
+        each chunk on the event loop before reading the next one.
+
+        The reader callback skips the file meanwhile, and is called once the
+        end of the file is reached to read anything written since. If a new
+        file replaced the file at its end, the reader switches to it and
+        reads it the same way, see `switch_to_new_file`.
 
         Args:
-            descriptor (file-like): The descriptor to remove the callback for.
+            filename (str): The path of the file.
+            reader (dict): The reader of the file.
+
         """
         loop = asyncio.get_event_loop()
-        loop.remove_reader(descriptor)
+        try:
+            while self.readers.get(filename) is reader:
+                fd, offset = reader['file'], reader['offset']
+                try:
+                    content = yield from loop.run_in_executor(
+                        None, os.pread, fd.fileno(), self.read_budget_bytes,
+                        offset)
+                except (OSError, ValueError):
+                    # The file was closed meanwhile
+                    return
+                if reader['file'] is not fd or reader['offset'] != offset:
+                    # The file was rotated meanwhile
+                    continue
+
+                reader['offset'] += len(content)
+                if content:
+                    self.process_new_content(filename, reader, content)
+                if len(content) < self.read_budget_bytes:
+                    if reader['next_file'] is not None:
+                        self.complete_switch(filename, reader)
+                        continue
+                    loop.call_soon(self.reader_if_watched, filename)
+                    return
+        finally:
+            reader['catch_up_task'] = None
+
+    def reader_if_watched(self, filename):
+        """Calls the reader callback of a file if still in the registry.
+
+        """
+        if filename in self.readers:
+            self.reader(filename)
+
+    def process_new_content(self, filename, reader, content):
+        """Assembles the lines completed by new content and passes them to
+        the coalescer of the reader.
+
+        Also extends the line index of the file if it is fully built, while
+        it is being built the new content is indexed by the build itself.
+
+        Args:
+            filename (str): The path of the file.
+            reader (dict): The reader of the file.
+            content (bytes): The new content read from the file.
+
+        """
+        metrics.FILE_EVENTS.inc(filename)
+        metrics.READ_BYTES.inc(filename, amount=len(content))
+        task = reader['line_index_task']
+        index = reader['line_index']
+        if (task is not None and task.done() and
+                index.indexed_bytes == reader['offset'] - len(content)):
+            index.feed(content)
+
+        lines = reader['assembler'].feed(content)
+        if lines:
+            metrics.READ_LINES.inc(filename, amount=len(lines))
+            if reader.get('read_time') is None:
+                # Time of the oldest content waiting to be sent
+                reader['read_time'] = asyncio.get_event_loop().time()
+            reader['coalescer'].add('\n'.join(lines))
+
+    def read_new_content(self, reader, limit=None):
+        """Reads the content appended to a file since the last read.
+
+        Uses positional reads on the long lived descriptor of the reader up
+        to the current end of the file, updating the offset of the reader.
+
+        Args:
+            reader (dict): The reader of the file.
+            limit (Optional[int]): Maximum number of bytes to read, by
+                default the file is read to its end.
+
+        Returns:
+            bytes: The new content, possibly empty.
+
+        """
+        fileno = reader['file'].fileno()
+        chunks = []
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = self.read_chunk_size
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            chunk = os.pread(fileno, size, reader['offset'])
+            reader['offset'] += len(chunk)
+            chunks.append(chunk)
+            if len(chunk) < size:
+                break
+
+        return b''.join(chunks)
+
+    def detect_truncation(self, filename, reader):
+        """Checks if a file has been truncated below the offset of its reader,
+        resetting the offset to the start of the file if so.
+
+        Args:
+            filename (str): The path of the file.
+            reader (dict): The reader of the file.
+
+        Returns:
+            bool: True if the file was truncated.
+
+        """
+        stat = os.fstat(reader['file'].fileno())
+        if stat.st_size >= reader['offset']:
+            return False
+
+        logger.info('Detected rotation on file %s - Sizes %d < %d',
+                    filename, stat.st_size, reader['offset'])
+        reader['offset'] = 0
+        reader['assembler'].reset()
+        reader['previous_stat'] = stat
+        self.reset_line_index(reader)
+        self.rotations_detected += 1
+        return True
+
+    def replacement_check_is_due(self, reader):
+        """Returns True if the path of a file should be checked for a new file
+        replacing it, at most once every `rotation_check_interval` seconds.
+
+        Registries notified of changes in the directory of the file don't
+        need to poll and set the interval to None.
+
+        Args:
+            reader (dict): The reader of the file.
+
+        """
+        if self.rotation_check_interval is None:
+            return False
+
+        now = asyncio.get_event_loop().time()
+        if now - reader.get('last_rotation_check', 0) < (
+                self.rotation_check_interval):
+            return False
+
+        reader['last_rotation_check'] = now
+        return True
+
+    def check_replacement(self, filename):
+        """Checks whether the path of a file points to a different file than
+        the one being read, as after a rename and create or a delete and
+        create rotation, switching to the new file if so.
+
+        While there is no file at the path, the old file keeps being read.
+
+        Args:
+            filename (str): The path of the file.
+
+        Returns:
+            bool: True if the reader is switching to a new file.
+
+        """
+        reader = self.readers.get(filename)
+        if reader is None:
+            return False
+
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return False
+
+        if is_same_file(stat, reader['previous_stat']):
+            return False
+
+        logger.info('Detected rotation on file %s - Inodes %d != %d',
+                    filename, stat.st_ino, reader['previous_stat'].st_ino)
+        return self.switch_to_new_file(filename, reader)
+
+    def switch_to_new_file(self, filename, reader):
+        """Opens the file now at the path of a file being read, the reader
+        switching to it once the old file is read to its end.
+
+        Both files are read in the background a chunk at a time, see
+        `catch_up`, as the rest of the old file and the whole new file may
+        be large.
+
+        Args:
+            filename (str): The path of the file.
+            reader (dict): The reader of the file.
+
+        Returns:
+            bool: True if the reader is switching to the new file.
+
+        """
+        if reader['next_file'] is not None:
+            return False
+
+        try:
+            reader['next_file'] = open(filename, 'rb', buffering=0)
+        except FileNotFoundError:
+            return False
+
+        if reader['catch_up_task'] is None:
+            reader['catch_up_task'] = asyncio.ensure_future(
+                self.catch_up(filename, reader))
+        return True
+
+    def complete_switch(self, filename, reader):
+        """Switches a reader drained to the end of its file to the new file
+        opened by `switch_to_new_file`.
 
-    def send_message_to_handlers(self, message, handlers):
+        Args:
+            filename (str): The path of the file.
+            reader (dict): The reader of the file.
+
+        """
+        lines = reader['assembler'].flush()
+        if lines:
+            reader['coalescer'].add('\n'.join(lines))
+
+        fd, reader['next_file'] = reader['next_file'], None
+        old_file, old_descriptor = reader['file'], reader['descriptor']
+        reader['file'] = fd
+        reader['offset'] = 0
+        reader['previous_stat'] = os.fstat(fd.fileno())
+        reader['descriptor'] = self.watch_file(filename, fd)
+        self.unwatch_file(filename, old_descriptor)
+        old_file.close()
+        self.reset_line_index(reader)
+        self.rotations_detected += 1
+
+    def build_line_index(self, reader):
+        """Starts building the line index of a file in the background if it
+        has not been started yet.
+
+        Indexes are only built once history is requested for a file, as
+        building them requires reading the whole file.
+
+        Args:
+            reader (dict): The reader of the file.
+
+        """
+        if reader['line_index_task'] is None:
+            reader['line_index_task'] = asyncio.ensure_future(
+                reader['line_index'].build(
+                    reader['file'], lambda: reader['offset']))
+
+    def reset_line_index(self, reader):
+        """Discards the line index of a file, stopping its build if running.
+
+        Args:
+            reader (dict): The reader of the file.
+
+        """
+        if reader['line_index_task'] is not None:
+            reader['line_index_task'].cancel()
+            reader['line_index_task'] = None
+        reader['line_index'].reset()
+
+    def read_history(self, filename, n, before=None, skip=0):
+        """Reads a page of n lines of a file ending `skip` lines before the
+        `before` cursor.
+
+        Cursors are the positions of the start of the first line of the pages
+        returned. Once the line index of the file covers the requested part,
+        skipping lines and numbering them costs a seek to the closest
+        checkpoint instead of a scan, until then the file is scanned
+        backwards from the cursor.
+
+        Pages reaching the start of the file continue into its rotated
+        siblings, e.g. ``app.log.1`` and ``app.log.2.gz``, whose cursors
+        carry the id of the archive, see `parse_cursor`, so they stay valid
+        as the archives are renamed by later rotations. Archives are read in
+        the background by `ArchiveReader`, so those pages are returned as
+        futures.
+
+        Args:
+            filename (str): Path to file which should exist in the registry.
+            n (int): Number of lines to read, up to `history_max_lines`.
+            before (Optional[int or str]): Cursor of the previous page,
+                defaults to the end of the content sent so far.
+            skip (Optional[int]): Number of lines before the cursor to skip.
+
+        Returns:
+            dict or Future: The `lines`, the `cursor` of the page, whether
+                the file `has_more` lines before it and the number of its
+                first `line` if known.
+
+        """
+        filename = os.path.abspath(filename)
+        reader = self.readers[filename]
+        n = min(n, self.history_max_lines)
+        archive, before = parse_cursor(before)
+        if archive is not None:
+            return self.archives.read_history(
+                filename, n, archive=archive, before=before, skip=skip)
+
+        self.build_line_index(reader)
+
+        fd, index = reader['file'], reader['line_index']
+        end = reader['offset'] - reader['assembler'].pending
+        if before is not None:
+            end = max(0, min(before, end))
+
+        line_number = None
+        # Lines to skip beyond the start of the file, in its archives
+        archive_skip = 0
+        if index.covers(end):
+            line_number = index.get_line_number(fd, end)
+            if skip:
+                archive_skip = max(0, skip - line_number)
+                line_number = max(0, line_number - skip)
+                end = index.get_position(fd, line_number)
+                skip = 0
+
+        lines, start = read_lines_before(
+            fd, n, end=end, offset=skip, block_size=self.tail_block_size,
+            use_mmap=self.tail_use_mmap)
+        page = {
+            'lines': [line.decode('utf-8', 'replace') for line in lines],
+            'cursor': start,
+            'has_more': start > 0,
+            'line': None if line_number is None else line_number - len(lines),
+        }
+        if start > 0 or not find_archives(filename):
+            return page
+
+        if len(lines) == n:
+            page['has_more'] = True
+            return page
+
+        if skip and not lines:
+            archive_skip = max(0, skip - count_lines(
+                fd, end, block_size=self.tail_block_size))
+        return self.archives.read_history(
+            filename, n, skip=archive_skip, newer_lines=page['lines'])
+
+    def configure_coalescing(self, filename, window_ms=None, max_bytes=None):
+        """Overrides the coalescing settings for a particular file, applying
+        them to its reader if it exists already.
+
+        Args:
+            filename (str): Path to the file.
+            window_ms (Optional[int]): Coalescing window in milliseconds,
+                defaults to the registry's setting.
+            max_bytes (Optional[int]): Size of collected content to send
+                right away, defaults to the registry's setting.
+
+        """
+        filename = os.path.abspath(filename)
+        if window_ms is None:
+            window_ms = self.coalesce_window_ms
+        if max_bytes is None:
+            max_bytes = self.coalesce_max_bytes
+
+        self.coalescing_overrides[filename] = (window_ms, max_bytes)
+        if filename in self.readers:
+            coalescer = self.readers[filename]['coalescer']
+            coalescer.window = window_ms / 1000
+            coalescer.max_bytes = max_bytes
+
+    def get_coalescing_stats(self):
+        """Returns the coalescing counters for every file in the registry.
+
+        Returns:
+            dict: Filenames as keys and dicts with the number of chunks read,
+                batches sent and chunks merged into other batches as values.
+
+        """
+        return {
+            filename: {
+                'chunks': reader['coalescer'].chunks_received,
+                'batches': reader['coalescer'].batches_flushed,
+                'merged': reader['coalescer'].merged,
+            }
+            for filename, reader in self.readers.items()
+        }
+
+    def get_file_id(self, path):
+        """Returns the id identifying a file in the binary protocol, assigning
+        one the first time it is requested.
+
+        Args:
+            path (str): Absolute path of the file.
+
+        """
+        if path not in self.file_ids:
+            file_id = len(self.file_ids) + 1
+            self.file_ids[path] = file_id
+            self.file_paths[file_id] = path
+        return self.file_ids[path]
+
+    def send_message_to_reader_handlers(self, filename, message):
+        """Sends a message to the handlers registered for a filename, keeping
+        it in the scrollback of the reader.
+
+        Handlers using filters receive only the lines passing them, the
+        message for each distinct filter is built once and shared by all
+        the handlers using it.
+
+        Args:
+            filename (str): Path to file which should exist in the registry.
+            message (str): The message to be sent.
+
+        """
+        reader = self.readers[filename]
+        file_id = self.get_file_id(filename)
+        offset = reader['offset'] - reader['assembler'].pending
+        reader['scrollback'].append(message, offset)
+        metrics.FILE_BATCHES.inc(filename)
+        read_time = reader.pop('read_time', None)
+        if read_time is not None:
+            metrics.READ_TO_SEND_SECONDS.observe(
+                asyncio.get_event_loop().time() - read_time)
+        for group_message, handlers in reader['filter_groups'].split(message):
+            self.send_message_to_handlers(
+                group_message, handlers, file_id=file_id, offset=offset)
+
+    @report_slow_calls('send_message_to_handlers')
+    def send_message_to_handlers(self, message, handlers, **metadata):
         """Sends a message string to the handlers
 
+        The message is wrapped in a BroadcastMessage so its encoding and
+        framing are done once and shared by all the handlers, if there are
+        more than one.
+
         Also handles empty messages and raises to avoid overloading the client.
 
         Args:
             message (str): The message to be sent.
             handlers (list): List of WebSocketHandlers to write the message.
+            **metadata: The file id, offset and body of the message for the
+                binary protocol, see `BroadcastMessage`.
 
         """
-        logger.info("Sending: '{}' to handlers".format(message))
+        sending_log.log(
+            "Sending: '%.80s' to %d handlers", message, len(handlers))
 
         if not message:
             logger.warning('Reader called with no message, wasted call?')
@@ -227,5 +1055,7 @@ class ReaderRegistry():
             if self.empty_msg_count > 10:
                 raise ExcessiveEmptyMessagesError()
 
+        message = BroadcastMessage(
+            message, shared=len(handlers) > 1, **metadata)
         for handler in handlers:
             handler.write_message(message)
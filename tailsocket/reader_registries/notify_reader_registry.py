@@ -9,7 +9,10 @@ import logging
 import pyinotify
 
 from .loop_reader_registry import ReaderRegistry
+from .poll_reader_registry import FilePoller, is_network_filesystem
+from tailsocket import metrics
 from tailsocket.errors import CouldNotCreateDescriptorError
+from tailsocket.profiling import report_slow_calls
 
 logger = logging.getLogger('tornado.application')
 
@@ -17,81 +20,402 @@ logger = logging.getLogger('tornado.application')
 class EventHandler(pyinotify.ProcessEvent):
     """Pyinotify event handler, invokes registry methods on masked events.
 
+    A single instance is shared by all the files watched by a registry, events
+    are dispatched to the right file using their watch descriptor.
+
     """
 
-    def my_init(self, file, registry):
-        self.filename = file
+    def my_init(self, registry):
         self.registry = registry
 
+    @report_slow_calls('process_IN_MODIFY')
     def process_IN_MODIFY(self, event):
-        print("Modifying: ", event.pathname)
-        with open(event.pathname, 'rb') as fd:
-            fd.seek(
-                self.registry.readers[event.pathname]['previous_stat'].st_size)
-            self.registry.reader(fd)
+        filename = self.registry.get_filename_for_watch_descriptor(event.wd)
+        if filename is None:
+            # Either a file in a directory watched for a glob subscription
+            # or the watch was removed while the event was in flight
+            self.registry.read_glob_file(event.wd, event.name)
+            return
+
+        # Counted before the reader, which may skip the file while catching
+        # up or read the content of several events at once
+        metrics.FILE_EVENTS_RECEIVED.inc(filename)
+        self.registry.reader(filename)
+
+    def process_IN_MOVE_SELF(self, event):
+        self.check_replacement_of_watched_file(event)
+
+    def process_IN_DELETE_SELF(self, event):
+        self.check_replacement_of_watched_file(event)
+
+    def process_IN_ATTRIB(self, event):
+        # Unlinking a file we keep open only changes its link count
+        self.check_replacement_of_watched_file(event)
+
+    def process_IN_CREATE(self, event):
+        self.check_replacement_in_directory(event)
+        self.registry.add_glob_path(event.wd, event.name, event.dir)
+
+    def process_IN_MOVED_TO(self, event):
+        self.check_replacement_in_directory(event)
+        self.registry.add_glob_path(event.wd, event.name, event.dir)
+
+    def check_replacement_of_watched_file(self, event):
+        filename = self.registry.get_filename_for_watch_descriptor(event.wd)
+        if filename is not None:
+            self.registry.check_replacement(filename)
+
+    def check_replacement_in_directory(self, event):
+        filename = self.registry.get_filename_for_directory_event(
+            event.wd, event.name)
+        if filename is not None:
+            self.registry.check_replacement(filename)
 
 
 class NotifyReaderRegistry(ReaderRegistry):
     """Subclass of ReaderRegistry using pyinotify handlers instead of raw
     asyncio polling for Linux compatibility.
 
+    Besides watching the files themselves, the directories containing them
+    are watched for new files to detect rotations replacing the files, so
+    there is no need to poll their paths.
+
+    Glob subscriptions only watch the directories that may contain matching
+    files, receiving the modifications of all the files in them through a
+    single watch per directory.
+
+    Files in network filesystems, where inotify doesn't see the changes made
+    by other hosts, are polled instead, see `FilePoller`.
+
     """
 
+    rotation_check_interval = None
+    poll_min_interval = 0.05
+    poll_max_interval = 2
+    poll_backoff = 2
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._watch_manager = pyinotify.WatchManager()
-        self._mask = pyinotify.IN_MODIFY  # TODO: does this include rolling?
+        self._mask = (
+            pyinotify.IN_MODIFY | pyinotify.IN_MOVE_SELF |
+            pyinotify.IN_DELETE_SELF | pyinotify.IN_ATTRIB)
+        self._directory_mask = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO
+        self._glob_directory_mask = self._directory_mask | pyinotify.IN_MODIFY
+        self._notifier = None
+        self._watch_descriptors = {}
+        self._directory_watches = {}
+        self._directory_descriptors = {}
+        self._poller = None
+
+    def get_notifier(self):
+        """Returns the pyinotify notifier shared by all the watched files.
+
+        The notifier is created lazily to make sure it is attached to the
+        event loop in use when the first file is watched.
+
+        """
+        if self._notifier is None:
+            self._notifier = pyinotify.AsyncioNotifier(
+                self._watch_manager,
+                asyncio.get_event_loop(),
+                default_proc_fun=EventHandler(registry=self))
+        return self._notifier
+
+    def get_filename_for_watch_descriptor(self, watch_descriptor):
+        """Returns the filename watched by a watch descriptor or None if the
+        watch descriptor is not registered.
+
+        Args:
+            watch_descriptor (int): The watch descriptor of an inotify event.
+
+        """
+        return self._watch_descriptors.get(watch_descriptor)
+
+    def get_filename_for_directory_event(self, watch_descriptor, name):
+        """Returns the path of a file created or moved into a watched
+        directory if the path is in the registry, None otherwise.
+
+        Args:
+            watch_descriptor (int): The watch descriptor of the directory.
+            name (str): The name of the file in the directory.
+
+        """
+        directory = self._directory_descriptors.get(watch_descriptor)
+        if directory is None:
+            return None
+
+        filename = os.path.join(directory, name)
+        return filename if filename in self.readers else None
 
-    def create_reader(self, filename, read_last_n_lines=10):
-        """Opens the specified file and creates the reader callback.
+    def get_poller(self):
+        """Returns the poller of the files in network filesystems, created
+        on first use.
+
+        """
+        if self._poller is None:
+            self._poller = FilePoller(
+                self, min_interval=self.poll_min_interval,
+                max_interval=self.poll_max_interval, backoff=self.poll_backoff)
+        return self._poller
 
-        Optionally returns the last few lines of content.
+    def watch_file(self, filename, fd):
+        """Adds an inotify watch for the file to the shared notifier, or
+        polls it if it lives in a network filesystem.
 
         Args:
-            filename (str): Path of the file to create reader for.
-            read_last_n_lines (Optional[int]): Optional number of lines of
-                content to be returned
+            filename (str): Path of the file to watch.
+            fd (file-like): The open file to watch.
 
         Returns:
-            tuple: A file descriptor and possibly empty string of content
+            int: The watch descriptor of the file, or its poll if polled.
 
         """
-        filename = os.path.abspath(filename)
-        logger.debug('Creating reader for {}'.format(filename))
-        fd = open(filename, 'rb')
-        if read_last_n_lines:
-            logger.debug('Reading last {} lines'.format(read_last_n_lines))
-            content, _ = self.read_last_lines_from_file(
-                read_last_n_lines, fd)
-            content = '\n'.join(content)
-        else:
-            fd.seek(0, os.SEEK_END)
-            content = ''
+        if is_network_filesystem(filename):
+            logger.info('Polling %s in a network filesystem', filename)
+            return self.get_poller().watch(filename, fd)
 
+        self.get_notifier()
         # add_watch returns a dict with the filename as a key and a watch
         # descriptor as a value
         watch_descriptor = self._watch_manager.add_watch(filename, self._mask)
         if watch_descriptor[filename] < 0:
             raise CouldNotCreateDescriptorError()
 
-        handler = EventHandler(file=filename, registry=self)
-        pyinotify.AsyncioNotifier(
-            self._watch_manager,
-            asyncio.get_event_loop(),
-            default_proc_fun=handler)
-        return watch_descriptor[filename], content
+        self._watch_descriptors[watch_descriptor[filename]] = filename
+        self.watch_directory(os.path.dirname(filename), filename)
+        return watch_descriptor[filename]
+
+    def unwatch_file(self, filename, descriptor):
+        """Removes the inotify watch of a file. Overridden for pyinotify.
+
+        Args:
+            filename (str): Path of the watched file.
+            descriptor (int): The watch descriptor of the file, or its poll.
+
+        """
+        if isinstance(descriptor, dict):
+            self.get_poller().unwatch(descriptor)
+            return
+
+        self._watch_manager.rm_watch(descriptor)
+        self._watch_descriptors.pop(descriptor, None)
+        self.unwatch_directory(os.path.dirname(filename), filename)
+
+    def watch_directory(self, directory, filename):
+        """Adds an inotify watch for files created in a directory, shared by
+        all the files in the registry living in it.
+
+        Args:
+            directory (str): Path of the directory.
+            filename (str): Path of the file requiring the watch.
+
+        """
+        directory_watch = self.get_directory_watch(directory)
+        directory_watch['filenames'].append(filename)
 
-    def remove_reader_for_filename(self, filename):
-        """Removes reader registration for a filename. Overridden for pyinotify.
+    def unwatch_directory(self, directory, filename):
+        """Releases the watch of a directory required by a file, removing it
+        if no other file requires it.
 
         Args:
-            filename (str): Path to file which should exist in the registry.
+            directory (str): Path of the directory.
+            filename (str): Path of the file requiring the watch.
 
         """
-        logger.debug('No handlers left for {}, removing'.format(filename))
-        self._watch_manager.rm_watch(self.readers[filename]['descriptor'])
-        del self.readers[filename]
+        directory_watch = self._directory_watches[directory]
+        directory_watch['filenames'].remove(filename)
+        self.release_directory_watch(directory)
+
+    def watch_glob(self, pattern, glob_reader):
+        """Watches the directories that may contain files matching a glob
+        pattern. Overridden for pyinotify.
+
+        Args:
+            pattern (str): The glob pattern.
+            glob_reader (GlobReader): The reader of the matching files.
+
+        Returns:
+            list: The watched directories, extended as new ones are created.
+
+        """
+        self.get_notifier()
+        directories = glob_reader.get_directories()
+        for directory in directories:
+            self.watch_glob_directory(directory, pattern)
+        return directories
+
+    def unwatch_glob(self, pattern, descriptor):
+        """Releases the watches of the directories of a glob pattern.
+
+        Args:
+            pattern (str): The glob pattern.
+            descriptor (list): The directories returned by `watch_glob`.
+
+        """
+        for directory in descriptor:
+            self.unwatch_glob_directory(directory, pattern)
+
+    def watch_glob_directory(self, directory, pattern):
+        """Adds an inotify watch for files created and modified in a
+        directory, shared by all the glob patterns matching files in it.
+
+        Args:
+            directory (str): Path of the directory.
+            pattern (str): The glob pattern requiring the watch.
+
+        """
+        directory_watch = self.get_directory_watch(directory)
+        directory_watch['patterns'].append(pattern)
+        self.update_directory_mask(directory_watch)
+
+    def unwatch_glob_directory(self, directory, pattern):
+        """Releases the watch of a directory required by a glob pattern.
+
+        Args:
+            directory (str): Path of the directory.
+            pattern (str): The glob pattern requiring the watch.
+
+        """
+        directory_watch = self._directory_watches[directory]
+        directory_watch['patterns'].remove(pattern)
+        self.release_directory_watch(directory)
+
+    def get_directory_watch(self, directory):
+        """Returns the watch of a directory, adding it if needed.
+
+        Args:
+            directory (str): Path of the directory.
+
+        """
+        if directory not in self._directory_watches:
+            watch_descriptor = self._watch_manager.add_watch(
+                directory, self._directory_mask)
+            if watch_descriptor[directory] < 0:
+                raise CouldNotCreateDescriptorError()
+
+            self._directory_watches[directory] = {
+                'descriptor': watch_descriptor[directory],
+                'mask': self._directory_mask,
+                'filenames': [],
+                'patterns': [],
+            }
+            self._directory_descriptors[watch_descriptor[directory]] = (
+                directory)
+
+        return self._directory_watches[directory]
+
+    def release_directory_watch(self, directory):
+        """Removes the watch of a directory if no file or glob pattern
+        requires it, updating its mask otherwise.
+
+        Args:
+            directory (str): Path of the directory.
+
+        """
+        directory_watch = self._directory_watches[directory]
+        if directory_watch['filenames'] or directory_watch['patterns']:
+            self.update_directory_mask(directory_watch)
+            return
+
+        self._watch_manager.rm_watch(directory_watch['descriptor'])
+        del self._directory_descriptors[directory_watch['descriptor']]
+        del self._directory_watches[directory]
+
+    def update_directory_mask(self, directory_watch):
+        """Adds modification events to the mask of a directory watch while
+        glob patterns require it.
+
+        Args:
+            directory_watch (dict): The watch of the directory.
+
+        """
+        mask = self._directory_mask
+        if directory_watch['patterns']:
+            mask = self._glob_directory_mask
+
+        if mask != directory_watch['mask']:
+            self._watch_manager.update_watch(
+                directory_watch['descriptor'], mask=mask)
+            directory_watch['mask'] = mask
+
+    def get_glob_subscriptions_for_directory_event(
+            self, watch_descriptor, name):
+        """Returns the path of a file in a watched directory and the glob
+        subscriptions watching the directory.
+
+        Args:
+            watch_descriptor (int): The watch descriptor of the directory.
+            name (str): The name of the file in the directory.
+
+        Returns:
+            tuple: The path and a list of pattern and subscription tuples.
+
+        """
+        directory = self._directory_descriptors.get(watch_descriptor)
+        if directory is None or not name:
+            return None, []
+
+        directory_watch = self._directory_watches[directory]
+        return os.path.join(directory, name), [
+            (pattern, self.globs[pattern])
+            for pattern in directory_watch['patterns']
+            if pattern in self.globs
+        ]
+
+    def read_glob_file(self, watch_descriptor, name):
+        """Reads a modified file in a directory watched for glob
+        subscriptions, if it matches their patterns.
+
+        Args:
+            watch_descriptor (int): The watch descriptor of the directory.
+            name (str): The name of the file in the directory.
+
+        """
+        path, subscriptions = self.get_glob_subscriptions_for_directory_event(
+            watch_descriptor, name)
+        received = False
+        for pattern, subscription in subscriptions:
+            glob_reader = subscription['glob_reader']
+            if path not in glob_reader.files:
+                if not glob_reader.matches(path):
+                    continue
+                glob_reader.track(path, from_start=True)
+
+            if not received:
+                metrics.FILE_EVENTS_RECEIVED.inc(path)
+                received = True
+            glob_reader.read(path)
+
+    def add_glob_path(self, watch_descriptor, name, is_directory):
+        """Adds a file or directory created in a directory watched for glob
+        subscriptions, if it matches their patterns.
+
+        New files are read from their start, new directories are watched and
+        the files already in them added.
+
+        Args:
+            watch_descriptor (int): The watch descriptor of the directory.
+            name (str): The name of the new file or directory.
+            is_directory (bool): Whether the new path is a directory.
+
+        """
+        path, subscriptions = self.get_glob_subscriptions_for_directory_event(
+            watch_descriptor, name)
+        for pattern, subscription in subscriptions:
+            glob_reader = subscription['glob_reader']
+            if not is_directory:
+                if glob_reader.matches(path):
+                    glob_reader.track(path, from_start=True)
+                    glob_reader.read(path)
+                continue
+
+            if not glob_reader.matches_directory(path):
+                continue
 
-    def remove_reader_callback_for_descriptor(self, descriptor):
-        # Overridden as a no-op as it's not necessary using pyinotify.
-        pass
+            for directory in glob_reader.get_directories(path):
+                if directory not in subscription['descriptor']:
+                    self.watch_glob_directory(directory, pattern)
+                    subscription['descriptor'].append(directory)
+            for tracked in glob_reader.scan(directory=path, from_start=True):
+                glob_reader.read(tracked)
@@ -0,0 +1,258 @@
+"""
+Polling Reader Registry definition, for filesystems where neither watching
+the files on the event loop nor inotify work, like network mounts.
+
+"""
+
+import os
+import re
+import asyncio
+
+from .loop_reader_registry import ReaderRegistry, is_same_file
+
+# Filesystem types whose changes made by other hosts inotify doesn't see
+NETWORK_FILESYSTEMS = frozenset((
+    '9p', 'afs', 'ceph', 'cifs', 'coda', 'fuse.glusterfs', 'fuse.sshfs',
+    'glusterfs', 'gpfs', 'lustre', 'ncpfs', 'nfs', 'nfs4', 'smb3', 'smbfs',
+))
+
+
+def get_filesystem_type(path, mounts_path='/proc/self/mounts'):
+    """Returns the type of the filesystem a path lives in, from the mount
+    point closest to it.
+
+    Args:
+        path (str): The path.
+        mounts_path (Optional[str]): Path of the list of mounts, only
+            available on Linux.
+
+    Returns:
+        str: The filesystem type, or None if unknown.
+
+    """
+    try:
+        with open(mounts_path) as fd:
+            mounts = [line.split() for line in fd]
+    except OSError:
+        return None
+
+    path = os.path.realpath(path)
+    filesystem_type, longest = None, -1
+    for mount in mounts:
+        if len(mount) < 3:
+            continue
+        # Spaces and other characters are octal escaped, e.g. \040
+        mount_point = re.sub(
+            r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)),
+            mount[1]).rstrip('/')
+        if path != mount_point and not path.startswith(mount_point + '/'):
+            continue
+        if len(mount_point) > longest:
+            filesystem_type, longest = mount[2], len(mount_point)
+    return filesystem_type
+
+
+def is_network_filesystem(path):
+    """Returns True if a path lives in a network filesystem.
+
+    """
+    return get_filesystem_type(path) in NETWORK_FILESYSTEMS
+
+
+def stat_files(files):
+    """Returns the size of open files and the stat of their paths, run in an
+    executor so a slow filesystem doesn't block the event loop.
+
+    Args:
+        files (list): Tuples of an open file and its path.
+
+    Returns:
+        list: Tuples of the size of each file and the stat of its path, None
+            if they could not be read, e.g. if the file was closed or its
+            path removed meanwhile.
+
+    """
+    results = []
+    for fd, path in files:
+        try:
+            size = os.fstat(fd.fileno()).st_size
+        except (OSError, ValueError):
+            size = None
+        try:
+            path_stat = os.stat(path)
+        except OSError:
+            path_stat = None
+        results.append((size, path_stat))
+    return results
+
+
+class FilePoller():
+    """Polls the files of a registry for new content and replacements,
+    calling its reader when a file grows or shrinks.
+
+    Each file is polled at its own interval, the minimum one while it is
+    active, doubled every poll it stays idle up to the maximum one. The
+    files due at the same time are checked in a single batch of stat calls
+    run in an executor.
+
+    Polls are dicts with the path and the open file, the current interval
+    and the time of the next poll, they are the descriptors returned by
+    `watch`.
+
+    Args:
+        registry (ReaderRegistry): The registry of the files.
+        min_interval (Optional[float]): Seconds between polls of active files.
+        max_interval (Optional[float]): Seconds between polls of idle files.
+        backoff (Optional[float]): Multiplier of the interval of idle files.
+
+    """
+
+    def __init__(self, registry, min_interval=0.05, max_interval=2,
+                 backoff=2):
+        self.registry = registry
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.polls = {}
+        self._handle = None
+        self._polling = False
+
+    def watch(self, filename, fd):
+        """Starts polling a file.
+
+        Returns:
+            dict: The poll of the file.
+
+        """
+        poll = {
+            'filename': filename,
+            'file': fd,
+            'interval': self.min_interval,
+            'next_poll': (
+                asyncio.get_event_loop().time() + self.min_interval),
+        }
+        self.polls[filename] = poll
+        self.schedule()
+        return poll
+
+    def unwatch(self, poll):
+        """Stops polling a file, unless it was replaced by a new poll as
+        rotations do.
+
+        """
+        if self.polls.get(poll['filename']) is poll:
+            del self.polls[poll['filename']]
+            self.schedule()
+
+    def schedule(self):
+        """Schedules the poll of the files due first, unless a batch is in
+        progress, in which case it is scheduled once done.
+
+        """
+        if self._polling:
+            return
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self.polls:
+            return
+
+        loop = asyncio.get_event_loop()
+        next_poll = min(poll['next_poll'] for poll in self.polls.values())
+        self._handle = loop.call_at(next_poll, self.poll)
+
+    def poll(self):
+        self._handle = None
+        self._polling = True
+        asyncio.ensure_future(self.poll_due_files())
+
+    @asyncio.coroutine
+    def poll_due_files(self):
+        """Checks the files due for a poll, reading the ones whose size
+        changed and switching to the new file of those replaced.
+
+        """
+        loop = asyncio.get_event_loop()
+        # Timers may run up to the resolution of the clock early
+        now = loop.time() + 0.001
+        due = [
+            poll for poll in self.polls.values() if poll['next_poll'] <= now]
+        try:
+            results = yield from loop.run_in_executor(
+                None, stat_files,
+                [(poll['file'], poll['filename']) for poll in due])
+            for poll, (size, path_stat) in zip(due, results):
+                if self.polls.get(poll['filename']) is poll:
+                    self.check(poll, size, path_stat)
+        finally:
+            self._polling = False
+            self.schedule()
+
+    def check(self, poll, size, path_stat):
+        """Reads a file if its size changed and checks whether its path
+        points to a new file, adapting its interval to its activity.
+
+        Args:
+            poll (dict): The poll of the file.
+            size (int): The size of the open file.
+            path_stat (os.stat_result): The stat of the path of the file.
+
+        """
+        filename = poll['filename']
+        reader = self.registry.readers.get(filename)
+        if reader is None:
+            return
+
+        active = False
+        if size is not None and size != reader['offset']:
+            active = True
+            self.registry.reader(filename)
+        if path_stat is not None and not is_same_file(
+                path_stat, reader['previous_stat']):
+            active = True
+            self.registry.check_replacement(filename)
+
+        if active:
+            poll['interval'] = self.min_interval
+        else:
+            poll['interval'] = min(
+                poll['interval'] * self.backoff, self.max_interval)
+        poll['next_poll'] = asyncio.get_event_loop().time() + poll['interval']
+
+
+class PollReaderRegistry(ReaderRegistry):
+    """Subclass of ReaderRegistry polling the size of the files instead of
+    watching them, for network filesystems and event loops which can't
+    watch regular files.
+
+    Files are polled frequently while they are written to and less so as
+    they stay idle, see `FilePoller`. Rotations are detected by the same
+    polls.
+
+    """
+
+    rotation_check_interval = None
+    poll_min_interval = 0.05
+    poll_max_interval = 2
+    poll_backoff = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.poller = FilePoller(
+            self, min_interval=self.poll_min_interval,
+            max_interval=self.poll_max_interval, backoff=self.poll_backoff)
+
+    def watch_file(self, filename, fd):
+        """Starts polling the file. Overridden for polling.
+
+        Returns:
+            dict: The poll of the file.
+
+        """
+        return self.poller.watch(filename, fd)
+
+    def unwatch_file(self, filename, descriptor):
+        """Stops polling the file. Overridden for polling.
+
+        """
+        self.poller.unwatch(descriptor)
@@ -0,0 +1,387 @@
+"""
+RemoteReaderRegistry definition, used by worker processes receiving the
+lines of the files from the tailer process.
+
+"""
+
+import os
+import socket
+import logging
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.iostream import IOStream, StreamClosedError
+
+from tailsocket import metrics
+from tailsocket.binary_protocol import MESSAGE_ERROR, MESSAGE_STATUS
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.filters import FilterGroups
+from tailsocket.glob_reader import is_glob
+from tailsocket.reader_registries.loop_reader_registry import ReaderRegistry
+from tailsocket.scrollback import ScrollbackBuffer
+from tailsocket.send_queue import SKIPPED_LINES_MARKER
+from tailsocket.tailer import encode_frame, read_frame
+
+logger = logging.getLogger('tornado.application')
+
+
+class RemoteReaderRegistry(ReaderRegistry):
+    """Registry of a worker process, which reads no file itself but
+    subscribes to them on the tailer process, see `tailsocket.tailer`.
+
+    A worker subscribes to a file or glob pattern once regardless of how
+    many of its handlers tail it, and distributes the lines it receives to
+    them, filtering them and keeping the scrollback of the files like the
+    registries reading them. Handlers added while a subscription is made
+    wait for its reply to receive their initial lines.
+
+    Reader dicts hold the handlers, the filter groups, the scrollback, the
+    id and offset of the file and the list of `pending` handlers with their
+    filters and resume positions, which is None once the subscription is
+    made.
+
+    Args:
+        socket_path (str): Path of the Unix socket of the tailer.
+        *args: The arguments of `ReaderRegistry`.
+        **kwargs: The keyword arguments of `ReaderRegistry`.
+
+    """
+
+    def __init__(self, socket_path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+        self.stream = None
+        self.requests = {}
+        self.next_request_id = 1
+
+    @gen.coroutine
+    def connect(self):
+        """Connects to the tailer and handles its messages until the
+        connection is closed.
+
+        Requests may be sent as soon as this is called, they are buffered
+        until the connection is made.
+
+        """
+        self.stream = IOStream(
+            socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+        try:
+            yield self.stream.connect(self.socket_path)
+            while True:
+                header, body = yield read_frame(self.stream)
+                self.on_tailer_message(header, body)
+        except StreamClosedError:
+            logger.error(
+                'Connection to the tailer at %s closed', self.socket_path)
+            requests, self.requests = self.requests, {}
+            for future in requests.values():
+                future.set_exception(StreamClosedError())
+
+    def send_request(self, request):
+        """Sends a request to the tailer.
+
+        Raises:
+            StreamClosedError: If the connection to the tailer is closed.
+
+        """
+        self.stream.write(encode_frame(request))
+
+    def request(self, request):
+        """Sends a request to the tailer expecting a reply.
+
+        Returns:
+            Future: Resolved with the reply.
+
+        """
+        future = Future()
+        request['id'] = self.next_request_id
+        self.next_request_id += 1
+        self.requests[request['id']] = future
+        self.send_request(request)
+        return future
+
+    def add_handler_to_filename(
+            self, ws_handler, filename, line_filter=None, resume_from=None):
+        """Adds a WebSocketHandler instance to a filename path, subscribing to
+        the file on the tailer if necessary.
+
+        Handlers resuming a tail are sent the lines of the scrollback
+        following the position they give, if it reaches back to it.
+
+        Args:
+            ws_handler (WebSocketHandler): WebSocketHandler to attach.
+            filename (str): Path to the file.
+            line_filter (Optional[LineFilter]): Filter of the lines to send
+                to the handler, by default all lines are sent.
+            resume_from (Optional[int]): Offset of the last lines received by
+                the handler in a previous subscription.
+
+        """
+        logger.debug('Adding handler for %s', filename)
+        filename = os.path.abspath(filename)
+        if filename not in self.readers:
+            self.send_request({'type': 'subscribe', 'key': filename})
+            self.readers[filename] = {
+                'handlers': [],
+                'filter_groups': FilterGroups(),
+                'scrollback': ScrollbackBuffer(
+                    self.scrollback_lines, self.scrollback_bytes),
+                'file_id': 0,
+                'offset': 0,
+                'pending': [],
+            }
+
+        reader = self.readers[filename]
+        reader['handlers'].append(ws_handler)
+        if reader['pending'] is not None:
+            reader['pending'].append((ws_handler, line_filter, resume_from))
+        else:
+            self.add_subscribed_handler(
+                reader, ws_handler, line_filter, resume_from)
+
+    def add_subscribed_handler(
+            self, reader, ws_handler, line_filter=None, resume_from=None):
+        """Adds a handler to the filter groups of a file already subscribed
+        to, sending it the initial lines from the scrollback.
+
+        """
+        reader['filter_groups'].add(ws_handler, line_filter)
+        lines = None
+        if resume_from is not None:
+            lines = reader['scrollback'].get_lines_after(resume_from)
+        resumed = lines is not None
+        if not resumed:
+            lines = reader['scrollback'].get_last_lines(
+                self.initial_lines_from_file)
+        self.send_initial_lines(
+            ws_handler, lines, line_filter, file_id=reader['file_id'],
+            offset=reader['offset'], resumed=resumed)
+
+    def remove_handler_from_filename(self, ws_handler, filename):
+        """Removes a WebSocketHandler instance from a filename path entry,
+        unsubscribing from the file if it has no handlers left.
+
+        Returns:
+            bool: True if handler was removed correctly.
+
+        """
+        reader = self.readers.get(os.path.abspath(filename))
+        if reader is not None and reader['pending']:
+            reader['pending'] = [
+                pending for pending in reader['pending']
+                if pending[0] is not ws_handler]
+        return super().remove_handler_from_filename(ws_handler, filename)
+
+    def remove_reader_for_filename(self, filename):
+        """Removes reader registration for a filename and unsubscribes from
+        the file on the tailer.
+
+        """
+        logger.debug('No handlers left for %s, removing', filename)
+        del self.readers[filename]
+        self.unsubscribe(filename)
+
+    def add_handler_to_glob(self, ws_handler, pattern, line_filter=None):
+        """Adds a WebSocketHandler instance to the files matching a glob
+        pattern, subscribing to it on the tailer if necessary.
+
+        Handlers of an existing subscription wait for the tailer to reply
+        with the number of matching files, as the worker doesn't know it.
+
+        Args:
+            ws_handler (WebSocketHandler): WebSocketHandler to attach.
+            pattern (str): The glob pattern.
+            line_filter (Optional[LineFilter]): Filter of the lines to send
+                to the handler, by default all lines are sent.
+
+        """
+        logger.debug('Adding handler for %s', pattern)
+        pattern = os.path.abspath(pattern)
+        if pattern not in self.globs:
+            self.send_request({'type': 'subscribe', 'key': pattern})
+            self.globs[pattern] = {
+                'handlers': [],
+                'filter_groups': FilterGroups(),
+                'pending': [],
+            }
+        elif not self.globs[pattern]['pending']:
+            self.send_request({'type': 'status', 'key': pattern})
+
+        subscription = self.globs[pattern]
+        subscription['handlers'].append(ws_handler)
+        subscription['pending'].append((ws_handler, line_filter))
+
+    def remove_handler_from_glob(self, ws_handler, pattern):
+        """Removes a WebSocketHandler instance from a glob subscription,
+        unsubscribing from the pattern if it has no handlers left.
+
+        Returns:
+            bool: True if handler was removed correctly.
+
+        """
+        pattern = os.path.abspath(pattern)
+        subscription = self.globs.get(pattern)
+        if subscription is None or ws_handler not in subscription['handlers']:
+            logger.warning(
+                'Attempted to remove a handler not present in the registry'
+                ' for pattern %s', pattern)
+            return False
+
+        subscription['handlers'].remove(ws_handler)
+        subscription['filter_groups'].remove(ws_handler)
+        subscription['pending'] = [
+            (h, f) for h, f in subscription['pending'] if h is not ws_handler]
+        if not subscription['handlers']:
+            logger.debug('No handlers left for %s, removing', pattern)
+            del self.globs[pattern]
+            self.unsubscribe(pattern)
+
+        return True
+
+    def unsubscribe(self, key):
+        """Unsubscribes from a file or glob pattern on the tailer, if still
+        connected.
+
+        """
+        try:
+            self.send_request({'type': 'unsubscribe', 'key': key})
+        except StreamClosedError:
+            pass
+
+    def read_history(self, filename, n, before=None, skip=0):
+        """Requests a page of the history of a file to the tailer, see
+        `ReaderRegistry.read_history`.
+
+        Returns:
+            Future: Resolved with the page.
+
+        """
+        return self.request({
+            'type': 'history',
+            'key': os.path.abspath(filename),
+            'lines': n,
+            'before': before,
+            'skip': skip,
+        })
+
+    def on_tailer_message(self, header, body):
+        """Handles a message from the tailer.
+
+        Args:
+            header (dict): The header of the message.
+            body (str): The lines or status text of the message.
+
+        """
+        if 'id' in header:
+            future = self.requests.pop(header['id'], None)
+            if future is None:
+                return
+            if header['type'] == 'error':
+                future.set_exception(ValueError(header['message']))
+            else:
+                future.set_result(header['page'])
+            return
+
+        if header['type'] == 'skipped':
+            self.on_skipped_lines(header)
+            return
+
+        if header.get('path'):
+            self.file_ids[header['path']] = header['file_id']
+            self.file_paths[header['file_id']] = header['path']
+
+        if is_glob(header['key']):
+            self.on_glob_message(header, body)
+        else:
+            self.on_file_message(header, body)
+
+    def on_skipped_lines(self, header):
+        """Tells the handlers of a file or glob pattern how many lines the
+        tailer dropped while the worker fell behind.
+
+        """
+        metrics.TAILER_SKIPPED_LINES.inc(amount=header['lines'])
+        subscription = self.readers.get(header['key']) or self.globs.get(
+            header['key'])
+        if subscription is None:
+            return
+
+        message = BroadcastMessage(
+            SKIPPED_LINES_MARKER.format(header['lines']),
+            message_type=MESSAGE_STATUS)
+        for ws_handler in list(subscription['handlers']):
+            ws_handler.write_message(message)
+
+    def on_file_message(self, header, body):
+        """Handles a message from the tailer on a file subscription.
+
+        Lines of a subscription still pending belong to a previous one and
+        are dropped.
+
+        """
+        reader = self.readers.get(header['key'])
+        if reader is None:
+            return
+
+        if header['type'] == 'error':
+            self.fail_subscription(self.readers, header)
+            return
+
+        if reader['pending'] is None and header['type'] == 'subscribed':
+            return
+        if reader['pending'] is not None and header['type'] == 'lines':
+            return
+
+        reader['file_id'] = header.get('file_id', 0)
+        reader['offset'] = header.get('offset', 0)
+        if not header.get('status') and body:
+            reader['scrollback'].append(body, reader['offset'])
+
+        if header['type'] == 'lines':
+            for group_message, handlers in reader['filter_groups'].split(
+                    body):
+                self.send_message_to_handlers(
+                    group_message, handlers, file_id=reader['file_id'],
+                    offset=reader['offset'])
+            return
+
+        pending, reader['pending'] = reader['pending'], None
+        for ws_handler, line_filter, resume_from in pending:
+            self.add_subscribed_handler(
+                reader, ws_handler, line_filter, resume_from)
+
+    def on_glob_message(self, header, body):
+        """Handles a message from the tailer on a glob subscription.
+
+        """
+        subscription = self.globs.get(header['key'])
+        if subscription is None:
+            return
+
+        if header['type'] == 'error':
+            self.fail_subscription(self.globs, header)
+        elif header['type'] == 'subscribed':
+            pending, subscription['pending'] = subscription['pending'], []
+            for ws_handler, line_filter in pending:
+                subscription['filter_groups'].add(ws_handler, line_filter)
+                ws_handler.write_message(body)
+        else:
+            self.send_glob_batch(
+                header['key'], header['path'], body.split('\n'),
+                file_id=header['file_id'], offset=header['offset'])
+
+    def fail_subscription(self, subscriptions, header):
+        """Removes a subscription the tailer failed to make, sending the error
+        to its handlers.
+
+        Args:
+            subscriptions (dict): The readers or globs of the registry.
+            header (dict): The error message from the tailer.
+
+        """
+        subscription = subscriptions.pop(header['key'])
+        error = BroadcastMessage(
+            'An error occurred: {}'.format(header['message']),
+            message_type=MESSAGE_ERROR)
+        for ws_handler in subscription['handlers']:
+            ws_handler.write_message(error)
@@ -0,0 +1,280 @@
+"""
+UpstreamReaderRegistry definition, used by relays tailing the files through
+another tailsocket instance.
+
+"""
+
+import os
+import logging
+import collections
+
+from tornado import escape, gen, websocket
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest
+from tornado.ioloop import IOLoop
+
+from tailsocket import binary_protocol
+from tailsocket.glob_reader import is_glob
+from tailsocket.reader_registries.remote_reader_registry import (
+    RemoteReaderRegistry)
+
+logger = logging.getLogger('tornado.application')
+
+
+class UpstreamConnection():
+    """Websocket connection to the upstream instance subscribed to a file or
+    glob pattern, using the binary protocol.
+
+    The messages received are handed to the registry as the messages of the
+    tailer are, see `tailsocket.tailer`. If the connection is lost it is
+    made again, file subscriptions resuming from the offset of the last
+    lines received so none are sent twice.
+
+    Args:
+        registry (UpstreamReaderRegistry): The registry of the relay.
+        url (str): Websocket URL of the upstream instance.
+        key (str): Path or glob pattern of the subscription.
+        reconnect_delay (Optional[float]): Seconds to wait before the first
+            reconnection attempt, doubled after every failed attempt.
+        max_reconnect_delay (Optional[float]): Maximum seconds to wait.
+
+    """
+
+    def __init__(
+            self, registry, url, key, reconnect_delay=1,
+            max_reconnect_delay=30):
+        self.registry = registry
+        self.url = url
+        self.key = key
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connection = None
+        self.closed = False
+        self.subscribed = False
+        self.offset = None
+        self.status = ''
+        self.file_paths = {}
+        self.history_requests = collections.deque()
+        self._awaiting_reply = False
+
+    @gen.coroutine
+    def run(self):
+        """Connects to the upstream instance and handles its messages,
+        reconnecting whenever the connection is lost or the messages can't
+        be handled until closed.
+
+        """
+        delay = self.reconnect_delay
+        while not self.closed:
+            try:
+                self.connection = yield websocket.websocket_connect(
+                    HTTPRequest(self.url, headers={
+                        'Sec-WebSocket-Protocol':
+                            binary_protocol.SUBPROTOCOL}))
+            except Exception as e:
+                logger.warning('Could not connect to %s: %s', self.url, e)
+                yield gen.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            delay = self.reconnect_delay
+            if self.closed:
+                self.connection.close()
+                break
+
+            try:
+                self._awaiting_reply = True
+                self.connection.write_message(
+                    escape.json_encode(self.get_subscription()))
+                while True:
+                    data = yield self.connection.read_message()
+                    if data is None:
+                        break
+                    for message in binary_protocol.decode_messages(data):
+                        self.on_message(message)
+            except Exception:
+                # Nothing observes this coroutine, an error must not end the
+                # relay of the file silently
+                logger.exception(
+                    'Error relaying %s from %s', self.key, self.url)
+                self.connection.close()
+
+            self.connection = None
+            self.fail_history_requests()
+            if not self.closed:
+                logger.warning('Connection to %s for %s lost, reconnecting',
+                               self.url, self.key)
+                yield gen.sleep(delay)
+
+    def close(self):
+        """Closes the connection for good.
+
+        """
+        self.closed = True
+        if self.connection is not None:
+            self.connection.close()
+
+    def get_subscription(self):
+        """Returns the subscription request, resuming from the offset of the
+        last lines received if subscribed to a file before.
+
+        Subscriptions which received no lines yet start again from the end of
+        the file, resuming from its start could replay the whole file.
+
+        """
+        request = {'type': 'subscribe', 'filename': self.key}
+        if self.offset is not None and not is_glob(self.key):
+            request['resume_from'] = self.offset
+        return request
+
+    def request_history(self, n, before=None, skip=0):
+        """Requests a page of the history of the file.
+
+        Returns:
+            Future: Resolved with the page.
+
+        """
+        if self.connection is None:
+            raise ValueError('Not connected to {}'.format(self.url))
+
+        future = Future()
+        self.history_requests.append(future)
+        self.connection.write_message(escape.json_encode({
+            'type': 'history', 'lines': n, 'before': before, 'skip': skip}))
+        return future
+
+    def fail_history_requests(self):
+        """Fails the history requests waiting for a reply.
+
+        """
+        while self.history_requests:
+            self.history_requests.popleft().set_exception(
+                ValueError('Connection to {} lost'.format(self.url)))
+
+    def on_message(self, message):
+        """Handles a message of the binary protocol.
+
+        The first message after subscribing is the reply to the subscription,
+        status replies to resumed subscriptions are dropped.
+
+        Args:
+            message (binary_protocol.Message): The decoded message.
+
+        """
+        text = message.payload.decode('utf-8')
+        is_reply, self._awaiting_reply = self._awaiting_reply, False
+        if message.type == binary_protocol.MESSAGE_FILE:
+            self._awaiting_reply = is_reply
+            self.file_paths[message.file_id] = text
+        elif message.type == binary_protocol.MESSAGE_JSON:
+            self._awaiting_reply = is_reply
+            reply = escape.json_decode(text)
+            if reply.get('type') == 'history' and self.history_requests:
+                self.history_requests.popleft().set_result(reply)
+        elif message.type == binary_protocol.MESSAGE_ERROR:
+            if is_reply and not self.subscribed:
+                self.registry.on_tailer_message(
+                    {'type': 'error', 'key': self.key, 'message': text}, '')
+            elif self.history_requests:
+                self.history_requests.popleft().set_exception(
+                    ValueError(text))
+        elif message.type == binary_protocol.MESSAGE_STATUS:
+            if is_reply:
+                self.status = text
+                if not self.subscribed:
+                    self.subscribed = True
+                    self.registry.on_tailer_message(
+                        {'type': 'subscribed', 'key': self.key,
+                         'status': True}, text)
+        elif message.type == binary_protocol.MESSAGE_LINES:
+            header = {
+                'type': 'lines' if self.subscribed else 'subscribed',
+                'key': self.key,
+                'file_id': message.file_id,
+                'path': self.file_paths.get(message.file_id, ''),
+                'offset': message.offset,
+            }
+            self.subscribed = True
+            self.offset = message.offset
+            self.registry.on_tailer_message(header, text)
+
+
+class UpstreamReaderRegistry(RemoteReaderRegistry):
+    """Registry of a relay, which reads no file itself but subscribes to them
+    on an upstream tailsocket instance over its websocket endpoint.
+
+    The relay opens one connection per file or glob pattern tailed by its
+    clients, however many they are, and distributes the lines it receives
+    to them like worker processes do with the lines of the tailer.
+
+    Args:
+        url (str): Base websocket URL of the upstream instance, e.g.
+            ``ws://origin:8888``.
+        *args: The arguments of `ReaderRegistry`.
+        **kwargs: The keyword arguments of `ReaderRegistry`.
+
+    """
+
+    upstream_reconnect_delay = 1
+    upstream_max_reconnect_delay = 30
+
+    def __init__(self, url, *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self.url = '{}/websocket/relay'.format(url.rstrip('/'))
+        self.upstreams = {}
+
+    def connect(self):
+        """Connections are made for each subscription, nothing to do.
+
+        """
+
+    def send_request(self, request):
+        """Opens or closes the connection of a subscription, or replies to a
+        status request with the last status sent by the upstream instance.
+
+        """
+        key = request['key']
+        if request['type'] == 'subscribe':
+            upstream = UpstreamConnection(
+                self, self.url, key,
+                reconnect_delay=self.upstream_reconnect_delay,
+                max_reconnect_delay=self.upstream_max_reconnect_delay)
+            self.upstreams[key] = upstream
+            upstream.run()
+        elif request['type'] == 'unsubscribe':
+            upstream = self.upstreams.pop(key, None)
+            if upstream is not None:
+                upstream.close()
+        elif request['type'] == 'status':
+            IOLoop.current().add_callback(
+                self.on_tailer_message,
+                {'type': 'subscribed', 'key': key, 'status': True},
+                self.upstreams[key].status)
+
+    def fail_subscription(self, subscriptions, header):
+        """Closes the connection of a subscription the upstream instance
+        failed to make, sending the error to its handlers.
+
+        """
+        upstream = self.upstreams.pop(header['key'], None)
+        if upstream is not None:
+            upstream.close()
+        super().fail_subscription(subscriptions, header)
+
+    def read_history(self, filename, n, before=None, skip=0):
+        """Requests a page of the history of a file to the upstream instance,
+        see `ReaderRegistry.read_history`.
+
+        Returns:
+            Future: Resolved with the page.
+
+        Raises:
+            ValueError: If the file is not relayed.
+
+        """
+        filename = os.path.abspath(filename)
+        upstream = self.upstreams.get(filename)
+        if upstream is None:
+            raise ValueError('{} is not relayed from {}'.format(
+                filename, self.url))
+        return upstream.request_history(n, before=before, skip=skip)
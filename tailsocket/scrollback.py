@@ -0,0 +1,114 @@
+"""
+In-memory scrollback of the most recent lines sent for a file.
+
+"""
+
+import collections
+
+
+class ScrollbackBuffer():
+    """Ring buffer of the most recent messages sent for a file, bounded both
+    in number of lines and total size.
+
+    Messages are kept as sent along with their number of lines so adding
+    them is cheap, only the messages needed to serve a request are split.
+    The position in the file of the end of each message may be kept too,
+    to serve the lines following a position to clients resuming a tail.
+
+    Args:
+        max_lines (Optional[int]): Maximum number of lines to keep.
+        max_bytes (Optional[int]): Maximum size of the lines to keep,
+            measured on the decoded text.
+
+    """
+
+    def __init__(self, max_lines=1000, max_bytes=1024 * 1024):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.lines = 0
+        self.size = 0
+        self.evicted_offset = None
+        self._messages = collections.deque()
+
+    def __len__(self):
+        return self.lines
+
+    def append(self, message, offset=None):
+        """Adds a message evicting the oldest ones if over the bounds.
+
+        Args:
+            message (str): The message, possibly spanning several lines.
+            offset (Optional[int]): Position in the file of the end of the
+                message.
+
+        """
+        line_count = message.count('\n') + 1
+        self._messages.append((message, line_count, offset))
+        self.lines += line_count
+        self.size += len(message) + 1
+        while self._messages and (
+                self.lines > self.max_lines or self.size > self.max_bytes):
+            evicted, evicted_count, evicted_offset = self._messages.popleft()
+            self.lines -= evicted_count
+            self.size -= len(evicted) + 1
+            self.evicted_offset = evicted_offset
+
+    def get_last_lines(self, n):
+        """Returns up to the last n lines kept.
+
+        Args:
+            n (int): Number of lines to return.
+
+        Returns:
+            list: The lines, oldest first.
+
+        """
+        chunks = []
+        needed = n
+        for message, line_count, _ in reversed(self._messages):
+            if needed <= 0:
+                break
+            if line_count == 1:
+                chunks.append([message])
+            else:
+                chunks.append(message.split('\n')[-needed:])
+            needed -= line_count
+
+        return [line for chunk in reversed(chunks) for line in chunk]
+
+    def get_lines_after(self, offset):
+        """Returns the lines of the messages ending after a position of the
+        file.
+
+        Args:
+            offset (int): The position, usually the end of the last message
+                received by a client resuming a tail.
+
+        Returns:
+            list: The lines, oldest first, or None if the scrollback doesn't
+                reach back to the position.
+
+        """
+        messages = []
+        for message, _, end in reversed(self._messages):
+            if end is None:
+                return None
+            if end <= offset:
+                break
+            messages.append(message)
+        else:
+            if self.evicted_offset is None or self.evicted_offset > offset:
+                return None
+
+        return [
+            line for message in reversed(messages)
+            for line in message.split('\n')]
+
+    def clear(self):
+        """Discards all the lines kept.
+
+        """
+        self._messages.clear()
+        self.lines = 0
+        self.size = 0
+        self.evicted_offset = None
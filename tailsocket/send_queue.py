@@ -0,0 +1,228 @@
+"""
+Bounded outgoing queues for slow websocket connections.
+
+"""
+
+import logging
+import collections
+
+from tornado.ioloop import IOLoop
+
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.log import RateLimitedLog
+
+logger = logging.getLogger('tornado.application')
+
+# Overflows happen in bursts when the server is overloaded, logging every
+# drop would only add to the load
+overflow_log = RateLimitedLog(logger, logging.WARNING)
+
+DROP_OLDEST = 'drop_oldest'
+SKIP_MARKER = 'skip_marker'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, SKIP_MARKER, DISCONNECT)
+
+SKIPPED_LINES_MARKER = '<< {} lines skipped >>'
+
+# Seconds between the checks for connections drained without resolving the
+# future of the last write of the queue
+DRAIN_CHECK_INTERVAL = 0.05
+
+
+def get_message_size(message):
+    """Returns the size of a message, using the encoded payload of broadcast
+    messages when available to avoid encoding it.
+
+    """
+    if isinstance(message, BroadcastMessage):
+        return len(message.payload)
+    return len(message)
+
+
+def count_lines(message):
+    """Returns the number of lines of a text message, to be counted before
+    the message is wrapped, e.g. in the JSON of a channel.
+
+    """
+    if isinstance(message, dict):
+        return 0
+    return message.count(b'\n' if isinstance(message, bytes) else '\n') + 1
+
+
+class SendQueue():
+    """Queue of the messages waiting to be written to a connection.
+
+    Messages are written straight away while the connection keeps up, once a
+    write is pending any further messages are queued and written together
+    when the connection drains, which is checked every `DRAIN_CHECK_INTERVAL`
+    too as the future of the pending write may never be resolved. The queue
+    is bounded to `max_bytes`, on overflow the policy decides what to do:
+
+    - `drop_oldest`: discard the oldest queued messages.
+    - `skip_marker`: discard the oldest queued messages and write a marker
+        with the number of lines skipped once the connection drains, one
+        per channel of the skipped messages on multiplexed connections.
+    - `disconnect`: discard the queue and close the connection.
+
+    A single message bigger than `max_bytes` is always accepted into an empty
+    queue.
+
+    Args:
+        write (callable): Called with a message and a binary flag to write it
+            to the connection, returns a Future resolved when the connection
+            drains or None if written synchronously.
+        writing (callable): Returns True if the connection has data waiting
+            to be flushed.
+        close (callable): Called to disconnect the connection.
+        max_bytes (Optional[int]): Maximum size of the queued messages.
+        policy (Optional[str]): Overflow policy, one of `POLICIES`.
+        format_marker (Optional[callable]): Called with the channel id, None
+            for messages of no channel, and the number of lines skipped to
+            format the skip marker.
+
+    """
+
+    def __init__(
+            self, write, writing, close, max_bytes=1024 * 1024,
+            policy=SKIP_MARKER, format_marker=None):
+        if policy not in POLICIES:
+            raise ValueError('Unknown slow consumer policy {}'.format(policy))
+
+        self.write = write
+        self.writing = writing
+        self.close = close
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.format_marker = format_marker or (
+            lambda channel, lines: SKIPPED_LINES_MARKER.format(lines))
+        self.queued_bytes = 0
+        self.dropped_messages = 0
+        self.skipped_lines = 0
+        self._skipped_by_channel = collections.OrderedDict()
+        self._messages = collections.deque()
+        self._pending_write = None
+        self._drain_check = None
+
+    def __len__(self):
+        return len(self._messages)
+
+    def get_stats(self):
+        """Returns the depth of the queue and the overflow counters.
+
+        """
+        return {
+            'queued_messages': len(self._messages),
+            'queued_bytes': self.queued_bytes,
+            'dropped_messages': self.dropped_messages,
+            'skipped_lines': self.skipped_lines,
+        }
+
+    def put(self, message, binary=False, lines=None, channel=None):
+        """Writes the message if the connection is idle or queues it
+        applying the overflow policy otherwise.
+
+        Args:
+            message (str or bytes): The message to write.
+            binary (Optional[bool]): Whether to send the message as binary.
+            lines (Optional[int]): Number of lines of the message, counted
+                by `count_lines` if not given.
+            channel (Optional[str or int]): Id of the channel the message
+                belongs to, if any.
+
+        """
+        if not self._is_busy():
+            self._write(message, binary)
+            return
+
+        size = get_message_size(message)
+        if self.queued_bytes + size > self.max_bytes and self._messages:
+            if self.policy == DISCONNECT:
+                logger.warning(
+                    'Send queue overflow, closing connection with %d queued '
+                    'bytes', self.queued_bytes)
+                self.clear()
+                self.close()
+                return
+
+            self._drop_until_fits(size)
+
+        if lines is None:
+            lines = count_lines(message)
+        self._messages.append((message, binary, size, lines, channel))
+        self.queued_bytes += size
+        self._schedule_drain_check()
+
+    def clear(self):
+        """Discards all queued messages.
+
+        """
+        self._messages.clear()
+        self.queued_bytes = 0
+        self._pending_write = None
+        if self._drain_check is not None:
+            IOLoop.current().remove_timeout(self._drain_check)
+            self._drain_check = None
+
+    def flush(self):
+        """Writes all the queued messages, preceded by the skipped lines
+        markers if any lines were dropped.
+
+        """
+        self._pending_write = None
+        if self.policy == SKIP_MARKER and self.skipped_lines:
+            for channel, lines in self._skipped_by_channel.items():
+                self._write(self.format_marker(channel, lines))
+            self._skipped_by_channel.clear()
+            self.skipped_lines = 0
+
+        while self._messages:
+            message, binary, size, _, _ = self._messages.popleft()
+            self.queued_bytes -= size
+            self._write(message, binary)
+
+    def _is_busy(self):
+        if self._pending_write is None:
+            return False
+
+        if self._pending_write.done() or not self.writing():
+            # The connection drained without resolving our future, e.g. if
+            # some other frame was written after ours
+            self.flush()
+            return self._pending_write is not None
+
+        return True
+
+    def _schedule_drain_check(self):
+        # Tornado replaces the write future of the stream on every write, so
+        # ours is never resolved if another frame, e.g. a pong, is written
+        # after it, check for the connection draining while messages wait
+        if self._drain_check is None:
+            self._drain_check = IOLoop.current().call_later(
+                DRAIN_CHECK_INTERVAL, self._check_drained)
+
+    def _check_drained(self):
+        self._drain_check = None
+        if self._messages and self._is_busy():
+            self._schedule_drain_check()
+
+    def _write(self, message, binary=False):
+        future = self.write(message, binary)
+        if future is not None and not future.done():
+            self._pending_write = future
+            future.add_done_callback(self._on_write_done)
+
+    def _on_write_done(self, future):
+        if future is self._pending_write:
+            self.flush()
+
+    def _drop_until_fits(self, size):
+        while self._messages and self.queued_bytes + size > self.max_bytes:
+            _, _, message_size, lines, channel = self._messages.popleft()
+            self.queued_bytes -= message_size
+            self.dropped_messages += 1
+            if self.policy == SKIP_MARKER and lines:
+                self.skipped_lines += lines
+                self._skipped_by_channel[channel] = (
+                    self._skipped_by_channel.get(channel, 0) + lines)
+
+        overflow_log.log('Send queue overflow, dropped queued messages')
@@ -0,0 +1,340 @@
+"""
+Tailer process serving the lines of the files to the worker processes
+accepting the websocket connections.
+
+The tailer is the only process reading the files, workers subscribe to
+them over a Unix socket once regardless of how many of their connections
+tail them. Messages in both directions are frames made of a JSON header
+and a text body::
+
+    header length   uint32
+    body length     uint32
+    header          JSON object, its `type` telling the kind of message
+    body            UTF-8 lines or status text, possibly empty
+
+Workers send ``subscribe``, ``unsubscribe`` and ``status`` requests for a
+file or glob pattern given as `key`, and ``history`` requests with an `id`.
+The tailer replies to subscriptions and status requests with a
+``subscribed`` message carrying the initial lines or the status text,
+forwards every new batch of lines as a ``lines`` message, with the
+`file_id`, `path` and `offset` of the file, and replies to history requests
+with a ``history`` message holding the `page` under the same `id`. Failed
+requests are replied to with an ``error`` message.
+
+Workers falling behind have the ``lines`` messages exceeding
+`max_pending_bytes` dropped, and are sent a ``skipped`` message with the
+number of `lines` dropped for each key once they catch up.
+
+"""
+
+import struct
+import logging
+import collections
+from functools import partial
+
+from tornado import gen
+from tornado.concurrent import is_future
+from tornado.escape import json_decode, json_encode
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpserver import TCPServer
+
+from tailsocket.binary_protocol import MESSAGE_LINES
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.glob_reader import is_glob
+from tailsocket.log import RateLimitedLog
+
+logger = logging.getLogger('tornado.application')
+
+FRAME = struct.Struct('!II')
+
+# Bytes waiting to be written to a worker beyond which lines are dropped
+MAX_PENDING_BYTES = 16 * 1024 * 1024
+
+overflow_log = RateLimitedLog(logger, logging.WARNING)
+
+
+def encode_frame(header, body=b''):
+    """Encodes a message between the tailer and a worker.
+
+    Args:
+        header (dict): The header of the message.
+        body (Optional[bytes]): The UTF-8 encoded body of the message.
+
+    Returns:
+        bytes: The encoded frame.
+
+    """
+    header = json_encode(header).encode()
+    return FRAME.pack(len(header), len(body)) + header + body
+
+
+@gen.coroutine
+def read_frame(stream):
+    """Reads a message between the tailer and a worker from a stream.
+
+    Args:
+        stream (IOStream): The stream to read from.
+
+    Returns:
+        tuple: The header dict and the body text of the message.
+
+    Raises:
+        StreamClosedError: If the stream is closed.
+
+    """
+    data = yield stream.read_bytes(FRAME.size)
+    header_length, body_length = FRAME.unpack(data)
+    data = yield stream.read_bytes(header_length + body_length)
+    return (
+        json_decode(data[:header_length]),
+        data[header_length:].decode('utf-8'))
+
+
+class TailerChannel():
+    """The subscription of a worker to a file or glob pattern.
+
+    Channels are registered in the registry of the tailer in place of the
+    websocket handlers of the worker, forwarding the messages they receive
+    to it. The first message is the one the registry writes to new
+    handlers, sent as the reply to the subscription.
+
+    Args:
+        connection (TailerConnection): The connection of the worker.
+        key (str): Path or glob pattern of the subscription.
+
+    """
+
+    def __init__(self, connection, key):
+        self.connection = connection
+        self.key = key
+        self.subscribed = False
+
+    def __repr__(self):
+        return '<TailerChannel {}>'.format(self.key)
+
+    def write_message(self, message, binary=False):
+        """Forwards a message of the registry to the worker.
+
+        """
+        header = {
+            'type': 'subscribed' if not self.subscribed else 'lines',
+            'key': self.key,
+        }
+        self.subscribed = True
+        if (isinstance(message, BroadcastMessage) and
+                message.message_type == MESSAGE_LINES):
+            header['file_id'] = message.file_id
+            header['path'] = self.connection.registry.file_paths.get(
+                message.file_id, '')
+            header['offset'] = message.offset
+            body = message.body_payload
+        else:
+            header['status'] = True
+            body = str(message).encode()
+        self.connection.send(header, body)
+
+
+class TailerConnection():
+    """The connection of a worker process to the tailer.
+
+    The data waiting to be written to the worker is bounded like the send
+    queues of the websocket connections: while more than
+    `max_pending_bytes` are pending, new lines are dropped and counted per
+    key, the worker being sent a ``skipped`` message for each key before
+    the next lines once it catches up. Other messages are never dropped.
+
+    Args:
+        registry (ReaderRegistry): The registry reading the files.
+        stream (IOStream): The stream connected to the worker.
+        max_pending_bytes (Optional[int]): Bytes waiting to be written
+            beyond which lines are dropped.
+
+    """
+
+    def __init__(self, registry, stream, max_pending_bytes=MAX_PENDING_BYTES):
+        self.registry = registry
+        self.stream = stream
+        self.max_pending_bytes = max_pending_bytes
+        self.channels = {}
+        self.skipped_lines = collections.OrderedDict()
+
+    @gen.coroutine
+    def run(self):
+        """Handles the requests of the worker until it disconnects, then
+        removes its subscriptions.
+
+        """
+        try:
+            while True:
+                request, _ = yield read_frame(self.stream)
+                self.on_request(request)
+        except StreamClosedError:
+            logger.info('Worker disconnected from the tailer')
+
+        for key in list(self.channels):
+            self.unsubscribe(key)
+
+    def on_request(self, request):
+        """Handles a request of the worker, replying with an error message if
+        it fails.
+
+        Args:
+            request (dict): The decoded request.
+
+        """
+        try:
+            if request['type'] == 'subscribe':
+                self.subscribe(request['key'])
+            elif request['type'] == 'unsubscribe':
+                self.unsubscribe(request['key'])
+            elif request['type'] == 'status':
+                self.send(
+                    {'type': 'subscribed', 'key': request['key'],
+                     'status': True},
+                    self.registry.get_glob_status(request['key']).encode())
+            elif request['type'] == 'history':
+                self.on_history_request(request)
+            else:
+                raise ValueError('Unknown request {}'.format(request['type']))
+        except Exception as e:
+            logger.exception(e)
+            reply = {'type': 'error', 'key': request.get('key'),
+                     'message': str(e)}
+            if 'id' in request:
+                reply['id'] = request['id']
+            self.send(reply)
+
+    def subscribe(self, key):
+        """Registers a channel of the worker for a file or glob pattern.
+
+        """
+        if key in self.channels:
+            return
+
+        channel = TailerChannel(self, key)
+        if is_glob(key):
+            self.registry.add_handler_to_glob(channel, key)
+        else:
+            self.registry.add_handler_to_filename(channel, key)
+        self.channels[key] = channel
+
+    def unsubscribe(self, key):
+        """Removes the channel of the worker for a file or glob pattern.
+
+        """
+        channel = self.channels.pop(key, None)
+        if channel is None:
+            return
+
+        if is_glob(key):
+            self.registry.remove_handler_from_glob(channel, key)
+        else:
+            self.registry.remove_handler_from_filename(channel, key)
+
+    def on_history_request(self, request):
+        """Replies with a page of the history of a file, see
+        `ReaderRegistry.read_history`.
+
+        """
+        page = self.registry.read_history(
+            request['key'], request['lines'], before=request.get('before'),
+            skip=request.get('skip', 0))
+        if is_future(page):
+            IOLoop.current().add_future(
+                page, partial(self.send_history_page, request))
+        else:
+            self.send_history_page(request, page)
+
+    def send_history_page(self, request, page):
+        """Replies to a history request with the page, or an error message
+        if reading it failed.
+
+        Args:
+            request (dict): The decoded request.
+            page (dict or Future): The page, or a future resolving to it for
+                pages read from archives.
+
+        """
+        if is_future(page):
+            try:
+                page = page.result()
+            except Exception as e:
+                logger.exception(e)
+                self.send({'type': 'error', 'key': request['key'],
+                           'id': request['id'], 'message': str(e)})
+                return
+
+        self.send({'type': 'history', 'id': request['id'], 'page': page})
+
+    def get_pending_bytes(self):
+        """Returns the number of bytes waiting to be written to the worker.
+
+        """
+        return getattr(self.stream, '_write_buffer_size', 0)
+
+    def send(self, header, body=b''):
+        """Sends a message to the worker unless it disconnected, dropping
+        lines while it falls behind.
+
+        """
+        if self.stream.closed():
+            return
+
+        if header['type'] == 'lines':
+            if self.get_pending_bytes() > self.max_pending_bytes:
+                key = header['key']
+                self.skipped_lines[key] = (
+                    self.skipped_lines.get(key, 0) + body.count(b'\n') + 1)
+                overflow_log.log('Worker falling behind, dropped lines')
+                return
+            self.send_skipped_lines()
+
+        self.write(encode_frame(header, body))
+
+    def send_skipped_lines(self):
+        """Tells the worker how many lines of each key were dropped.
+
+        """
+        skipped, self.skipped_lines = (
+            self.skipped_lines, collections.OrderedDict())
+        for key, lines in skipped.items():
+            self.write(encode_frame(
+                {'type': 'skipped', 'key': key, 'lines': lines}))
+
+    def write(self, frame):
+        try:
+            self.stream.write(frame)
+        except StreamClosedError:
+            pass
+
+
+class TailerServer(TCPServer):
+    """Accepts the connections of the worker processes, usually on a Unix
+    socket, serving them the lines read by a registry.
+
+    Args:
+        registry (ReaderRegistry): The registry reading the files.
+        max_pending_bytes (Optional[int]): Bytes waiting to be written to a
+            worker beyond which lines are dropped, see `TailerConnection`.
+        **kwargs: The arguments of `TCPServer`.
+
+    """
+
+    def __init__(self, registry, max_pending_bytes=MAX_PENDING_BYTES,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.registry = registry
+        self.max_pending_bytes = max_pending_bytes
+        self.connections = set()
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        logger.info('Worker connected to the tailer')
+        connection = TailerConnection(
+            self.registry, stream, max_pending_bytes=self.max_pending_bytes)
+        self.connections.add(connection)
+        try:
+            yield connection.run()
+        finally:
+            self.connections.discard(connection)
@@ -9,12 +9,16 @@ import asyncio
 import selectors
 from unittest import mock
 
+import pytest
 import tornado
+import tornado.concurrent
+import tornado.httpclient
+from tornado import escape
 from tornado.testing import AsyncHTTPTestCase
 from tornado.ioloop import IOLoop
 from tornado.options import options
 
-from tailsocket import application, log
+from tailsocket import application, binary_protocol, broadcast, log
 from tests import conftest
 
 
@@ -52,9 +56,42 @@ class ApplicationTests(AsyncHTTPTestCase):
         response = self.fetch('/')
         assert response.code == 200
         assert response.body is not None
+        # Write the records queued for the log files
+        log.stop_logging()
         assert os.stat(
             tornado.options.options.access_log_file_path).st_size > 0
 
+    def test_unknown_compressions_are_rejected_on_startup(self):
+        self.addCleanup(setattr, options, 'compression', options.compression)
+        with pytest.raises(tornado.options.Error):
+            options.parse_command_line(['tailsocket', '--compression=gzip'])
+
+        options.parse_command_line(['tailsocket', '--compression=none'])
+        assert options.compression == application.COMPRESSION_NONE
+
+    @tornado.testing.gen_test
+    def test_metrics_describe_the_files_and_connections(self):
+        conftest._create_log_file()
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(conftest.DEFAULT_FILENAME)
+        yield ws_client.read_message()
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line', file=fd)
+        yield ws_client.read_message()
+
+        response = yield self.http_client.fetch(self.get_url('/metrics'))
+        body = response.body.decode()
+        filename = os.path.abspath(conftest.DEFAULT_FILENAME)
+        assert 'tailsocket_files_watched 1' in body
+        assert 'tailsocket_connections 1' in body
+        assert 'tailsocket_file_subscribers{{file="{}"}} 1'.format(
+            filename) in body
+        assert 'tailsocket_read_lines_total{{file="{}"}}'.format(
+            filename) in body
+        assert 'tailsocket_read_to_send_seconds_count' in body
+
     @tornado.testing.gen_test
     def test_websocket_returns_contents_of_existing_file(self):
         conftest._create_log_file(write_initial_content=True)
@@ -128,3 +165,325 @@ class ApplicationTests(AsyncHTTPTestCase):
         ws_client.write_message(conftest.DEFAULT_FILENAME)
         ws_client.close()
         assert len(self._app.registry.readers) == 0
+
+    @tornado.testing.gen_test
+    def test_websocket_broadcasts_new_lines_to_every_client(self):
+        conftest._create_log_file()
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_clients = []
+        for i in range(3):
+            ws_client = yield tornado.websocket.websocket_connect(ws_url)
+            ws_client.write_message(conftest.DEFAULT_FILENAME)
+            ws_clients.append(ws_client)
+
+        for ws_client in ws_clients:
+            response = yield ws_client.read_message()
+            assert 'empty' in response.lower()
+
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line', file=fd)
+
+        for ws_client in ws_clients:
+            response = yield ws_client.read_message()
+            assert response == 'Test log line'
+
+    @tornado.testing.gen_test
+    def test_websocket_returns_pages_of_history(self):
+        lines = ['Line {}'.format(i) for i in range(100)]
+        conftest._create_log_file(
+            write_initial_content=True, initial_content='\n'.join(lines))
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(conftest.DEFAULT_FILENAME)
+        yield ws_client.read_message()
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'history', 'lines': 20, 'skip': 10}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response['type'] == 'history'
+        assert response['lines'] == lines[70:90]
+        assert response['has_more']
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'history', 'lines': 100, 'before': response['cursor']}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response['lines'] == lines[:70]
+        assert not response['has_more']
+
+    @tornado.testing.gen_test
+    def test_websocket_subscriptions_with_filters(self):
+        conftest._create_log_file(
+            write_initial_content=True,
+            initial_content='INFO Starting\nERROR Failed\nINFO Retrying')
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(escape.json_encode({
+            'type': 'subscribe', 'filename': conftest.DEFAULT_FILENAME,
+            'exclude': ['INFO']}))
+
+        response = yield ws_client.read_message()
+        assert response == 'ERROR Failed'
+
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('INFO Retrying\nERROR Failed again', file=fd)
+
+        response = yield ws_client.read_message()
+        assert response == 'ERROR Failed again'
+
+    @tornado.testing.gen_test
+    def test_websocket_multiplexes_channels(self):
+        conftest._create_log_file(write_initial_content=True)
+        conftest._create_log_file('test.other.log')
+        self.addCleanup(os.remove, 'test.other.log')
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        for channel, filename in enumerate(
+                [conftest.DEFAULT_FILENAME, 'test.other.log']):
+            ws_client.write_message(escape.json_encode({
+                'type': 'subscribe', 'channel': channel,
+                'filename': filename}))
+
+        responses = []
+        for _ in range(2):
+            response = yield ws_client.read_message()
+            responses.append(escape.json_decode(response))
+        assert responses == [
+            {'channel': 0, 'data': conftest.DEFAULT_TEXT},
+            {'channel': 1, 'data': '<< File is empty, tail started >>'},
+        ]
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'unsubscribe', 'channel': 0}))
+        yield tornado.gen.sleep(0.01)
+        for filename in (conftest.DEFAULT_FILENAME, 'test.other.log'):
+            with open(filename, 'a') as fd:
+                print('New line in {}'.format(filename), file=fd)
+
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response == {'channel': 1, 'data': 'New line in test.other.log'}
+        assert list(self._app.registry.readers) == [
+            os.path.abspath('test.other.log')]
+
+    @tornado.testing.gen_test
+    def test_websocket_channels_share_a_registration_per_file(self):
+        conftest._create_log_file()
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        for channel, include in enumerate([['ERROR'], ['INFO'], []]):
+            ws_client.write_message(escape.json_encode({
+                'type': 'subscribe', 'channel': channel,
+                'filename': conftest.DEFAULT_FILENAME, 'include': include}))
+            response = yield ws_client.read_message()
+            assert escape.json_decode(response)['channel'] == channel
+        yield tornado.gen.sleep(0.01)
+
+        filename = os.path.abspath(conftest.DEFAULT_FILENAME)
+        handlers = self._app.registry.readers[filename]['handlers']
+        assert len(handlers) == 1
+
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('ERROR 1\nINFO 2', file=fd)
+
+        responses = []
+        for _ in range(3):
+            response = yield ws_client.read_message()
+            responses.append(escape.json_decode(response))
+        assert sorted(responses, key=lambda r: r['channel']) == [
+            {'channel': 0, 'data': 'ERROR 1'},
+            {'channel': 1, 'data': 'INFO 2'},
+            {'channel': 2, 'data': 'ERROR 1\nINFO 2'},
+        ]
+
+        for channel in range(3):
+            ws_client.write_message(escape.json_encode(
+                {'type': 'unsubscribe', 'channel': channel}))
+        yield tornado.gen.sleep(0.1)
+        assert not self._app.registry.readers
+
+    @tornado.testing.gen_test
+    def test_websocket_tags_channel_errors_with_their_channel(self):
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(escape.json_encode({
+            'type': 'subscribe', 'channel': 'missing',
+            'filename': 'missing.log'}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response['channel'] == 'missing'
+        assert response['data'].startswith('An error occurred')
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'history', 'channel': 'unknown'}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response['channel'] == 'unknown'
+        assert response['data'].startswith('An error occurred')
+
+        conftest._create_log_file(write_initial_content=True)
+        ws_client.write_message(escape.json_encode({
+            'type': 'subscribe', 'channel': 'app',
+            'filename': conftest.DEFAULT_FILENAME}))
+        yield ws_client.read_message()
+        page = tornado.concurrent.Future()
+        page.set_exception(OSError('Tailer gone'))
+        with mock.patch.object(
+                self._app.registry, 'read_history', return_value=page):
+            ws_client.write_message(escape.json_encode(
+                {'type': 'history', 'channel': 'app'}))
+            response = escape.json_decode((yield ws_client.read_message()))
+        assert response == {
+            'channel': 'app', 'data': 'An error occurred: Tailer gone'}
+
+    @tornado.testing.gen_test
+    def test_websocket_frames_messages_of_a_single_client_itself(self):
+        conftest._create_log_file()
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(conftest.DEFAULT_FILENAME)
+        yield ws_client.read_message()
+
+        connection = next(iter(self._app.connections))
+        with mock.patch.object(connection, 'write_prebuilt_frame') as write:
+            with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+                print('Test log line', file=fd)
+            assert (yield ws_client.read_message()) == 'Test log line'
+
+        assert not write.called
+
+    @tornado.testing.gen_test
+    def test_websocket_shares_compressed_frames_between_clients(self):
+        options.compression = application.COMPRESSION_SHARED
+        lines = ['Line {}'.format(i) for i in range(100)]
+        conftest._create_log_file(
+            write_initial_content=True, initial_content='\n'.join(lines))
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_clients = []
+        for i in range(3):
+            ws_client = yield tornado.websocket.websocket_connect(
+                ws_url, compression_options={})
+            ws_client.write_message(conftest.DEFAULT_FILENAME)
+            response = yield ws_client.read_message()
+            assert response == '\n'.join(lines[-10:])
+            ws_clients.append(ws_client)
+
+        new_lines = '\n'.join('New log line {}'.format(i) for i in range(50))
+        with mock.patch('tailsocket.broadcast.compress_payload',
+                        wraps=broadcast.compress_payload) as compress:
+            with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+                print(new_lines, file=fd)
+
+            for ws_client in ws_clients:
+                response = yield ws_client.read_message()
+                assert response == new_lines
+
+        assert compress.call_count == 1
+        for connection in self._app.connections:
+            assert connection.uses_shared_compression()
+            assert (connection.ws_connection._wire_bytes_out <
+                    connection.ws_connection._message_bytes_out / 2)
+
+        # Messages compressed by the connection itself follow shared ones
+        ws_clients[0].write_message(escape.json_encode(
+            {'type': 'history', 'lines': 5}))
+        response = escape.json_decode((yield ws_clients[0].read_message()))
+        assert response['lines'] == new_lines.split('\n')[-5:]
+
+    @tornado.testing.gen_test
+    def test_websocket_sends_binary_messages_if_requested(self):
+        conftest._create_log_file(write_initial_content=True)
+        request = tornado.httpclient.HTTPRequest(
+            "ws://localhost:{}/websocket/test_name".format(
+                self.get_http_port()),
+            headers={'Sec-WebSocket-Protocol': binary_protocol.SUBPROTOCOL})
+        ws_client = yield tornado.websocket.websocket_connect(request)
+        ws_client.write_message(conftest.DEFAULT_FILENAME)
+
+        messages = []
+        while len(messages) < 2:
+            response = yield ws_client.read_message()
+            messages.extend(binary_protocol.decode_messages(response))
+        file_message, lines_message = messages
+        assert file_message.type == binary_protocol.MESSAGE_FILE
+        assert file_message.payload == os.path.abspath(
+            conftest.DEFAULT_FILENAME).encode()
+        assert lines_message.type == binary_protocol.MESSAGE_LINES
+        assert lines_message.file_id == file_message.file_id
+        assert lines_message.payload == conftest.DEFAULT_TEXT.encode()
+        assert lines_message.offset == len(conftest.DEFAULT_TEXT) + 1
+
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line', file=fd)
+
+        response = yield ws_client.read_message()
+        message, = binary_protocol.decode_messages(response)
+        assert message.payload == b'Test log line'
+        assert message.offset == os.stat(conftest.DEFAULT_FILENAME).st_size
+
+        ws_client.write_message('missing.log')
+        response = yield ws_client.read_message()
+        message, = binary_protocol.decode_messages(response)
+        assert message.type == binary_protocol.MESSAGE_ERROR
+
+    @tornado.testing.gen_test
+    def test_websocket_tags_binary_messages_with_their_channel(self):
+        conftest._create_log_file(write_initial_content=True)
+        request = tornado.httpclient.HTTPRequest(
+            "ws://localhost:{}/websocket/test_name".format(
+                self.get_http_port()),
+            headers={'Sec-WebSocket-Protocol': binary_protocol.SUBPROTOCOL})
+        ws_client = yield tornado.websocket.websocket_connect(request)
+        for channel in ('a', 'b'):
+            ws_client.write_message(escape.json_encode({
+                'type': 'subscribe', 'channel': channel,
+                'filename': conftest.DEFAULT_FILENAME}))
+
+        messages = []
+        while len(messages) < 5:
+            response = yield ws_client.read_message()
+            messages.extend(binary_protocol.decode_messages(response))
+        file_message = messages.pop(0)
+        assert file_message.type == binary_protocol.MESSAGE_FILE
+        for channel, (channel_message, lines_message) in zip(
+                ('a', 'b'), zip(messages[::2], messages[1::2])):
+            assert channel_message.type == binary_protocol.MESSAGE_CHANNEL
+            assert escape.json_decode(channel_message.payload) == channel
+            assert lines_message.type == binary_protocol.MESSAGE_LINES
+            assert lines_message.file_id == file_message.file_id
+            assert lines_message.payload == conftest.DEFAULT_TEXT.encode()
+
+    @tornado.testing.gen_test
+    def test_websocket_connections_expose_their_send_queue_depth(self):
+        conftest._create_log_file(write_initial_content=True)
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(conftest.DEFAULT_FILENAME)
+        yield ws_client.read_message()
+
+        assert len(self._app.connections) == 1
+        connection = next(iter(self._app.connections))
+        assert connection.get_queue_stats()['queued_bytes'] == 0
+
+        ws_client.close()
+        yield tornado.gen.sleep(0.01)
+        assert len(self._app.connections) == 0
+
+    @tornado.testing.gen_test
+    def test_skip_markers_are_tagged_with_their_channel(self):
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        yield tornado.websocket.websocket_connect(ws_url)
+        yield tornado.gen.sleep(0.01)
+        connection = next(iter(self._app.connections))
+
+        assert connection.format_skipped_lines_marker(None, 8) == (
+            '<< 8 lines skipped >>')
+        assert escape.json_decode(
+            connection.format_skipped_lines_marker('app', 32)) == {
+                'channel': 'app', 'data': '<< 32 lines skipped >>'}
@@ -0,0 +1,188 @@
+"""
+Test suite for the reading of rotated archives.
+
+"""
+
+import os
+import gzip
+
+import pytest
+
+from tailsocket import archives
+
+LINES = ['Line {} {}'.format(i, 'x' * (i * 37 % 300)) for i in range(1000)]
+
+
+def write_archive(path, lines, members=1):
+    content = ''.join(line + '\n' for line in lines).encode()
+    if not path.endswith('.gz'):
+        with open(path, 'wb') as fd:
+            fd.write(content)
+        return
+
+    size = len(content) // members + 1
+    with open(path, 'wb') as fd:
+        for i in range(members):
+            fd.write(gzip.compress(content[i * size:(i + 1) * size]))
+
+
+@pytest.fixture
+def gzip_path(tmpdir):
+    path = str(tmpdir.join('app.log.2.gz'))
+    write_archive(path, LINES, members=3)
+    return path
+
+
+def test_cursors_carry_the_archive_id():
+    assert archives.parse_cursor(None) == (None, None)
+    assert archives.parse_cursor(1024) == (None, 1024)
+    assert archives.parse_cursor('1024') == (None, 1024)
+    assert archives.parse_cursor('12.34:512') == ('12.34', 512)
+    assert archives.normalize_cursor('12.34:512') == '12.34:512'
+    for cursor in ('a:1', '2:1', '12.34:a', '-1.2:1'):
+        with pytest.raises(ValueError):
+            archives.parse_cursor(cursor)
+
+
+def get_cursor(path, position):
+    return archives.format_cursor(
+        archives.get_archive_id(os.stat(path)), position)
+
+
+def test_find_archives_orders_them_by_generation(tmpdir):
+    for name in ('app.log', 'app.log.10.gz', 'app.log.2.gz', 'app.log.1',
+                 'app.log.old', 'other.log.1', 'app.log.3.bz2'):
+        tmpdir.join(name).write('')
+
+    assert archives.find_archives(str(tmpdir.join('app.log'))) == [
+        str(tmpdir.join(name))
+        for name in ('app.log.1', 'app.log.2.gz', 'app.log.10.gz')]
+
+
+@pytest.mark.parametrize('members', [1, 3])
+def test_gzip_index_reads_any_part_of_the_content(tmpdir, members):
+    path = str(tmpdir.join('app.log.1.gz'))
+    write_archive(path, LINES, members=members)
+    content = ''.join(line + '\n' for line in LINES).encode()
+
+    index = archives.GzipIndex(interval=16 * 1024)
+    with open(path, 'rb') as fd:
+        index.build(fd)
+        assert index.size == len(content)
+        assert len(index.checkpoints) > 5
+        for position in (0, 1000, 16 * 1024 - 1, 50000, len(content) - 10):
+            assert index.read(fd, 3000, position) == (
+                content[position:position + 3000])
+
+
+def test_gzip_index_decompresses_a_single_span_per_read(gzip_path):
+    index = archives.GzipIndex(interval=1024 * 1024)
+    with open(gzip_path, 'rb') as fd:
+        index.build(fd)
+        assert len(index.checkpoints) == 1
+        index.read(fd, 100, index.size - 100)
+
+        # Reads of the same span are served from the last one decompressed
+        fd.close()
+        assert index.read(fd, 100, index.size - 200)
+
+
+def test_archive_reader_caches_indexes_until_archives_change(gzip_path):
+    reader = archives.ArchiveReader(checkpoint_interval=16 * 1024)
+    with reader.open(gzip_path) as fd:
+        index = fd.index
+    with reader.open(gzip_path) as fd:
+        assert fd.index is index
+
+    write_archive(gzip_path, LINES[:10])
+    with reader.open(gzip_path) as fd:
+        assert fd.index is not index
+        assert fd.read() == ''.join(
+            line + '\n' for line in LINES[:10]).encode()
+
+
+def test_archive_reader_pages_through_generations(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    write_archive(path + '.1', LINES[600:])
+    write_archive(path + '.2.gz', LINES[:600], members=2)
+    reader = archives.ArchiveReader(
+        checkpoint_interval=16 * 1024, block_size=512)
+
+    page = reader.read_page(path, 100, newer_lines=['Newer'])
+    assert page['lines'] == LINES[-99:] + ['Newer']
+    assert page['has_more']
+
+    lines = page['lines']
+    while page['has_more']:
+        archive, before = archives.parse_cursor(page['cursor'])
+        page = reader.read_page(path, 130, archive=archive, before=before)
+        lines[:0] = page['lines']
+    assert lines == LINES + ['Newer']
+    assert page['cursor'] == get_cursor(path + '.2.gz', 0)
+
+
+def test_archive_reader_skips_lines_across_generations(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    write_archive(path + '.1', LINES[600:])
+    write_archive(path + '.2.gz', LINES[:600])
+    reader = archives.ArchiveReader(checkpoint_interval=16 * 1024)
+
+    page = reader.read_page(path, 10, skip=500)
+    assert page['lines'] == LINES[490:500]
+    assert page['cursor'].startswith(get_cursor(path + '.2.gz', ''))
+
+    future = reader.read_history(path, 10, skip=5000)
+    assert future.result() == {
+        'lines': [], 'cursor': get_cursor(path + '.2.gz', 0),
+        'has_more': False, 'line': None}
+
+
+def test_archive_cursors_survive_rotations(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    write_archive(path + '.1', LINES[500:])
+    write_archive(path + '.2.gz', LINES[:500])
+    reader = archives.ArchiveReader(checkpoint_interval=16 * 1024)
+    page = reader.read_page(path, 100)
+    assert page['lines'] == LINES[-100:]
+
+    # Rotated again, the archive being compressed as the second generation
+    stat = os.stat(path + '.1')
+    os.rename(path + '.2.gz', path + '.3.gz')
+    write_archive(path + '.2.gz', LINES[500:])
+    os.utime(path + '.2.gz', ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.remove(path + '.1')
+    write_archive(path + '.1', ['Newer line'])
+
+    archive, before = archives.parse_cursor(page['cursor'])
+    page = reader.read_page(path, 100, archive=archive, before=before)
+    assert page['lines'] == LINES[-200:-100]
+
+    os.remove(path + '.2.gz')
+    with pytest.raises(ValueError):
+        reader.read_page(path, 100, archive=archive, before=before)
+
+
+def test_count_lines_counts_a_last_line_without_newline(tmpdir):
+    path = str(tmpdir.join('app.log'))
+    with open(path, 'wb') as fd:
+        fd.write(b'a\nb\nc')
+    with open(path, 'rb') as fd:
+        assert archives.count_lines(fd, 5, block_size=2) == 3
+        assert archives.count_lines(fd, 4, block_size=2) == 2
+        assert archives.count_lines(fd, 0) == 0
+
+
+def test_gzip_index_checkpoints_highly_compressed_content(tmpdir):
+    path = str(tmpdir.join('app.log.1.gz'))
+    content = b'a' * 1000000 + b'\n' + b'b' * 1000000
+    with open(path, 'wb') as fd:
+        fd.write(gzip.compress(content))
+
+    index = archives.GzipIndex(interval=1000)
+    with open(path, 'rb') as fd:
+        index.build(fd)
+        assert index.size == len(content)
+        assert index.positions[:3] == [0, 1000, 2000]
+        for position in (0, 999000, 999995, len(content) - 1500):
+            assert index.read(fd, 2000, position) == (
+                content[position:position + 2000])
@@ -0,0 +1,85 @@
+"""
+Test suite for the backward reader.
+
+"""
+
+import os
+from unittest import mock
+
+import pytest
+
+from tailsocket.backward_reader import read_lines_before
+from tests import conftest
+
+LINES = ['Line {} {}'.format(i, 'x' * (i * 37 % 300)) for i in range(100)]
+
+
+@pytest.yield_fixture
+def log_file():
+    conftest._create_log_file(
+        write_initial_content=True, initial_content='\n'.join(LINES))
+    with open(conftest.DEFAULT_FILENAME, 'rb', buffering=0) as fd:
+        yield fd
+
+
+@pytest.fixture(params=[False, True], ids=['blocks', 'mmap'])
+def use_mmap(request):
+    return request.param
+
+
+def decode(lines):
+    return [line.decode() for line in lines]
+
+
+def test_read_lines_before_reads_the_last_lines(log_file, use_mmap):
+    lines, start = read_lines_before(
+        log_file, 10, block_size=64, use_mmap=use_mmap)
+    assert decode(lines) == LINES[-10:]
+    assert start > 0
+
+
+def test_read_lines_before_skips_offset_lines(log_file, use_mmap):
+    lines, start = read_lines_before(
+        log_file, 10, offset=5, block_size=64, use_mmap=use_mmap)
+    assert decode(lines) == LINES[-15:-5]
+
+
+def test_read_lines_before_a_position(log_file, use_mmap):
+    _, end = read_lines_before(log_file, 20, use_mmap=use_mmap)
+    lines, start = read_lines_before(
+        log_file, 10, end=end, block_size=64, use_mmap=use_mmap)
+    assert decode(lines) == LINES[-30:-20]
+
+
+def test_read_lines_before_returns_all_lines_of_short_files(
+        log_file, use_mmap):
+    lines, start = read_lines_before(log_file, 1000, use_mmap=use_mmap)
+    assert decode(lines) == LINES
+    assert start == 0
+
+
+def test_read_lines_before_handles_files_without_trailing_newline(
+        use_mmap):
+    with open(conftest.DEFAULT_FILENAME, 'w') as fd:
+        fd.write('First\nSecond\nThird')
+
+    with open(conftest.DEFAULT_FILENAME, 'rb') as fd:
+        lines, start = read_lines_before(fd, 2, use_mmap=use_mmap)
+
+    assert lines == [b'Second', b'Third']
+
+
+def test_read_lines_before_on_empty_files(create_log_file, use_mmap):
+    with open(conftest.DEFAULT_FILENAME, 'rb') as fd:
+        assert read_lines_before(fd, 10, use_mmap=use_mmap) == ([], 0)
+
+
+def test_read_lines_before_only_reads_the_blocks_it_needs(log_file):
+    with mock.patch('os.pread', wraps=os.pread) as pread:
+        lines, start = read_lines_before(log_file, 3, block_size=64)
+
+    # Each returned byte is scanned once and read once, plus the slack of
+    # the last block scanned and the byte checked for a trailing newline
+    bytes_read = sum(call[0][1] for call in pread.call_args_list)
+    returned = sum(len(line) + 1 for line in lines)
+    assert bytes_read <= 2 * returned + 64 + 1
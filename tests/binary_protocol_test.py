@@ -0,0 +1,46 @@
+"""
+Test suite for the binary protocol.
+
+"""
+
+import pytest
+
+from tailsocket.binary_protocol import (
+    HEADER, MESSAGE_FILE, MESSAGE_LINES, Message, decode_messages,
+    encode_message)
+from tailsocket.broadcast import BroadcastMessage
+
+
+def test_encode_and_decode_messages():
+    data = (
+        encode_message(MESSAGE_FILE, b'/var/log/syslog', file_id=3) +
+        encode_message(
+            MESSAGE_LINES, 'Line 1\nLíne 2'.encode(), file_id=3,
+            offset=2 ** 40, line_count=2))
+
+    assert decode_messages(data) == [
+        Message(MESSAGE_FILE, 0, 3, 0, 0, b'/var/log/syslog'),
+        Message(MESSAGE_LINES, 0, 3, 2 ** 40, 2, 'Line 1\nLíne 2'.encode()),
+    ]
+
+
+def test_decode_truncated_messages_raises_value_error():
+    data = encode_message(MESSAGE_LINES, b'Line 1')
+    with pytest.raises(ValueError):
+        decode_messages(data[:HEADER.size - 1])
+    with pytest.raises(ValueError):
+        decode_messages(data[:-1])
+
+
+def test_broadcast_messages_encode_their_binary_payload_once():
+    message = BroadcastMessage(
+        '==> app.log <==\nLine 1\nLine 2', file_id=1, offset=100,
+        body='Line 1\nLine 2')
+
+    assert message.binary_payload is message.binary_payload
+    assert decode_messages(message.binary_payload) == [
+        Message(MESSAGE_LINES, 0, 1, 100, 2, b'Line 1\nLine 2')]
+    frame = message.get_frame(binary=True)
+    assert frame[0] == 0x80 | 0x2
+    assert frame[2:] == message.binary_payload
+    assert message.get_frame(binary=True) is frame
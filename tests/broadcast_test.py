@@ -0,0 +1,63 @@
+"""
+Test suite for the broadcast helpers.
+
+"""
+
+import zlib
+import struct
+
+from tornado import escape
+
+from tailsocket.broadcast import (
+    BroadcastMessage, build_frame, compress_payload)
+
+
+def test_build_frame_for_short_payloads():
+    frame = build_frame(b'Test log line')
+    assert frame == b'\x81\x0d' + b'Test log line'
+
+
+def test_build_frame_for_medium_payloads():
+    payload = b'a' * 300
+    frame = build_frame(payload)
+    assert frame[:4] == b'\x81\x7e' + struct.pack('!H', 300)
+    assert frame[4:] == payload
+
+
+def test_build_frame_for_long_payloads():
+    payload = b'a' * 70000
+    frame = build_frame(payload)
+    assert frame[:10] == b'\x81\x7f' + struct.pack('!Q', 70000)
+    assert frame[10:] == payload
+
+
+def test_broadcast_message_behaves_like_a_string():
+    message = BroadcastMessage('Test log line')
+    assert message == 'Test log line'
+    assert isinstance(message, str)
+
+
+def test_broadcast_message_builds_its_frame_once():
+    message = BroadcastMessage('Línea de log')
+    assert message.payload == 'Línea de log'.encode()
+    assert message.frame is message.frame
+    assert message.frame == build_frame('Línea de log'.encode())
+
+
+def test_broadcast_message_encodes_its_json_once():
+    message = BroadcastMessage('Línea "de" log')
+    assert message.json is message.json
+    assert message.json == escape.json_encode('Línea "de" log')
+
+
+def decompress(data, max_wbits=zlib.MAX_WBITS):
+    decompressor = zlib.decompressobj(-max_wbits)
+    return decompressor.decompress(data + b'\x00\x00\xff\xff')
+
+
+def test_compress_payload_without_context_takeover():
+    payload = b'Test log line\n' * 100
+    compressed = compress_payload(payload)
+    assert len(compressed) < len(payload) / 10
+    assert decompress(compressed) == payload
+    assert compress_payload(payload) == compressed
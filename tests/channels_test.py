@@ -0,0 +1,149 @@
+"""
+Test suite for multiplexed channels.
+
+"""
+
+from unittest import mock
+
+from tornado import escape
+
+from tailsocket import binary_protocol
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.channels import (
+    Channel, ChannelGroup, ChannelMessage, format_channel_message)
+from tailsocket.filters import LineFilter
+
+
+def test_format_channel_message_tags_text_messages():
+    message = format_channel_message('syslog', 'Line "1"\nLine 2')
+    assert escape.json_decode(message) == {
+        'channel': 'syslog', 'data': 'Line "1"\nLine 2'}
+
+
+def test_format_channel_message_reuses_the_json_of_broadcast_messages():
+    message = BroadcastMessage('Test log line')
+    with mock.patch('tailsocket.channels.json_encode',
+                    wraps=escape.json_encode) as json_encode:
+        for channel_id in range(3):
+            tagged = format_channel_message(channel_id, message)
+            assert escape.json_decode(tagged) == {
+                'channel': channel_id, 'data': 'Test log line'}
+
+    encoded = [c[0][0] for c in json_encode.call_args_list]
+    assert encoded == [0, 1, 2]
+
+
+def test_format_channel_message_tags_dict_messages():
+    message = format_channel_message(1, {'type': 'history'})
+    assert message == {'type': 'history', 'channel': 1}
+
+
+def test_channels_write_tagged_messages_to_their_connection():
+    connection = mock.Mock(binary_protocol=False)
+    channel = Channel(connection, 'app', 'app.log')
+    channel.write_message('Test log line')
+    connection.write_message.assert_called_once_with(
+        '{"channel": "app", "data": "Test log line"}', False, lines=1,
+        channel='app')
+
+
+def test_channel_messages_are_preceded_by_their_channel():
+    message = BroadcastMessage('Test log line', file_id=2, offset=14)
+    tagged = [ChannelMessage(channel_id, message) for channel_id in 'ab']
+
+    for channel_id, channel_message in zip('ab', tagged):
+        channel, lines = binary_protocol.decode_messages(
+            channel_message.binary_payload)
+        assert channel.type == binary_protocol.MESSAGE_CHANNEL
+        assert escape.json_decode(channel.payload) == channel_id
+        assert lines == binary_protocol.decode_messages(
+            message.binary_payload)[0]
+
+
+def test_channel_messages_encode_text_as_status_and_dicts_as_json():
+    status = ChannelMessage(1, 'Status')
+    assert status.message_type == binary_protocol.MESSAGE_STATUS
+    assert status == 'Status'
+
+    json = ChannelMessage(1, {'type': 'history'})
+    assert json.message_type == binary_protocol.MESSAGE_JSON
+    assert escape.json_decode(json) == {'type': 'history'}
+
+
+def test_channels_write_channel_messages_on_binary_connections():
+    connection = mock.Mock(binary_protocol=True)
+    channel = Channel(connection, 'app', 'app.log')
+    channel.write_message(BroadcastMessage('Line 1\nLine 2', file_id=1))
+
+    message = connection.write_message.call_args[0][0]
+    assert isinstance(message, ChannelMessage)
+    assert (message.channel_id, message.file_id) == ('app', 1)
+    assert connection.write_message.call_args[1] == {
+        'lines': 2, 'channel': 'app'}
+
+
+def test_channel_groups_register_each_channel_until_its_initial_lines():
+    connection = mock.Mock()
+    group = ChannelGroup(connection, 'app.log')
+    channel = mock.Mock()
+    line_filter = LineFilter(include=['ERROR'])
+    with mock.patch('tailsocket.channels.IOLoop') as ioloop:
+        group.add(channel, line_filter, 42)
+        pending = connection.add_to_registry.call_args[0][0]
+        connection.add_to_registry.assert_called_once_with(
+            pending, 'app.log', line_filter, 42)
+        assert len(group) == 1
+
+        pending.write_message('ERROR initial')
+        pending.write_message('ERROR sent by the group')
+
+    channel.write_message.assert_called_once_with('ERROR initial', False)
+    ioloop.current().add_callback.assert_called_once_with(
+        connection.remove_from_registry, pending, 'app.log')
+    assert group.filter_groups.groups == {line_filter: [channel]}
+
+
+def test_channel_groups_filter_lines_for_each_channel():
+    group = ChannelGroup(mock.Mock(), 'app.log')
+    channels = [mock.Mock() for _ in range(3)]
+    group.filter_groups.add(channels[0])
+    group.filter_groups.add(channels[1], LineFilter(include=['ERROR']))
+    group.filter_groups.add(channels[2], LineFilter(include=['DEBUG']))
+    group.write_message('Initial lines of the group')
+
+    message = BroadcastMessage('ERROR 1\nINFO 2', file_id=3, offset=10)
+    group.write_message(message)
+
+    channels[0].write_message.assert_called_once_with(message, False)
+    filtered = channels[1].write_message.call_args[0][0]
+    assert filtered == 'ERROR 1'
+    assert (filtered.file_id, filtered.offset) == (3, 10)
+    assert not channels[2].write_message.called
+
+
+def test_channel_groups_keep_the_header_of_glob_batches():
+    group = ChannelGroup(mock.Mock(), '*.log')
+    channel = mock.Mock()
+    group.filter_groups.add(channel, LineFilter(include=['ERROR']))
+    group.started = True
+
+    group.write_message(BroadcastMessage(
+        '==> app.log <==\nERROR 1\nINFO 2', body='ERROR 1\nINFO 2'))
+
+    filtered = channel.write_message.call_args[0][0]
+    assert filtered == '==> app.log <==\nERROR 1'
+    assert filtered.body == 'ERROR 1'
+
+
+def test_channel_groups_remove_pending_channels_from_the_registry():
+    connection = mock.Mock()
+    group = ChannelGroup(connection, 'app.log')
+    channel = mock.Mock()
+    group.add(channel)
+    pending = connection.add_to_registry.call_args[0][0]
+
+    group.remove(channel)
+
+    connection.remove_from_registry.assert_called_once_with(
+        pending, 'app.log')
+    assert not group
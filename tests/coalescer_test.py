@@ -0,0 +1,71 @@
+"""
+Test suite for the Coalescer.
+
+"""
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from tailsocket.coalescer import Coalescer
+
+
+def test_coalescer_without_window_flushes_every_chunk(safe_event_loop):
+    callback = mock.MagicMock()
+    coalescer = Coalescer(callback)
+    for i in range(3):
+        coalescer.add('Line {}'.format(i))
+
+    assert callback.call_count == 3
+    assert coalescer.merged == 0
+
+
+def test_coalescer_flushes_first_chunk_of_a_quiet_file_right_away(
+        safe_event_loop):
+    callback = mock.MagicMock()
+    coalescer = Coalescer(callback, window=10)
+    coalescer.add('Line')
+
+    callback.assert_called_once_with('Line')
+
+
+def test_coalescer_flushes_when_reaching_max_bytes(safe_event_loop):
+    callback = mock.MagicMock()
+    coalescer = Coalescer(callback, window=10, max_bytes=10)
+    coalescer.add('First')
+    coalescer.add('Second')
+    coalescer.add('Third')
+
+    assert callback.call_args_list == [
+        mock.call('First'), mock.call('Second\nThird')]
+    assert coalescer.merged == 1
+
+
+@pytest.mark.asyncio
+def test_coalescer_batches_chunks_within_the_window():
+    callback = mock.MagicMock()
+    coalescer = Coalescer(callback, window=0.01)
+    for i in range(4):
+        coalescer.add('Line {}'.format(i))
+
+    assert callback.call_args_list == [mock.call('Line 0')]
+
+    yield from asyncio.sleep(0.02)
+
+    assert callback.call_args_list == [
+        mock.call('Line 0'), mock.call('Line 1\nLine 2\nLine 3')]
+    assert coalescer.chunks_received == 4
+    assert coalescer.batches_flushed == 2
+    assert coalescer.merged == 2
+
+
+def test_cancelling_the_coalescer_discards_pending_chunks(safe_event_loop):
+    callback = mock.MagicMock()
+    coalescer = Coalescer(callback, window=10)
+    coalescer.add('Sent')
+    coalescer.add('Discarded')
+    coalescer.cancel()
+    coalescer.flush()
+
+    callback.assert_called_once_with('Sent')
@@ -3,6 +3,10 @@ Fixtures for test suites.
 
 """
 
+import sys
+import asyncio
+import selectors
+
 import pytest
 
 DEFAULT_FILENAME = 'test.log'
@@ -33,3 +37,27 @@ def create_initialised_log_file():
 @pytest.fixture()
 def create_log_file():
     return _create_log_file()
+
+
+@pytest.fixture
+def safe_event_loop():
+    """Fixture to fallback to `select` in Linux.
+
+    """
+    if sys.platform == 'linux':
+        selector = selectors.SelectSelector()
+        loop = asyncio.SelectorEventLoop(selector)
+        asyncio.set_event_loop(loop)
+        return loop
+
+    return asyncio.get_event_loop_policy().new_event_loop()
+
+
+@pytest.yield_fixture
+def event_loop():
+    """Pytest-asyncio fixture to inject a safe event loop in marked tests.
+
+    """
+    loop = safe_event_loop()
+    yield loop
+    loop.close()
@@ -0,0 +1,76 @@
+"""
+Test suite for the line filters.
+
+"""
+
+from unittest import mock
+
+import pytest
+
+from tailsocket.filters import FilterGroups, LineFilter
+
+LINES = [
+    'INFO sshd: Accepted key for user',
+    'DEBUG sshd: debug1: channel open',
+    'WARNING kernel: low memory',
+    'ERROR sshd: Connection closed on port 22',
+    'INFO cron: job started',
+]
+
+
+@pytest.mark.parametrize('line_filter, expected', [
+    (LineFilter(include=['sshd']), [0, 1, 3]),
+    (LineFilter(include=['sshd'], exclude=['debug1']), [0, 3]),
+    (LineFilter(include=[{'regex': r'port \d+'}]), [3]),
+    (LineFilter(exclude=[{'substring': 'sshd'}]), [2, 4]),
+    (LineFilter(level='warning'), [2, 3]),
+    (LineFilter(include=['cron', 'kernel'], level='WARN'), [2]),
+])
+def test_filters_select_lines(line_filter, expected):
+    assert line_filter.filter_lines(LINES) == [LINES[i] for i in expected]
+
+
+def test_filters_with_the_same_patterns_are_equal():
+    assert LineFilter(include=['a', 'b']) == LineFilter(include=['b', 'a'])
+    assert LineFilter(include=['a']) != LineFilter(exclude=['a'])
+    assert LineFilter.from_request({'filename': 'test.log'}) is None
+
+
+def test_invalid_filters_raise_value_error():
+    with pytest.raises(ValueError):
+        LineFilter(include=[{'regex': '('}])
+    with pytest.raises(ValueError):
+        LineFilter(level='LOUD')
+
+
+def test_filter_groups_split_messages_by_filter():
+    groups = FilterGroups()
+    handlers = [mock.Mock() for _ in range(4)]
+    groups.add(handlers[0])
+    groups.add(handlers[1], LineFilter(level='error'))
+    groups.add(handlers[2], LineFilter(level='error'))
+    groups.add(handlers[3], LineFilter(include=['nothing matches this']))
+
+    message = '\n'.join(LINES)
+    assert len(groups) == 3
+    assert sorted(groups.split(message), key=len) == sorted([
+        (message, [handlers[0]]),
+        (LINES[3], [handlers[1], handlers[2]]),
+    ], key=len)
+
+
+def test_filter_groups_search_each_pattern_once_per_line():
+    groups = FilterGroups()
+    filters = [
+        LineFilter(include=['sshd'], exclude=[str(i)]) for i in range(10)]
+    for line_filter in filters:
+        groups.add(mock.Mock(), line_filter)
+    groups._compiled = {
+        pattern: mock.Mock(wraps=compiled)
+        for pattern, compiled in groups._compiled.items()}
+
+    selected = groups.select(LINES)
+
+    assert groups._compiled['sshd'].search.call_count == 3
+    for line_filter in filters:
+        assert selected[line_filter] == line_filter.filter_lines(LINES)
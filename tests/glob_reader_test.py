@@ -0,0 +1,96 @@
+"""
+Test suite for the GlobReader.
+
+"""
+
+import os
+from unittest import mock
+
+from tailsocket.glob_reader import GlobReader, is_glob
+
+
+def write(path, content):
+    with open(path, 'a') as fd:
+        fd.write(content)
+
+
+def create_tree(tmpdir):
+    for worker in ('worker-1', 'worker-2'):
+        tmpdir.mkdir(worker)
+        write(str(tmpdir.join(worker, 'app.log')), 'Old line\n')
+        write(str(tmpdir.join(worker, 'app.txt')), 'Not a log\n')
+    return os.path.join(str(tmpdir), '*', '*.log')
+
+
+def test_is_glob():
+    assert is_glob('/var/log/*.log')
+    assert is_glob('/var/log/app-[0-9].log')
+    assert not is_glob('/var/log/syslog')
+
+
+def test_glob_reader_matches_paths_by_segment(tmpdir):
+    glob_reader = GlobReader(create_tree(tmpdir), mock.Mock())
+
+    assert glob_reader.root == str(tmpdir)
+    assert glob_reader.matches(str(tmpdir.join('worker-3', 'app.log')))
+    assert not glob_reader.matches(str(tmpdir.join('a', 'b', 'app.log')))
+    assert not glob_reader.matches(str(tmpdir.join('worker-1', 'app.txt')))
+    assert glob_reader.matches_directory(str(tmpdir.join('worker-3')))
+    assert not glob_reader.matches_directory(str(tmpdir.join('a', 'b')))
+    assert sorted(glob_reader.get_directories()) == [
+        str(tmpdir), str(tmpdir.join('worker-1')),
+        str(tmpdir.join('worker-2'))]
+
+
+def test_glob_reader_reads_new_lines_of_matching_files(tmpdir):
+    callback = mock.Mock()
+    glob_reader = GlobReader(create_tree(tmpdir), callback)
+    assert sorted(glob_reader.scan()) == [
+        str(tmpdir.join(worker, 'app.log'))
+        for worker in ('worker-1', 'worker-2')]
+
+    path = str(tmpdir.join('worker-2', 'app.log'))
+    write(path, 'New line\nPartial')
+    glob_reader.read(path)
+    callback.assert_called_once_with(path, ['New line'])
+
+
+def test_glob_reader_keeps_idle_files_closed(tmpdir):
+    callback = mock.Mock()
+    for i in range(5):
+        write(str(tmpdir.join('{}.log'.format(i))), '')
+    glob_reader = GlobReader(
+        os.path.join(str(tmpdir), '*.log'), callback, max_open_files=2)
+    glob_reader.scan()
+    assert len(glob_reader) == 5
+    assert len(glob_reader._open_files) == 0
+
+    for i in range(5):
+        path = str(tmpdir.join('{}.log'.format(i)))
+        write(path, 'Line {}\n'.format(i))
+        glob_reader.read(path)
+        callback.assert_called_with(path, ['Line {}'.format(i)])
+
+    assert list(glob_reader._open_files) == [
+        str(tmpdir.join('{}.log'.format(i))) for i in (3, 4)]
+    glob_reader.close()
+    assert len(glob_reader._open_files) == 0
+
+
+def test_glob_reader_poll_picks_up_new_and_replaced_files(tmpdir):
+    callback = mock.Mock()
+    glob_reader = GlobReader(create_tree(tmpdir), callback)
+    glob_reader.scan()
+
+    tmpdir.mkdir('worker-3')
+    new_path = str(tmpdir.join('worker-3', 'app.log'))
+    write(new_path, 'First line\n')
+    replaced_path = str(tmpdir.join('worker-1', 'app.log'))
+    os.rename(replaced_path, replaced_path + '.1')
+    write(replaced_path, 'Rotated line\n')
+    glob_reader.poll()
+
+    assert sorted(callback.call_args_list) == sorted([
+        mock.call(new_path, ['First line']),
+        mock.call(replaced_path, ['Rotated line']),
+    ])
@@ -0,0 +1,60 @@
+"""
+Test suite for the LineAssembler.
+
+"""
+
+from tailsocket.line_assembler import LineAssembler
+
+
+def test_assembler_splits_complete_lines():
+    assembler = LineAssembler()
+    assert assembler.feed(b'First\nSecond\n') == ['First', 'Second']
+    assert assembler.pending == 0
+
+
+def test_assembler_carries_incomplete_lines_over():
+    assembler = LineAssembler()
+    assert assembler.feed(b'First\nSec') == ['First']
+    assert assembler.pending == 3
+    assert assembler.feed(b'ond') == []
+    assert assembler.feed(b'\nThird\n') == ['Second', 'Third']
+
+
+def test_assembler_handles_characters_split_across_reads():
+    data = 'Línea ñ €\n'.encode()
+    assembler = LineAssembler()
+    lines = []
+    for i in range(len(data)):
+        lines.extend(assembler.feed(data[i:i + 1]))
+
+    assert lines == ['Línea ñ €']
+
+
+def test_assembler_replaces_invalid_bytes():
+    assembler = LineAssembler()
+    assert assembler.feed(b'Bad \xff byte\n') == ['Bad � byte']
+
+
+def test_assembler_strips_carriage_returns():
+    assembler = LineAssembler()
+    assert assembler.feed(b'First\r\nSecond\r\n') == ['First', 'Second']
+
+
+def test_assembler_keeps_whitespace_and_empty_lines():
+    assembler = LineAssembler()
+    assert assembler.feed(b'  Indented\n\nLast \n') == [
+        '  Indented', '', 'Last ']
+
+
+def test_assembler_emits_overlong_lines_at_character_boundaries():
+    data = 'ab€'.encode()
+    assembler = LineAssembler(max_line_length=4)
+    assert assembler.feed(data[:4]) == ['ab']
+    assert assembler.feed(data[4:] + b'\n') == ['€']
+
+
+def test_assembler_reset_discards_incomplete_lines():
+    assembler = LineAssembler()
+    assembler.feed(b'Incomplete')
+    assembler.reset()
+    assert assembler.feed(b'New\n') == ['New']
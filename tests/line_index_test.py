@@ -0,0 +1,85 @@
+"""
+Test suite for the sparse line index.
+
+"""
+
+import threading
+from unittest import mock
+
+import pytest
+
+from tailsocket import line_index
+from tailsocket.line_index import SparseLineIndex
+from tests import conftest
+
+LINES = ['Line {} {}'.format(i, 'x' * (i * 37 % 300)) for i in range(100)]
+
+
+@pytest.yield_fixture
+def log_file():
+    conftest._create_log_file(
+        write_initial_content=True, initial_content='\n'.join(LINES))
+    with open(conftest.DEFAULT_FILENAME, 'rb', buffering=0) as fd:
+        yield fd
+
+
+def get_line_start(line_number):
+    return sum(len(line) + 1 for line in LINES[:line_number])
+
+
+def test_index_keeps_a_checkpoint_every_interval_lines(log_file):
+    index = SparseLineIndex(interval=10)
+    index.feed(log_file.read())
+
+    assert index.lines == 100
+    assert index.checkpoints == [get_line_start(i) for i in range(0, 101, 10)]
+
+
+def test_index_can_be_fed_in_arbitrary_chunks(log_file):
+    data = log_file.read()
+    index = SparseLineIndex(interval=7)
+    for start in range(0, len(data), 33):
+        index.feed(data[start:start + 33])
+
+    assert index.checkpoints == [get_line_start(i) for i in range(0, 101, 7)]
+    assert index.indexed_bytes == len(data)
+
+
+def test_index_finds_line_numbers_and_positions(log_file):
+    index = SparseLineIndex(interval=10)
+    index.feed(log_file.read())
+
+    for line_number in (0, 5, 10, 42, 99, 100):
+        position = get_line_start(line_number)
+        assert index.get_position(log_file, line_number) == position
+        assert index.get_line_number(log_file, position) == line_number
+
+    assert index.get_position(log_file, 101) is None
+
+
+@pytest.mark.asyncio
+def test_index_builds_in_chunks_up_to_the_end(log_file):
+    index = SparseLineIndex(interval=10)
+    end = get_line_start(50)
+    yield from index.build(log_file, lambda: end, chunk_size=100)
+
+    assert index.indexed_bytes == end
+    assert index.lines == 50
+    assert index.checkpoints == [get_line_start(i) for i in range(0, 51, 10)]
+
+
+@pytest.mark.asyncio
+def test_index_reads_the_file_outside_of_the_event_loop(log_file):
+    index = SparseLineIndex(interval=10)
+    threads = set()
+    original_read_at = line_index.read_at
+
+    def read_at(*args):
+        threads.add(threading.get_ident())
+        return original_read_at(*args)
+
+    with mock.patch.object(line_index, 'read_at', read_at):
+        yield from index.build(log_file, lambda: 1000, chunk_size=100)
+
+    assert index.indexed_bytes == 1000
+    assert threads and threading.get_ident() not in threads
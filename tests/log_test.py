@@ -0,0 +1,56 @@
+"""
+Test suite for the logging setup.
+
+"""
+
+import logging
+
+from tornado.options import options
+
+from tailsocket import log
+
+
+def test_records_are_written_to_the_file_of_their_logger(tmpdir):
+    options.access_log_file_path = str(tmpdir.join('access.log'))
+    options.application_log_file_path = str(tmpdir.join('application.log'))
+    options.logging = 'info'
+    log.setup_logging()
+    log.loggers['access'].info('GET / %d', 200)
+    log.loggers['application'].debug('Not logged %s', 'debug')
+    log.loggers['application'].info('Reading %s', 'test.log')
+    log.stop_logging()
+
+    assert 'GET / 200' in tmpdir.join('access.log').read()
+    application_log = tmpdir.join('application.log').read()
+    assert 'Reading test.log' in application_log
+    assert 'GET' not in application_log
+    assert 'Not logged' not in application_log
+
+
+def test_rate_limited_log_logs_once_per_interval(monkeypatch):
+    logger = logging.getLogger('tailsocket.test')
+    logger.setLevel(logging.INFO)
+    records = []
+    monkeypatch.setattr(logger, 'handle', records.append)
+    now = [100]
+    monkeypatch.setattr(log.time, 'monotonic', lambda: now[0])
+
+    sampled = log.RateLimitedLog(logger, logging.INFO, interval=1)
+    for i in range(5):
+        sampled.log('Sending %d', i)
+    now[0] = 101.5
+    sampled.log('Sending %d', 5)
+
+    assert [record.getMessage() for record in records] == [
+        'Sending 0 (1 times in the last 0.0s)',
+        'Sending 5 (5 times in the last 1.5s)',
+    ]
+
+
+def test_rate_limited_log_skips_disabled_levels():
+    logger = logging.getLogger('tailsocket.test.disabled')
+    logger.setLevel(logging.WARNING)
+    sampled = log.RateLimitedLog(logger, logging.INFO)
+    sampled.log('Sending %d', 1)
+
+    assert sampled.count == 0
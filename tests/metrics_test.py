@@ -0,0 +1,68 @@
+"""
+Test suite for the metrics module.
+
+"""
+
+from tailsocket.metrics import Counter, Gauge, Histogram, format_labels
+
+
+def test_counters_render_a_sample_per_label_set():
+    counter = Counter('lines_total', 'Lines read', ('file',))
+    counter.inc('/var/log/a.log')
+    counter.inc('/var/log/b.log', amount=3)
+    counter.inc('/var/log/a.log')
+
+    assert counter.render() == '\n'.join((
+        '# HELP lines_total Lines read',
+        '# TYPE lines_total counter',
+        'lines_total{file="/var/log/a.log"} 2',
+        'lines_total{file="/var/log/b.log"} 3',
+    ))
+
+
+def test_counters_remove_the_samples_of_a_label_set():
+    counter = Counter('lines_total', 'Lines read', ('file',))
+    counter.inc('/var/log/a.log')
+    counter.inc('/var/log/b.log')
+    counter.remove('/var/log/a.log')
+    counter.remove('/var/log/c.log')
+
+    assert counter.render().splitlines()[2:] == [
+        'lines_total{file="/var/log/b.log"} 1']
+
+
+def test_gauges_are_set():
+    gauge = Gauge('connections', 'Open connections')
+    gauge.set(value=5)
+    gauge.set(value=2)
+
+    assert gauge.render().splitlines()[-1] == 'connections 2'
+
+
+def test_gauges_are_set_for_the_given_label_values():
+    gauge = Gauge('subscribers', 'Subscribers', ('file',))
+    gauge.set('/var/log/a.log', value=3)
+    gauge.set('/var/log/b.log', value=1)
+
+    assert gauge.render().splitlines()[2:] == [
+        'subscribers{file="/var/log/a.log"} 3',
+        'subscribers{file="/var/log/b.log"} 1']
+
+
+def test_histograms_render_cumulative_buckets():
+    histogram = Histogram('latency', 'Latency', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+
+    assert histogram.render().splitlines()[2:] == [
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        'latency_sum 2.65',
+        'latency_count 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    assert format_labels(('file',), ('a"b\\c\n',)) == (
+        r'{file="a\"b\\c\n"}')
@@ -0,0 +1,67 @@
+"""
+Test suite for the load generator.
+
+"""
+
+import os
+import random
+
+import pytest
+
+import mock_log
+
+
+@pytest.mark.parametrize('distribution', mock_log.DISTRIBUTIONS)
+def test_lines_carry_their_timestamp_and_sequence(distribution):
+    generator = mock_log.LineGenerator(
+        100, distribution=distribution, multibyte=0.5,
+        rng=random.Random(0))
+    for sequence in range(100):
+        line = generator.make_line(sequence, timestamp=1476711000.5)
+        assert line.endswith('\n')
+        assert line.count('\n') == 1
+        assert len(line.encode('utf-8')) <= generator.max_size
+        assert mock_log.parse_line(line) == (1476711000.5, sequence)
+
+
+def test_fixed_size_lines_do_not_exceed_the_size():
+    generator = mock_log.LineGenerator(80, multibyte=1, rng=random.Random(0))
+    sizes = {
+        len(generator.make_line(sequence).encode('utf-8'))
+        for sequence in range(100)}
+    assert max(sizes) == 80
+    assert min(sizes) > 70
+
+
+def test_parse_line_ignores_other_lines():
+    assert mock_log.parse_line('<< File is empty, tail started >>') is None
+    assert mock_log.parse_line('') is None
+
+
+def test_sequence_tracker_counts_lost_and_duplicated_lines():
+    tracker = mock_log.SequenceTracker()
+    for sequence in (0, 1, 1, 4, 5, 3):
+        tracker.track(sequence)
+    tracker.finish(8)
+
+    assert tracker.received == 6
+    assert tracker.duplicated == 2
+    assert tracker.lost == 4
+
+
+@pytest.mark.parametrize('mode', mock_log.ROTATIONS)
+def test_log_files_are_rotated(tmpdir, mode):
+    path = str(tmpdir.join('test.log'))
+    log_file = mock_log.LogFile(path, rollover=3, rollover_mode=mode)
+    generator = mock_log.LineGenerator(40)
+    log_file.write([generator.make_line(i) for i in range(5)])
+    log_file.close()
+
+    with open(path) as fd:
+        sequences = [mock_log.parse_line(line)[1] for line in fd]
+    assert sequences == [3, 4]
+    if mode in (mock_log.ROTATION_RENAME, mock_log.ROTATION_COPYTRUNCATE):
+        with open(path + '.1') as fd:
+            assert len(fd.readlines()) == 3
+    else:
+        assert not os.path.exists(path + '.1')
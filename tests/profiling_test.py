@@ -0,0 +1,135 @@
+"""
+Test suite for the profiling module and the admin endpoint.
+
+"""
+
+import os
+import sys
+import time
+import asyncio
+import selectors
+
+import tornado
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.testing import AsyncHTTPTestCase
+
+from tailsocket import application, log, metrics, profiling
+
+
+def test_report_slow_calls_counts_slow_calls(monkeypatch):
+    monkeypatch.setattr(profiling, 'slow_callback_threshold', 0.01)
+
+    @profiling.report_slow_calls('test_callback')
+    def callback(seconds):
+        time.sleep(seconds)
+        return seconds
+
+    assert callback(0) == 0
+    assert metrics.SLOW_CALLBACKS.values[('test_callback',)] == 0
+    assert callback(0.02) == 0.02
+    assert metrics.SLOW_CALLBACKS.values[('test_callback',)] == 1
+
+
+def test_loop_lag_monitor_measures_blocking_callbacks():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monitor = profiling.LoopLagMonitor(interval=0.01)
+    monitor.start()
+    loop.call_soon(time.sleep, 0.05)
+    loop.run_until_complete(asyncio.sleep(0.1))
+    monitor.stop()
+    loop.close()
+
+    assert monitor.max_lag >= 0.03
+
+
+def test_cpu_profile_reports_the_functions_called():
+    def profiled_function():
+        return sum(range(1000))
+
+    profile = profiling.CpuProfile(limit=10)
+    profile.start()
+    profiled_function()
+    report = profile.stop()
+
+    assert 'profiled_function' in report
+
+
+def test_memory_profile_reports_the_allocations():
+    profile = profiling.MemoryProfile(limit=10)
+    profile.start()
+    allocated = [str(i) for i in range(10000)]
+    report = profile.stop()
+
+    assert allocated
+    assert 'profiling_test.py' in report
+
+
+class AdminTests(AsyncHTTPTestCase):
+
+    def get_app(self):
+        options.access_log_file_path = 'test.access.log'
+        options.application_log_file_path = 'test.application.log'
+        options.logging = 'debug'
+        options.admin = True
+        log.setup_logging()
+        return application.TailSocketApplication()
+
+    def get_new_ioloop(self):
+        if sys.platform == 'linux':
+            selector = selectors.SelectSelector()
+            loop = asyncio.SelectorEventLoop(selector)
+            asyncio.set_event_loop(loop)
+
+        IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+        return IOLoop.current()
+
+    def tearDown(self):
+        options.admin = False
+        for path in (
+                options.access_log_file_path,
+                options.application_log_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        super().tearDown()
+
+    @tornado.testing.gen_test
+    def test_profile_endpoint_returns_a_time_boxed_capture(self):
+        response = yield self.http_client.fetch(
+            self.get_url('/admin/profile?mode=cpu&seconds=0.05'))
+        assert response.headers['Content-Type'] == 'text/plain'
+        assert b'function calls' in response.body
+
+    @tornado.testing.gen_test
+    def test_profile_endpoint_runs_one_capture_at_a_time(self):
+        first = self.http_client.fetch(
+            self.get_url('/admin/profile?mode=memory&seconds=0.1'))
+        yield gen.sleep(0.01)
+        response = yield self.http_client.fetch(
+            self.get_url('/admin/profile?mode=cpu&seconds=0'),
+            raise_error=False)
+        assert response.code == 409
+        assert (yield first).code == 200
+
+    def test_profile_endpoint_rejects_unknown_modes(self):
+        response = self.fetch('/admin/profile?mode=disk')
+        assert response.code == 400
+
+    def test_profile_endpoint_rejects_invalid_arguments(self):
+        for query in ('seconds=abc', 'seconds=nan', 'seconds=-1',
+                      'limit=abc', 'limit=0'):
+            response = self.fetch('/admin/profile?mode=cpu&' + query)
+            assert response.code == 400
+
+    @tornado.testing.gen_test
+    def test_profile_endpoint_caps_the_capture_duration(self):
+        application.ProfileHandler.max_seconds = 0.05
+        try:
+            response = yield self.http_client.fetch(
+                self.get_url('/admin/profile?mode=cpu&seconds=inf'),
+                request_timeout=5)
+        finally:
+            application.ProfileHandler.max_seconds = 60
+        assert response.code == 200
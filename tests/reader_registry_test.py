@@ -5,43 +5,26 @@ Test suite for ReaderRegistry
 
 import os
 import sys
+import gzip
 import asyncio
-import selectors
+from functools import partial
 from unittest import mock
 
 import pytest
 
+from tailsocket import metrics
+from tailsocket.archives import get_archive_id
+from tailsocket.filters import LineFilter
 from tailsocket.reader_registries import get_registry
+from tailsocket.reader_registries.loop_reader_registry import ReaderRegistry
+from tailsocket.reader_registries.poll_reader_registry import (
+    get_filesystem_type)
 from tests import conftest
 
 
 DEFAULT_FILENAME = conftest.DEFAULT_FILENAME
 
 
-@pytest.fixture
-def safe_event_loop():
-    """Fixture to fallback to `select` in Linux.
-
-    """
-    if sys.platform == 'linux':
-        selector = selectors.SelectSelector()
-        loop = asyncio.SelectorEventLoop(selector)
-        asyncio.set_event_loop(loop)
-        return loop
-
-    return asyncio.get_event_loop_policy().new_event_loop()
-
-
-@pytest.yield_fixture
-def event_loop():
-    """Pytest-asyncio fixture to inject a safe event loop in marked tests.
-
-    """
-    loop = safe_event_loop()
-    yield loop
-    loop.close()
-
-
 def create_reader_and_add_handler(filename=None, handler=None, **kwargs):
     """Creates a ReaderRegistry instance watching a particular filename.
 
@@ -78,6 +61,14 @@ def test_a_new_registry_incudes_a_readers_dictionary(
     assert registry.readers == {}
 
 
+def test_get_registry_returns_the_requested_registry_type(
+        safe_event_loop):
+    registry = get_registry(registry_type='loop')
+    assert type(registry) is ReaderRegistry
+    with pytest.raises(ValueError):
+        get_registry(registry_type='kqueue')
+
+
 def test_registry_can_add_handlers_to_filenames(
         safe_event_loop, create_initialised_log_file):
     registry, handler = create_reader_and_add_handler()
@@ -146,6 +137,36 @@ def test_removing_one_of_many_handlers(safe_event_loop, create_log_file):
     assert another_handler in registry.readers[filename]['handlers']
 
 
+def test_messages_are_shared_only_by_many_handlers(safe_event_loop):
+    registry = get_registry()
+    handlers = [mock.MagicMock() for _ in range(2)]
+
+    registry.send_message_to_handlers('Line', handlers[:1])
+    registry.send_message_to_handlers('Line', handlers)
+
+    single = handlers[0].write_message.call_args_list[0][0][0]
+    shared = handlers[0].write_message.call_args_list[1][0][0]
+    assert not single.shared
+    assert shared.shared
+    assert handlers[1].write_message.call_args[0][0] is shared
+
+
+def test_adding_a_handler_to_a_watched_file_sends_lines_from_memory(
+        safe_event_loop):
+    conftest._create_log_file(
+        write_initial_content=True,
+        initial_content="\n".join('Line {}'.format(i) for i in range(20)))
+    registry, handler = create_reader_and_add_handler()
+    another_handler = mock.MagicMock()
+    with mock.patch.object(
+            registry, 'read_last_lines_from_file') as read_last_lines:
+        registry.add_handler_to_filename(another_handler, DEFAULT_FILENAME)
+
+    read_last_lines.assert_not_called()
+    another_handler.write_message.assert_called_once_with(
+        '\n'.join('Line {}'.format(i) for i in range(10, 20)))
+
+
 # Note the `event_loop` fixture is injected automatically
 
 @pytest.mark.asyncio
@@ -197,7 +218,514 @@ def test_reader_method_detects_file_rotation(create_log_file):
     handler.write_message.assert_has_calls(calls)
 
 
+@pytest.mark.skipif(
+    sys.platform != 'linux',
+    reason='The select loop calls the reader on every iteration')
+@pytest.mark.asyncio
+def test_reader_keeps_the_file_open_and_does_not_stat_on_appends(
+        create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    reader = registry.readers[os.path.abspath(DEFAULT_FILENAME)]
+    fd = reader['file']
+    with mock.patch('os.stat', wraps=os.stat) as stat, \
+            mock.patch('os.fstat', wraps=os.fstat) as fstat:
+        for i in range(3):
+            with open(DEFAULT_FILENAME, 'a') as log_fd:
+                print('Test log line {}'.format(i), file=log_fd)
+
+            yield from noop()
+
+    assert handler.write_message.call_count == 4  # including empty message
+    assert reader['file'] is fd
+    assert reader['offset'] == os.path.getsize(DEFAULT_FILENAME)
+    assert stat.call_count == 0
+    assert fstat.call_count == 0
+
+
+@pytest.mark.asyncio
+def test_reader_coalesces_bursts_of_writes(create_log_file):
+    registry, handler = create_reader_and_add_handler(coalesce_window_ms=50)
+    for i in range(4):
+        with open(DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line {}'.format(i), file=fd)
+
+        yield from noop()
+
+    assert handler.write_message.call_count == 2  # empty message plus first
+    handler.write_message.assert_called_with('Test log line 0')
+
+    yield from asyncio.sleep(0.06)
+
+    assert handler.write_message.call_count == 3
+    handler.write_message.assert_called_with(
+        'Test log line 1\nTest log line 2\nTest log line 3')
+    stats = registry.get_coalescing_stats()[os.path.abspath(DEFAULT_FILENAME)]
+    assert stats == {'chunks': 4, 'batches': 2, 'merged': 2}
+
+
+@pytest.mark.asyncio
+def test_reader_reads_large_appends_in_bounded_chunks(create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    registry.read_budget_bytes = 1024
+    lines = ['Test log line {:04d}'.format(i) for i in range(1000)]
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('\n'.join(lines), file=fd)
+
+    for _ in range(100):
+        yield from asyncio.sleep(0.001)
+
+    messages = [call[0][0] for call in handler.write_message.call_args_list]
+    assert '\n'.join(messages[1:]).split('\n') == lines
+    # Plus the part of a line left over by the previous chunk
+    assert max(len(message) for message in messages) <= 1024 + len(lines[0])
+    assert registry.readers[os.path.abspath(DEFAULT_FILENAME)][
+        'catch_up_task'] is None
+
+
+@pytest.mark.asyncio
+def test_large_appends_do_not_starve_other_files(create_many_log_files):
+    registry = get_registry()
+    registry.read_budget_bytes = 1024
+    received = []
+    for filename in create_many_log_files[:2]:
+        handler = mock.MagicMock()
+        handler.write_message.side_effect = partial(
+            lambda filename, message: received.append(filename), filename)
+        registry.add_handler_to_filename(handler, filename)
+    firehose, other = create_many_log_files[:2]
+    del received[:]
+
+    with open(firehose, 'a') as fd:
+        for i in range(5000):
+            print('Test log line {:04d}'.format(i), file=fd)
+    yield from noop()
+    with open(other, 'a') as fd:
+        print('Test log line', file=fd)
+
+    for _ in range(200):
+        yield from asyncio.sleep(0.001)
+
+    assert received.index(other) < len(received) - 10
+
+
+@pytest.mark.asyncio
+def test_reader_only_sends_complete_lines(create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    data = 'Test líne split\n'.encode()
+    for chunk in (data[:7], data[7:], b'Second line\n'):
+        with open(DEFAULT_FILENAME, 'ab') as fd:
+            fd.write(chunk)
+
+        yield from noop()
+
+    assert handler.write_message.call_args_list[1:] == [
+        mock.call('Test líne split'), mock.call('Second line')]
+
+
+@pytest.mark.asyncio
+def test_a_line_being_written_is_sent_once_complete(create_log_file):
+    with open(DEFAULT_FILENAME, 'w') as fd:
+        fd.write('First\nSecond half-')
+    registry, handler = create_reader_and_add_handler()
+    reader = registry.readers[os.path.abspath(DEFAULT_FILENAME)]
+    assert reader['scrollback'].get_last_lines(10) == ['First']
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        fd.write('written line\n')
+    yield from noop()
+
+    assert handler.write_message.call_args_list == [
+        mock.call('First'), mock.call('Second half-written line')]
+
+
+@pytest.mark.asyncio
+def test_registry_reads_pages_of_history(create_log_file):
+    lines = ['Line {}'.format(i) for i in range(100)]
+    conftest._create_log_file(
+        write_initial_content=True, initial_content='\n'.join(lines))
+    registry, handler = create_reader_and_add_handler()
+
+    page = registry.read_history(DEFAULT_FILENAME, 20)
+    assert page['lines'] == lines[80:]
+    assert page['has_more']
+
+    page = registry.read_history(DEFAULT_FILENAME, 20, before=page['cursor'])
+    assert page['lines'] == lines[60:80]
+
+    reader = registry.readers[os.path.abspath(DEFAULT_FILENAME)]
+    yield from reader['line_index_task']
+    page = registry.read_history(DEFAULT_FILENAME, 20, skip=70)
+    assert page['lines'] == lines[10:30]
+    assert page['line'] == 10
+
+    page = registry.read_history(DEFAULT_FILENAME, 20, before=page['cursor'])
+    assert page['lines'] == lines[:10]
+    assert page == {
+        'lines': lines[:10], 'cursor': 0, 'has_more': False, 'line': 0}
+
+
+@pytest.mark.asyncio
+def test_history_continues_into_rotated_archives(tmpdir):
+    lines = ['Line {}'.format(i) for i in range(300)]
+    path = str(tmpdir.join('app.log'))
+    with gzip.open(path + '.2.gz', 'wt') as fd:
+        print('\n'.join(lines[:100]), file=fd)
+    tmpdir.join('app.log.1').write('\n'.join(lines[100:200]) + '\n')
+    conftest._create_log_file(
+        path, write_initial_content=True,
+        initial_content='\n'.join(lines[200:]))
+    registry, handler = create_reader_and_add_handler(path)
+
+    page = registry.read_history(path, 150)
+    page = yield from asyncio.wrap_future(page)
+    assert page['lines'] == lines[150:]
+    assert page['cursor'] == '{}:{}'.format(
+        get_archive_id(os.stat(path + '.1')),
+        sum(len(line) + 1 for line in lines[100:150]))
+    assert page['has_more']
+
+    page = yield from asyncio.wrap_future(
+        registry.read_history(path, 150, before=page['cursor'], skip=10))
+    assert page['lines'] == lines[:140]
+    assert page == {
+        'lines': lines[:140],
+        'cursor': '{}:0'.format(get_archive_id(os.stat(path + '.2.gz'))),
+        'has_more': False, 'line': None}
+
+
+def test_metrics_of_a_file_are_removed_with_its_reader(
+        safe_event_loop, create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    filename = os.path.abspath(DEFAULT_FILENAME)
+    read_bytes = metrics.READ_BYTES.values.get((filename,), 0)
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('Test log line', file=fd)
+    registry.reader(filename)
+    assert metrics.READ_BYTES.values[(filename,)] == read_bytes + 14
+
+    registry.remove_handler_from_filename(handler, DEFAULT_FILENAME)
+    for metric in metrics.FILE_METRICS:
+        assert (filename,) not in metric.values
+
+
+@pytest.mark.asyncio
+def test_line_index_is_extended_as_the_file_grows(create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    registry.read_history(DEFAULT_FILENAME, 10)
+    reader = registry.readers[os.path.abspath(DEFAULT_FILENAME)]
+    yield from reader['line_index_task']
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('\n'.join('Line {}'.format(i) for i in range(10)), file=fd)
+
+    yield from noop()
+
+    assert reader['line_index'].lines == 10
+    page = registry.read_history(DEFAULT_FILENAME, 5, skip=2)
+    assert page['lines'] == ['Line {}'.format(i) for i in range(3, 8)]
+    assert page['line'] == 3
+
+
+@pytest.mark.asyncio
+def test_registry_sends_handlers_the_lines_passing_their_filters(
+        create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    error_handler = mock.MagicMock()
+    registry.add_handler_to_filename(
+        error_handler, DEFAULT_FILENAME, LineFilter(level='error'))
+    error_handler.write_message.assert_called_once_with(
+        '<< No recent lines match the filters, tail started >>')
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('INFO Starting\nERROR Failed\nINFO Retrying', file=fd)
+
+    yield from noop()
+
+    handler.write_message.assert_called_with(
+        'INFO Starting\nERROR Failed\nINFO Retrying')
+    error_handler.write_message.assert_called_with('ERROR Failed')
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('INFO Done', file=fd)
+
+    yield from noop()
+
+    handler.write_message.assert_called_with('INFO Done')
+    assert error_handler.write_message.call_count == 2
+
+
+@pytest.mark.asyncio
+def test_registry_tails_files_matching_a_glob(tmpdir):
+    tmpdir.mkdir('worker-1').join('app.log').write('Old line\n')
+    pattern = os.path.join(str(tmpdir), '*', '*.log')
+    registry = get_registry()
+    registry.glob_poll_interval = 0.001
+    handler = mock.MagicMock()
+    registry.add_handler_to_glob(handler, pattern)
+    handler.write_message.assert_called_once_with(
+        '<< Tailing 1 files matching {} >>'.format(pattern))
+
+    with tmpdir.join('worker-1', 'app.log').open('a') as fd:
+        print('First line', file=fd)
+    tmpdir.mkdir('worker-2').join('app.log').write('Second line\n')
+    tmpdir.join('worker-2', 'app.txt').write('Not a log\n')
+
+    for _ in range(10):
+        yield from noop()
+        if handler.write_message.call_count == 3:
+            break
+
+    assert sorted(
+        c[0][0] for c in handler.write_message.call_args_list[1:]) == [
+        '==> {} <==\nFirst line'.format(tmpdir.join('worker-1', 'app.log')),
+        '==> {} <==\nSecond line'.format(tmpdir.join('worker-2', 'app.log')),
+    ]
+
+    path = str(tmpdir.join('worker-1', 'app.log'))
+    assert metrics.READ_LINES.values[(path,)] == 1
+    assert registry.remove_handler_from_glob(handler, pattern)
+    assert registry.globs == {}
+    assert (path,) not in metrics.READ_LINES.values
+
+
+def rotate_by_renaming(filename):
+    os.rename(filename, filename + '.1')
+    with open(filename + '.1', 'a') as fd:
+        print('Late line in rotated file', file=fd)
+
+
+def rotate_by_deleting(filename):
+    os.remove(filename)
+
+
+@pytest.mark.parametrize('rotate', [rotate_by_renaming, rotate_by_deleting])
+@pytest.mark.asyncio
+def test_reader_method_detects_file_replacement(create_log_file, rotate):
+    registry, handler = create_reader_and_add_handler()
+    if registry.rotation_check_interval is not None:
+        registry.rotation_check_interval = 0
+    filename = os.path.abspath(DEFAULT_FILENAME)
+    old_inode = os.stat(filename).st_ino
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        fd.write('Before rotation\nIncomplete line')
+
+    yield from noop()
+    rotate(DEFAULT_FILENAME)
+    yield from noop()
+
+    with open(DEFAULT_FILENAME, 'w') as fd:
+        print('After rotation', file=fd)
+
+    for _ in range(20):
+        yield from asyncio.sleep(0.001)
+
+    messages = [call[0][0] for call in handler.write_message.call_args_list]
+    if rotate is rotate_by_renaming:
+        assert messages[1:] == [
+            'Before rotation',
+            'Incomplete lineLate line in rotated file',
+            'After rotation']
+    else:
+        assert messages[1:] == [
+            'Before rotation', 'Incomplete line', 'After rotation']
+
+    assert os.stat(filename).st_ino != old_inode
+    assert registry.readers[filename]['previous_stat'].st_ino != old_inode
+    assert registry.rotations_detected == 1
+
+    if os.path.exists(DEFAULT_FILENAME + '.1'):
+        os.remove(DEFAULT_FILENAME + '.1')
+
+
+@pytest.mark.asyncio
+def test_files_replaced_are_read_in_bounded_chunks(create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    registry.read_budget_bytes = 1024
+    if registry.rotation_check_interval is not None:
+        registry.rotation_check_interval = 0
+    filename = os.path.abspath(DEFAULT_FILENAME)
+    lines = ['Test log line {:04d}'.format(i) for i in range(1000)]
+    reads = []
+    read_new_content = registry.read_new_content
+
+    def record_read(reader, limit=None):
+        reads.append(limit)
+        return read_new_content(reader, limit)
+
+    registry.read_new_content = record_read
+    os.rename(DEFAULT_FILENAME, DEFAULT_FILENAME + '.1')
+    with open(DEFAULT_FILENAME + '.1', 'a') as fd:
+        print('\n'.join(lines[:500]), file=fd)
+    with open(DEFAULT_FILENAME, 'w') as fd:
+        print('\n'.join(lines[500:]), file=fd)
+    registry.check_replacement(filename)
+
+    for _ in range(100):
+        yield from asyncio.sleep(0.001)
+
+    messages = [call[0][0] for call in handler.write_message.call_args_list]
+    assert '\n'.join(messages[1:]).split('\n') == lines
+    assert None not in reads
+    assert registry.rotations_detected == 1
+    assert registry.readers[filename]['next_file'] is None
+    os.remove(DEFAULT_FILENAME + '.1')
+
+
 def test_registry_fails_if_filename_does_not_exist(
         safe_event_loop, create_log_file):
     with pytest.raises(OSError):
         registry, handler = create_reader_and_add_handler('not-a-file.log')
+
+
+@pytest.yield_fixture
+def create_many_log_files():
+    """Creates a handful of log files, removing them afterwards.
+
+    """
+    filenames = ['test-{}.log'.format(i) for i in range(5)]
+    for filename in filenames:
+        conftest._create_log_file(filename)
+
+    yield filenames
+
+    for filename in filenames:
+        os.remove(filename)
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='Requires pyinotify')
+def test_notify_registry_registers_a_single_loop_reader_for_many_files(
+        safe_event_loop, create_many_log_files):
+    registry = get_registry()
+    handler = mock.MagicMock()
+    with mock.patch.object(
+            safe_event_loop, 'add_reader',
+            wraps=safe_event_loop.add_reader) as add_reader:
+        for filename in create_many_log_files:
+            registry.add_handler_to_filename(handler, filename)
+
+    assert len(registry.readers) == len(create_many_log_files)
+    assert add_reader.call_count == 1
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='Requires pyinotify')
+@pytest.mark.asyncio
+def test_notify_registry_dispatches_each_event_once(create_many_log_files):
+    registry = get_registry()
+    handler = mock.MagicMock()
+    for filename in create_many_log_files:
+        registry.add_handler_to_filename(handler, filename)
+
+    with mock.patch.object(
+            registry, 'reader', wraps=registry.reader) as reader:
+        with open(create_many_log_files[2], 'a') as fd:
+            print('Test log line', file=fd)
+
+        yield from noop()
+
+    assert reader.call_count == 1
+    reader.assert_called_once_with(
+        os.path.abspath(create_many_log_files[2]))
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='Requires pyinotify')
+@pytest.mark.asyncio
+def test_notify_registry_counts_events_received_while_catching_up(
+        create_log_file):
+    registry, handler = create_reader_and_add_handler()
+    filename = os.path.abspath(DEFAULT_FILENAME)
+    received = metrics.FILE_EVENTS_RECEIVED.values[(filename,)]
+    reads = metrics.FILE_EVENTS.values[(filename,)]
+    reader = registry.readers[filename]
+    reader['catch_up_task'] = mock.MagicMock()
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('Test log line', file=fd)
+    yield from noop()
+
+    assert metrics.FILE_EVENTS_RECEIVED.values[(filename,)] == received + 1
+    assert metrics.FILE_EVENTS.values[(filename,)] == reads
+    reader['catch_up_task'] = None
+
+
+@pytest.mark.asyncio
+def test_poll_registry_reads_new_lines(create_log_file):
+    registry, handler = create_reader_and_add_handler(registry_type='poll')
+    registry.poller.min_interval = 0.01
+    for i in range(3):
+        with open(DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line {}'.format(i), file=fd)
+        yield from asyncio.sleep(0.1)
+
+    handler.write_message.assert_has_calls([
+        mock.call('Test log line {}'.format(i)) for i in range(3)])
+
+
+@pytest.mark.asyncio
+def test_poll_registry_backs_off_polling_idle_files(create_log_file):
+    registry, handler = create_reader_and_add_handler(registry_type='poll')
+    poller = registry.poller
+    poller.min_interval, poller.max_interval = 0.01, 0.04
+    poll, = poller.polls.values()
+
+    yield from asyncio.sleep(0.2)
+    assert poll['interval'] == 0.04
+
+    with open(DEFAULT_FILENAME, 'a') as fd:
+        print('Test log line', file=fd)
+    for _ in range(100):
+        if handler.write_message.call_args == mock.call('Test log line'):
+            break
+        yield from asyncio.sleep(0.001)
+    assert poll['interval'] == 0.01
+
+
+@pytest.mark.asyncio
+def test_poll_registry_detects_file_replacement(create_log_file):
+    registry, handler = create_reader_and_add_handler(registry_type='poll')
+    registry.poller.min_interval = 0.01
+    filename = os.path.abspath(DEFAULT_FILENAME)
+
+    rotate_by_renaming(DEFAULT_FILENAME)
+    with open(DEFAULT_FILENAME, 'w') as fd:
+        print('After rotation', file=fd)
+    yield from asyncio.sleep(0.1)
+
+    handler.write_message.assert_has_calls([
+        mock.call('Late line in rotated file'), mock.call('After rotation')])
+    assert registry.rotations_detected == 1
+    assert list(registry.poller.polls) == [filename]
+    os.remove(DEFAULT_FILENAME + '.1')
+
+
+def test_get_filesystem_type_uses_the_closest_mount_point(tmpdir):
+    mounts = tmpdir.join('mounts')
+    mounts.write('\n'.join((
+        '/dev/sda1 / ext4 rw 0 0',
+        'server:/export /mnt/shared\\040logs nfs4 rw 0 0',
+        'tmpfs /mnt/shared\\040logs/tmp tmpfs rw 0 0',
+    )))
+
+    def get_type(path):
+        return get_filesystem_type(path, mounts_path=str(mounts))
+
+    assert get_type('/var/log/syslog') == 'ext4'
+    assert get_type('/mnt/shared logs/app.log') == 'nfs4'
+    assert get_type('/mnt/shared logs/tmp/app.log') == 'tmpfs'
+    assert get_type('/mnt/shared logs2/app.log') == 'ext4'
+
+
+@pytest.mark.skipif(sys.platform != 'linux', reason='Requires pyinotify')
+def test_notify_registry_polls_files_in_network_filesystems(
+        safe_event_loop, create_log_file):
+    path = 'tailsocket.reader_registries.notify_reader_registry'
+    with mock.patch(path + '.is_network_filesystem', return_value=True):
+        registry, handler = create_reader_and_add_handler(
+            registry_type='notify')
+
+    filename = os.path.abspath(DEFAULT_FILENAME)
+    assert list(registry.get_poller().polls) == [filename]
+    assert registry._watch_descriptors == {}
+
+    registry.remove_handler_from_filename(handler, DEFAULT_FILENAME)
+    assert registry.get_poller().polls == {}
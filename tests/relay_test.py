@@ -0,0 +1,209 @@
+"""
+Test suite for relays, running an origin and a relay instance.
+
+"""
+
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+import selectors
+from unittest import mock
+
+import pytest
+import tornado
+import tornado.websocket
+from tornado import escape, gen
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.testing import AsyncHTTPTestCase, bind_unused_port
+
+from tailsocket import application, log
+from tailsocket.reader_registries.upstream_reader_registry import (
+    UpstreamConnection, UpstreamReaderRegistry)
+from tests import conftest
+
+
+class RelayTests(AsyncHTTPTestCase):
+    """The test application is the origin, the relay runs in the same event
+    loop on another port.
+
+    """
+
+    def get_app(self):
+        options.access_log_file_path = 'test.access.log'
+        options.application_log_file_path = 'test.application.log'
+        options.logging = 'debug'
+        log.setup_logging()
+        return application.TailSocketApplication()
+
+    def get_new_ioloop(self):
+        if sys.platform == 'linux':
+            selector = selectors.SelectSelector()
+            loop = asyncio.SelectorEventLoop(selector)
+            asyncio.set_event_loop(loop)
+
+        IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+        return IOLoop.current()
+
+    def setUp(self):
+        super().setUp()
+        self.relay_registry = UpstreamReaderRegistry(
+            'ws://localhost:{}'.format(self.get_http_port()))
+        self.relay_registry.upstream_reconnect_delay = 0.01
+        self.relay_app = application.TailSocketApplication(
+            registry=self.relay_registry)
+        sock, self.relay_port = bind_unused_port()
+        self.relay_server = HTTPServer(self.relay_app)
+        self.relay_server.add_sockets([sock])
+
+    def tearDown(self):
+        for upstream in list(self.relay_registry.upstreams.values()):
+            upstream.close()
+        self.relay_server.stop()
+        self.io_loop.run_sync(lambda: gen.sleep(0.05))
+        for path in (
+                options.access_log_file_path,
+                options.application_log_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        super().tearDown()
+
+    @gen.coroutine
+    def connect_client(self, filename=None):
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.relay_port)
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(
+            os.path.abspath(filename or conftest.DEFAULT_FILENAME))
+        return ws_client
+
+    def append_line(self, line, filename=conftest.DEFAULT_FILENAME):
+        with open(filename, 'a') as fd:
+            print(line, file=fd)
+
+    @tornado.testing.gen_test
+    def test_relay_clients_share_one_upstream_connection(self):
+        conftest._create_log_file(write_initial_content=True)
+        ws_clients = []
+        for i in range(3):
+            ws_client = yield self.connect_client()
+            response = yield ws_client.read_message()
+            assert response == conftest.DEFAULT_TEXT
+            ws_clients.append(ws_client)
+
+        assert len(self.relay_registry.upstreams) == 1
+        assert len(self._app.connections) == 1
+
+        self.append_line('Test log line')
+        for ws_client in ws_clients:
+            response = yield ws_client.read_message()
+            assert response == 'Test log line'
+
+    @tornado.testing.gen_test
+    def test_relay_resumes_without_duplicates_after_reconnecting(self):
+        conftest._create_log_file(write_initial_content=True)
+        ws_client = yield self.connect_client()
+        yield ws_client.read_message()
+        self.append_line('Line 1')
+        assert (yield ws_client.read_message()) == 'Line 1'
+
+        upstream, = self.relay_registry.upstreams.values()
+        upstream.connection.close()
+        self.append_line('Line 2')
+        yield gen.sleep(0.1)
+        self.append_line('Line 3')
+
+        received = []
+        while len(received) < 2:
+            response = yield ws_client.read_message()
+            received.extend(response.split('\n'))
+        assert received == ['Line 2', 'Line 3']
+
+    @tornado.testing.gen_test
+    def test_origin_resumes_from_the_given_offset(self):
+        conftest._create_log_file(
+            write_initial_content=True, initial_content='Line 1\nLine 2')
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(escape.json_encode({
+            'type': 'subscribe', 'filename': conftest.DEFAULT_FILENAME,
+            'resume_from': len('Line 1\n')}))
+        assert (yield ws_client.read_message()) == 'Line 2'
+
+    @tornado.testing.gen_test
+    def test_relay_reconnects_after_failing_to_handle_a_message(self):
+        conftest._create_log_file(write_initial_content=True)
+        ws_client = yield self.connect_client()
+        yield ws_client.read_message()
+
+        upstream, = self.relay_registry.upstreams.values()
+        connection = upstream.connection
+        with mock.patch.object(
+                upstream, 'on_message', side_effect=ValueError('Bad')):
+            self.append_line('Line 1')
+            yield gen.sleep(0.05)
+
+        self.append_line('Line 2')
+        received = []
+        while 'Line 2' not in received:
+            response = yield ws_client.read_message()
+            received.extend(response.split('\n'))
+        assert upstream.connection is not connection
+
+    def test_relay_resumes_only_after_receiving_lines(self):
+        filename = os.path.abspath(conftest.DEFAULT_FILENAME)
+        upstream = UpstreamConnection(
+            self.relay_registry, self.get_url('/'), filename)
+        upstream.subscribed = True
+        assert upstream.get_subscription() == {
+            'type': 'subscribe', 'filename': filename}
+
+        upstream.offset = 0
+        assert upstream.get_subscription() == {
+            'type': 'subscribe', 'filename': filename, 'resume_from': 0}
+
+    @tornado.testing.gen_test
+    def test_relay_sends_upstream_errors_to_clients(self):
+        ws_client = yield self.connect_client('some-file')
+        response = yield ws_client.read_message()
+        assert 'error' in response.lower()
+        assert not self.relay_registry.upstreams
+
+    @tornado.testing.gen_test
+    def test_relay_proxies_history_requests(self):
+        lines = ['Line {}'.format(i) for i in range(100)]
+        conftest._create_log_file(
+            write_initial_content=True, initial_content='\n'.join(lines))
+        ws_client = yield self.connect_client()
+        yield ws_client.read_message()
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'history', 'lines': 20, 'skip': 10}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response['type'] == 'history'
+        assert response['lines'] == lines[70:90]
+
+    def test_relay_history_of_files_not_relayed_raises_value_error(self):
+        with pytest.raises(ValueError):
+            self.relay_registry.read_history(conftest.DEFAULT_FILENAME, 10)
+
+    @tornado.testing.gen_test
+    def test_relay_glob_subscriptions(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'app.log')
+        conftest._create_log_file(path)
+        pattern = os.path.join(directory, '*.log')
+
+        ws_client = yield self.connect_client(pattern)
+        response = yield ws_client.read_message()
+        assert response == '<< Tailing 1 files matching {} >>'.format(
+            pattern)
+
+        self.append_line('Test log line', path)
+        response = yield ws_client.read_message()
+        assert response == '==> {} <==\nTest log line'.format(path)
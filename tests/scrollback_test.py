@@ -0,0 +1,64 @@
+"""
+Test suite for the ScrollbackBuffer.
+
+"""
+
+from tailsocket.scrollback import ScrollbackBuffer
+
+
+def test_scrollback_returns_the_last_lines():
+    scrollback = ScrollbackBuffer()
+    scrollback.append('Line 1')
+    scrollback.append('Line 2\nLine 3\nLine 4')
+    scrollback.append('Line 5')
+
+    assert scrollback.get_last_lines(3) == ['Line 3', 'Line 4', 'Line 5']
+    assert scrollback.get_last_lines(10) == [
+        'Line {}'.format(i) for i in range(1, 6)]
+    assert len(scrollback) == 5
+
+
+def test_scrollback_is_bounded_by_lines():
+    scrollback = ScrollbackBuffer(max_lines=3)
+    for i in range(10):
+        scrollback.append('Line {}'.format(i))
+
+    assert scrollback.get_last_lines(10) == ['Line 7', 'Line 8', 'Line 9']
+
+
+def test_scrollback_is_bounded_by_size():
+    scrollback = ScrollbackBuffer(max_bytes=21)
+    for i in range(10):
+        scrollback.append('Line {}'.format(i))
+
+    assert scrollback.get_last_lines(10) == ['Line 7', 'Line 8', 'Line 9']
+    assert scrollback.size <= 21
+
+
+def test_scrollback_clear():
+    scrollback = ScrollbackBuffer()
+    scrollback.append('Line')
+    scrollback.clear()
+
+    assert scrollback.get_last_lines(10) == []
+    assert len(scrollback) == 0
+
+
+def test_scrollback_returns_lines_after_an_offset():
+    scrollback = ScrollbackBuffer(max_lines=4)
+    scrollback.append('Line 0\nLine 1', 14)
+    scrollback.append('Line 2', 21)
+    scrollback.append('Line 3\nLine 4', 35)
+
+    assert scrollback.get_lines_after(21) == ['Line 3', 'Line 4']
+    assert scrollback.get_lines_after(35) == []
+    assert scrollback.get_lines_after(14) == ['Line 2', 'Line 3', 'Line 4']
+    # The first message was evicted
+    assert scrollback.get_lines_after(0) is None
+
+
+def test_scrollback_without_offsets_cannot_resume():
+    scrollback = ScrollbackBuffer()
+    scrollback.append('Line 0')
+
+    assert scrollback.get_lines_after(0) is None
@@ -0,0 +1,241 @@
+"""
+Test suite for the SendQueue.
+
+"""
+
+import logging
+from unittest import mock
+
+import pytest
+
+from tailsocket import send_queue
+from tailsocket.broadcast import BroadcastMessage
+from tailsocket.channels import format_channel_message
+from tailsocket.log import RateLimitedLog
+
+
+class FakeFuture():
+    """Minimal future resolved manually, running callbacks synchronously.
+
+    """
+
+    def __init__(self):
+        self._done = False
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def add_done_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def set_result(self, result):
+        self._done = True
+        for callback in self._callbacks:
+            callback(self)
+
+
+class FakeConnection():
+    """Connection whose writes stay pending until `drain` is called.
+
+    """
+
+    def __init__(self):
+        self.written = []
+        self.future = None
+        self.close = mock.MagicMock()
+
+    def write(self, message, binary=False):
+        self.written.append(message)
+        self.future = FakeFuture()
+        return self.future
+
+    def writing(self):
+        return not self.future.done()
+
+    def drain(self):
+        self.future.set_result(None)
+
+
+def create_queue(max_bytes=20, policy=send_queue.DROP_OLDEST):
+    connection = FakeConnection()
+    queue = send_queue.SendQueue(
+        connection.write, connection.writing, connection.close,
+        max_bytes=max_bytes, policy=policy)
+    return queue, connection
+
+
+def test_send_queue_writes_straight_away_when_idle():
+    queue, connection = create_queue()
+    queue.put('First')
+
+    assert connection.written == ['First']
+    assert len(queue) == 0
+
+
+def test_send_queue_queues_while_a_write_is_pending():
+    queue, connection = create_queue()
+    queue.put('First')
+    queue.put('Second')
+    queue.put('Third')
+
+    assert connection.written == ['First']
+    assert queue.get_stats()['queued_messages'] == 2
+    assert queue.get_stats()['queued_bytes'] == len('SecondThird')
+
+    connection.drain()
+
+    assert connection.written == ['First', 'Second', 'Third']
+    assert queue.queued_bytes == 0
+
+
+def test_send_queue_drop_oldest_policy():
+    queue, connection = create_queue()
+    queue.put('First')
+    for i in range(4):
+        queue.put('Message {}'.format(i))
+
+    connection.drain()
+
+    assert connection.written == ['First', 'Message 2', 'Message 3']
+    assert queue.dropped_messages == 2
+
+
+def test_send_queue_skip_marker_policy():
+    queue, connection = create_queue(policy=send_queue.SKIP_MARKER)
+    queue.put('First')
+    queue.put('Line 1\nLine 2')
+    queue.put('Line 3\nLine 4')
+    queue.put('Line 5')
+
+    connection.drain()
+
+    assert connection.written == [
+        'First', '<< 2 lines skipped >>', 'Line 3\nLine 4', 'Line 5']
+    assert queue.skipped_lines == 0
+
+
+def test_send_queue_counts_the_lines_given_when_queued():
+    message = format_channel_message(1, 'Line 1\nLine 2\nLine 3\nLine 4')
+    queue, connection = create_queue(
+        max_bytes=2 * len(message), policy=send_queue.SKIP_MARKER)
+    queue.put('First')
+    for _ in range(10):
+        queue.put(message, lines=4)
+
+    connection.drain()
+
+    assert connection.written == [
+        'First', '<< 32 lines skipped >>', message, message]
+
+
+def test_send_queue_writes_a_skip_marker_per_channel():
+    connection = FakeConnection()
+    queue = send_queue.SendQueue(
+        connection.write, connection.writing, connection.close,
+        max_bytes=20, policy=send_queue.SKIP_MARKER,
+        format_marker=lambda channel, lines: '{}: {}'.format(channel, lines))
+    queue.put('First')
+    queue.put('Line 1\nLine 2', channel='app')
+    queue.put('Line 1', channel='db')
+    queue.put('Line 3', channel='app')
+    queue.put('Overflowing line', channel='app')
+
+    connection.drain()
+
+    assert connection.written == [
+        'First', 'app: 3', 'db: 1', 'Overflowing line']
+
+
+def test_send_queue_rate_limits_overflow_warnings():
+    logger = mock.Mock()
+    queue, connection = create_queue()
+    queue.put('First')
+    with mock.patch.object(
+            send_queue, 'overflow_log',
+            RateLimitedLog(logger, logging.WARNING, interval=60)):
+        for i in range(10):
+            queue.put('Message {}'.format(i))
+
+    assert queue.dropped_messages == 8
+    assert logger.log.call_count == 1
+
+
+def test_send_queue_disconnect_policy():
+    queue, connection = create_queue(policy=send_queue.DISCONNECT)
+    queue.put('First')
+    queue.put('Message 1')
+    queue.put('Message 2 overflows')
+
+    connection.close.assert_called_once_with()
+    assert len(queue) == 0
+
+
+def test_send_queue_accepts_a_single_big_message():
+    queue, connection = create_queue()
+    queue.put('First')
+    queue.put('A message bigger than the queue')
+
+    connection.drain()
+
+    assert connection.written[-1] == 'A message bigger than the queue'
+
+
+def test_send_queue_measures_broadcast_messages_by_payload():
+    queue, connection = create_queue()
+    queue.put('First')
+    queue.put(BroadcastMessage('Línea'))
+
+    assert queue.queued_bytes == len('Línea'.encode())
+
+
+def test_send_queue_flushes_if_the_connection_drained_on_its_own():
+    queue, connection = create_queue()
+    queue.put('First')
+    queue.put('Second')
+    connection.future._done = True  # drained without running callbacks
+    queue.put('Third')
+
+    assert connection.written == ['First', 'Second']
+    assert len(queue) == 1
+
+
+def test_send_queue_flushes_if_a_ping_is_written_while_messages_wait():
+    queue, connection = create_queue()
+    with mock.patch('tailsocket.send_queue.IOLoop') as ioloop:
+        queue.put('First')
+        queue.put('Second')
+        # Tornado replaces the write future of the stream, leaving the one
+        # of the queue unresolved
+        connection.write('Ping')
+        connection.drain()
+        assert connection.written == ['First', 'Ping']
+
+        delay, check = ioloop.current().call_later.call_args[0]
+        assert delay == send_queue.DRAIN_CHECK_INTERVAL
+        check()
+
+    assert connection.written == ['First', 'Ping', 'Second']
+    assert len(queue) == 0
+
+
+def test_send_queue_checks_again_while_the_connection_is_writing():
+    queue, connection = create_queue()
+    with mock.patch('tailsocket.send_queue.IOLoop') as ioloop:
+        queue.put('First')
+        queue.put('Second')
+        check = ioloop.current().call_later.call_args[0][1]
+        check()
+
+        assert connection.written == ['First']
+        assert ioloop.current().call_later.call_count == 2
+
+        queue.clear()
+
+    ioloop.current().remove_timeout.assert_called_once_with(
+        ioloop.current().call_later.return_value)
+
+
+def test_send_queue_rejects_unknown_policies():
+    with pytest.raises(ValueError):
+        create_queue(policy='ignore')
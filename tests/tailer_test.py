@@ -0,0 +1,288 @@
+"""
+Test suite for the tailer process and the registry of the workers.
+
+"""
+
+import os
+import sys
+import gzip
+import shutil
+import socket
+import asyncio
+import tempfile
+import selectors
+from unittest import mock
+
+import tornado
+import tornado.websocket
+from tornado import escape, gen, netutil
+from tornado.iostream import IOStream
+from tornado.ioloop import IOLoop
+from tornado.options import options
+from tornado.testing import AsyncHTTPTestCase
+
+from tailsocket import application, log, metrics
+from tailsocket.archives import get_archive_id
+from tailsocket.reader_registries import get_registry
+from tailsocket.reader_registries.remote_reader_registry import (
+    RemoteReaderRegistry)
+from tailsocket.tailer import (
+    FRAME, TailerConnection, TailerServer, encode_frame, read_frame)
+from tests import conftest
+
+
+def read_header(frame):
+    header_length, _ = FRAME.unpack(frame[:FRAME.size])
+    return escape.json_decode(frame[FRAME.size:FRAME.size + header_length])
+
+
+class TailerTests(AsyncHTTPTestCase):
+    """Runs a tailer and a worker application in the same event loop.
+
+    """
+
+    def get_app(self):
+        options.access_log_file_path = 'test.access.log'
+        options.application_log_file_path = 'test.application.log'
+        options.logging = 'debug'
+        log.setup_logging()
+        self.socket_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.socket_dir, 'tailer.sock')
+        self.tailer = TailerServer(get_registry())
+        self.tailer.add_socket(netutil.bind_unix_socket(self.socket_path))
+        self.worker_registries = []
+        self.registry = self.create_worker_registry()
+        return application.TailSocketApplication(registry=self.registry)
+
+    def get_new_ioloop(self):
+        if sys.platform == 'linux':
+            selector = selectors.SelectSelector()
+            loop = asyncio.SelectorEventLoop(selector)
+            asyncio.set_event_loop(loop)
+
+        IOLoop.configure('tornado.platform.asyncio.AsyncIOLoop')
+        return IOLoop.current()
+
+    def tearDown(self):
+        for registry in self.worker_registries:
+            registry.stream.close()
+        self.io_loop.run_sync(lambda: gen.sleep(0.05))
+        self.tailer.stop()
+        shutil.rmtree(self.socket_dir)
+        for path in (
+                options.access_log_file_path,
+                options.application_log_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        super().tearDown()
+
+    def create_worker_registry(self):
+        registry = RemoteReaderRegistry(self.socket_path)
+        registry.connect()
+        self.worker_registries.append(registry)
+        return registry
+
+    @gen.coroutine
+    def connect_client(self, filename=conftest.DEFAULT_FILENAME):
+        ws_url = "ws://localhost:{}/websocket/test_name".format(
+            self.get_http_port())
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        ws_client.write_message(filename)
+        return ws_client
+
+    @gen.coroutine
+    def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            yield gen.sleep(0.01)
+        raise AssertionError('Condition not met')
+
+    @tornado.testing.gen_test
+    def test_frames_are_read_as_encoded(self):
+        left, right = socket.socketpair()
+        writer, reader = IOStream(left), IOStream(right)
+        writer.write(encode_frame({'type': 'lines'}, 'Línea'.encode()))
+        writer.write(encode_frame({'type': 'status'}))
+
+        assert (yield read_frame(reader)) == ({'type': 'lines'}, 'Línea')
+        assert (yield read_frame(reader)) == ({'type': 'status'}, '')
+        writer.close()
+        reader.close()
+
+    @tornado.testing.gen_test
+    def test_worker_connection_ends_when_the_tailer_closes_it(self):
+        registry = RemoteReaderRegistry(self.socket_path)
+        self.worker_registries.append(registry)
+        connection = registry.connect()
+        yield self.wait_for(lambda: len(self.tailer.connections) == 2)
+
+        for tailer_connection in list(self.tailer.connections):
+            tailer_connection.stream.close()
+        yield gen.with_timeout(IOLoop.current().time() + 1, connection)
+        assert registry.stream.closed()
+
+    @tornado.testing.gen_test
+    def test_workers_receive_initial_and_new_lines_from_tailer(self):
+        conftest._create_log_file(write_initial_content=True)
+        ws_client = yield self.connect_client()
+        response = yield ws_client.read_message()
+        assert response == conftest.DEFAULT_TEXT
+
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line', file=fd)
+
+        response = yield ws_client.read_message()
+        assert response == 'Test log line'
+
+    @tornado.testing.gen_test
+    def test_tailer_reads_each_file_once_for_all_workers(self):
+        conftest._create_log_file()
+        other_registry = self.create_worker_registry()
+        handler = mock.Mock()
+        other_registry.add_handler_to_filename(
+            handler, conftest.DEFAULT_FILENAME)
+        ws_clients = []
+        for i in range(2):
+            ws_client = yield self.connect_client()
+            response = yield ws_client.read_message()
+            assert 'empty' in response.lower()
+            ws_clients.append(ws_client)
+
+        tailer_registry = self.tailer.registry
+        filename = os.path.abspath(conftest.DEFAULT_FILENAME)
+        assert len(tailer_registry.readers) == 1
+        assert len(tailer_registry.readers[filename]['handlers']) == 2
+
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line', file=fd)
+
+        for ws_client in ws_clients:
+            response = yield ws_client.read_message()
+            assert response == 'Test log line'
+        yield self.wait_for(lambda: handler.write_message.call_count == 2)
+        assert handler.write_message.call_args[0][0] == 'Test log line'
+
+    @tornado.testing.gen_test
+    def test_later_clients_are_served_from_the_worker_scrollback(self):
+        conftest._create_log_file(write_initial_content=True)
+        ws_client = yield self.connect_client()
+        yield ws_client.read_message()
+        with open(conftest.DEFAULT_FILENAME, 'a') as fd:
+            print('Test log line', file=fd)
+        yield ws_client.read_message()
+
+        other_client = yield self.connect_client()
+        response = yield other_client.read_message()
+        assert response == '\n'.join((conftest.DEFAULT_TEXT, 'Test log line'))
+
+    @tornado.testing.gen_test
+    def test_last_client_leaving_unsubscribes_from_tailer(self):
+        conftest._create_log_file()
+        ws_client = yield self.connect_client()
+        yield ws_client.read_message()
+        assert len(self.tailer.registry.readers) == 1
+
+        ws_client.close()
+        yield self.wait_for(lambda: not self.tailer.registry.readers)
+        assert not self.registry.readers
+
+    @tornado.testing.gen_test
+    def test_tailer_errors_are_sent_to_clients(self):
+        ws_client = yield self.connect_client('some-file')
+        response = yield ws_client.read_message()
+        assert 'error' in response.lower()
+        assert not self.registry.readers
+
+    @tornado.testing.gen_test
+    def test_history_is_read_by_the_tailer(self):
+        lines = ['Line {}'.format(i) for i in range(100)]
+        conftest._create_log_file(
+            write_initial_content=True, initial_content='\n'.join(lines))
+        ws_client = yield self.connect_client()
+        yield ws_client.read_message()
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'history', 'lines': 20, 'skip': 10}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response['type'] == 'history'
+        assert response['lines'] == lines[70:90]
+        assert response['has_more']
+
+    @tornado.testing.gen_test
+    def test_history_of_archives_is_read_by_the_tailer(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'app.log')
+        with gzip.open(path + '.1.gz', 'wt') as fd:
+            print('Archived line', file=fd)
+        conftest._create_log_file(path, write_initial_content=True)
+        ws_client = yield self.connect_client(path)
+        yield ws_client.read_message()
+
+        ws_client.write_message(escape.json_encode(
+            {'type': 'history', 'lines': 20}))
+        response = escape.json_decode((yield ws_client.read_message()))
+        assert response == {
+            'type': 'history', 'lines': ['Archived line', 'Start test log'],
+            'cursor': '{}:0'.format(get_archive_id(os.stat(path + '.1.gz'))),
+            'has_more': False, 'line': None}
+
+    @tornado.testing.gen_test
+    def test_glob_subscriptions_through_tailer(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'app.log')
+        conftest._create_log_file(path)
+        pattern = os.path.join(directory, '*.log')
+
+        ws_clients = []
+        for i in range(2):
+            ws_client = yield self.connect_client(pattern)
+            response = yield ws_client.read_message()
+            assert response == '<< Tailing 1 files matching {} >>'.format(
+                pattern)
+            ws_clients.append(ws_client)
+
+        with open(path, 'a') as fd:
+            print('Test log line', file=fd)
+
+        for ws_client in ws_clients:
+            response = yield ws_client.read_message()
+            assert response == '==> {} <==\nTest log line'.format(path)
+
+
+def test_tailer_drops_lines_while_a_worker_falls_behind():
+    stream = mock.Mock(_write_buffer_size=0)
+    stream.closed.return_value = False
+    connection = TailerConnection(
+        mock.Mock(), stream, max_pending_bytes=100)
+
+    stream._write_buffer_size = 101
+    connection.send({'type': 'lines', 'key': 'a.log'}, b'Line 1\nLine 2')
+    connection.send({'type': 'lines', 'key': 'b.log'}, b'Line 1')
+    connection.send({'type': 'history', 'id': 1, 'page': {}})
+    stream._write_buffer_size = 0
+    connection.send({'type': 'lines', 'key': 'a.log'}, b'Line 3')
+
+    assert [
+        read_header(call[0][0]) for call in stream.write.call_args_list] == [
+            {'type': 'history', 'id': 1, 'page': {}},
+            {'type': 'skipped', 'key': 'a.log', 'lines': 2},
+            {'type': 'skipped', 'key': 'b.log', 'lines': 1},
+            {'type': 'lines', 'key': 'a.log'}]
+
+
+def test_workers_tell_handlers_about_lines_skipped_by_the_tailer():
+    registry = RemoteReaderRegistry('tailer.sock')
+    registry.stream = mock.Mock()
+    handler = mock.Mock()
+    registry.add_handler_to_filename(handler, 'test.log')
+    skipped = metrics.TAILER_SKIPPED_LINES.values[()]
+
+    registry.on_tailer_message(
+        {'type': 'skipped', 'key': os.path.abspath('test.log'),
+         'lines': 3}, '')
+
+    handler.write_message.assert_called_once_with('<< 3 lines skipped >>')
+    assert metrics.TAILER_SKIPPED_LINES.values[()] == skipped + 3